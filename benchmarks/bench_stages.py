@@ -0,0 +1,238 @@
+"""変換の各段階（xmlの解析・配列の作成・結合・terrain rgb・書き出し・投影変換）の処理時間を計測する
+
+Examples:
+    % pipenv run python -m benchmarks.bench_stages --mesh_count 16 --output_json bench.json
+    % pipenv run python -m benchmarks.bench_stages --compare_json bench.json
+
+"""
+import datetime
+import json
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import click
+import numpy as np
+from osgeo import gdal
+
+from benchmarks.fgd_synthetic import PRODUCTS, write_zip
+from convert_fgd_dem.converter import Converter
+from convert_fgd_dem.dem import Dem
+from convert_fgd_dem.geotiff import Geotiff
+from convert_fgd_dem.helpers import warp
+
+
+def _get_max_rss_mb():
+    """プロセス開始からの最大常駐メモリ（MB）を返す"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOSはバイト、Linuxはキロバイト単位
+    if sys.platform == "darwin":
+        return max_rss / 1024 / 1024
+    return max_rss / 1024
+
+
+def measure(func, cells, repeat=3):
+    """関数を繰り返し実行し、処理時間・スループット・メモリ使用量を計測する
+
+    Args:
+        func (callable): 計測する関数（引数なし）
+        cells (int): 1回の実行で処理するセル数
+        repeat (int): 実行回数
+
+    Returns:
+        dict: 計測結果
+
+    Notes:
+        スループットは最速の実行時間から算出する
+        メモリ使用量の計測のため、funcはrepeat + 1回実行される
+        peak_traced_mbはPython・numpyが確保したメモリの最大値で、GDAL内部の確保は含まない
+        max_rss_mbはプロセス全体の最大常駐メモリで、それまでの段階を含めた値になる
+
+    """
+    seconds_list = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds_list.append(time.perf_counter() - start)
+
+    # tracemallocは処理を大きく遅くするので、時間の計測とは別に1回だけ実行する
+    tracemalloc.start()
+    func()
+    peak_traced = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    best_seconds = min(seconds_list)
+    return {
+        "cells": cells,
+        "best_seconds": best_seconds,
+        "mean_seconds": sum(seconds_list) / len(seconds_list),
+        "cells_per_second": cells / best_seconds if best_seconds > 0 else None,
+        "peak_traced_mb": peak_traced / 1024 / 1024,
+        "max_rss_mb": _get_max_rss_mb(),
+    }
+
+
+def run_benchmarks(product="DEM5A", mesh_count=4, repeat=3, work_dir=None):
+    """合成データで各段階の処理時間を計測する
+
+    Args:
+        product (str): "DEM5A" or "DEM10B"
+        mesh_count (int): メッシュ数
+        repeat (int): 各段階の実行回数
+        work_dir (Path): 合成データ・出力の作成先
+
+    Returns:
+        dict: 段階毎の計測結果
+
+    """
+    work_dir = Path(work_dir)
+    zip_path = work_dir / f"synthetic-{product}-{mesh_count}.zip"
+    write_zip(zip_path, product, mesh_count)
+    output_path = work_dir / "GeoTiff"
+
+    x_length, y_length = PRODUCTS[product]["grid"]
+    mesh_cells = x_length * y_length * mesh_count
+
+    xml_paths = Dem.list_xml_paths(zip_path)
+    contents = [Dem.get_xml_content(xml_path) for xml_path in xml_paths]
+    converter = Converter(zip_path, output_path)
+    # 標高値のデコードを含めず結合のみを計測するよう、先に全メッシュをデコードしておく
+    converter.dem.mesh_data_list
+    geo_transform, dem_array, image_x, image_y, _ = converter.make_data_for_geotiff()
+    image_cells = image_x * image_y
+    geotiff = Geotiff(geo_transform, dem_array, image_x, image_y, output_path)
+
+    def make_raster_bands():
+        dst_ds = geotiff.create(3, gdal.GDT_Byte, in_memory=True)
+        geotiff.make_raster_bands(True, 3, dst_ds)
+
+    def write():
+        geotiff.write(1, gdal.GDT_Float32, "output.tif")
+
+    def resample():
+        warp(
+            source_path=output_path / "output.tif",
+            file_name="output_3857.tif",
+            output_path=output_path,
+            epsg="EPSG:3857",
+            no_data_value=-9999)
+
+    stages = {
+        "get_xml_content": (
+            lambda: [Dem.get_xml_content(xml_path) for xml_path in xml_paths],
+            mesh_cells),
+        "get_np_array": (
+            lambda: [Dem._get_np_array(content) for content in contents],
+            mesh_cells),
+        "make_data_for_geotiff": (converter.make_data_for_geotiff, image_cells),
+        "make_raster_bands_rgbify": (make_raster_bands, image_cells),
+        "write": (write, image_cells),
+        "warp": (resample, image_cells),
+    }
+
+    results = {}
+    for name, (func, cells) in stages.items():
+        results[name] = measure(func, cells, repeat)
+        click.echo(
+            f"{name:<26} {results[name]['best_seconds']:8.3f}s "
+            f"{results[name]['cells_per_second'] or 0:14,.0f} cells/s "
+            f"{results[name]['peak_traced_mb']:8.1f} MB")
+    return results
+
+
+def _get_git_commit():
+    """計測したコミットのハッシュ値を返す（gitが使えない場合はNone）"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results):
+    """基準の計測結果と比較して、段階毎の速度比を表示する
+
+    Args:
+        baseline (dict): 基準のJSONの内容
+        results (dict): 今回の段階毎の計測結果
+
+    """
+    click.echo(f"compared with {baseline['meta'].get('commit')}:")
+    for name, result in results.items():
+        base_result = baseline["results"].get(name)
+        if base_result is None:
+            continue
+        speedup = base_result["best_seconds"] / result["best_seconds"]
+        click.echo(f"{name:<26} x{speedup:6.2f}")
+
+
+@click.command()
+@click.option(
+    "--product",
+    type=click.Choice(sorted(PRODUCTS)),
+    default="DEM5A",
+    help="合成するDEMの種類 default=DEM5A",
+)
+@click.option(
+    "--mesh_count",
+    type=int,
+    default=4,
+    help="合成するメッシュ数 default=4",
+)
+@click.option(
+    "--repeat",
+    type=int,
+    default=3,
+    help="各段階の実行回数 default=3",
+)
+@click.option(
+    "--output_json",
+    type=str,
+    default=None,
+    help="計測結果を保存するJSONのパス default=None",
+)
+@click.option(
+    "--compare_json",
+    type=str,
+    default=None,
+    help="比較する基準の計測結果のJSONのパス default=None",
+)
+def main(product, mesh_count, repeat, output_json, compare_json):
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = run_benchmarks(product, mesh_count, repeat, work_dir)
+
+    report = {
+        "meta": {
+            "commit": _get_git_commit(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "product": product,
+            "mesh_count": mesh_count,
+            "repeat": repeat,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "gdal": gdal.__version__,
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+    if compare_json is not None:
+        with open(compare_json, "r", encoding="utf-8") as baseline_file:
+            compare(json.load(baseline_file), results)
+
+    if output_json is not None:
+        with open(output_json, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
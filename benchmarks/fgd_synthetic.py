@@ -0,0 +1,177 @@
+"""ベンチマーク用に、基盤地図情報DEM（DEM5A・DEM10B）形式の合成xmlとzipを作成する"""
+import random
+import zipfile
+
+# 製品毎の「メッシュコードの桁数・グリッドの大きさ・メッシュの大きさ（度）」
+PRODUCTS = {
+    # 3次メッシュ（30秒×45秒）を225×150に分割
+    "DEM5A": {"digits": 8, "grid": (225, 150), "size": (30 / 3600, 45 / 3600)},
+    # 2次メッシュ（5分×7.5分）を1125×750に分割
+    "DEM10B": {"digits": 6, "grid": (1125, 750), "size": (5 / 60, 7.5 / 60)},
+}
+
+XML_HEAD = """<?xml version="1.0" encoding="UTF-8"?>
+<Dataset xmlns="http://fgd.gsi.go.jp/spec/2008/FGD_GMLSchema"
+ xmlns:gml="http://www.opengis.net/gml/3.2" gml:id="Dataset1">
+<gml:description>synthetic</gml:description>
+<DEM gml:id="DEM001">
+<fid>synthetic-{mesh_code}</fid>
+<type>{product}</type>
+<mesh>{mesh_code}</mesh>
+<coverage gml:id="DEM001-3">
+<gml:boundedBy>
+<gml:Envelope srsName="fguuid:jgd2011.bl">
+<gml:lowerCorner>{lower_lat:.9f} {lower_lon:.9f}</gml:lowerCorner>
+<gml:upperCorner>{upper_lat:.9f} {upper_lon:.9f}</gml:upperCorner>
+</gml:Envelope>
+</gml:boundedBy>
+<gml:gridDomain>
+<gml:Grid dimension="2" gml:id="DEM001-4">
+<gml:limits>
+<gml:GridEnvelope>
+<gml:low>0 0</gml:low>
+<gml:high>{high_x} {high_y}</gml:high>
+</gml:GridEnvelope>
+</gml:limits>
+<gml:axisLabels>x y</gml:axisLabels>
+</gml:Grid>
+</gml:gridDomain>
+<gml:rangeSet>
+<gml:DataBlock>
+<gml:rangeParameters>
+<gml:QuantityList uom="DEM構成点"></gml:QuantityList>
+</gml:rangeParameters>
+<gml:tupleList>
+"""
+
+XML_TAIL = """</gml:tupleList>
+</gml:DataBlock>
+</gml:rangeSet>
+<gml:coverageFunction>
+<gml:GridFunction>
+<gml:sequenceRule order="+x-y">Linear</gml:sequenceRule>
+<gml:startPoint>0 0</gml:startPoint>
+</gml:GridFunction>
+</gml:coverageFunction>
+</coverage>
+</DEM>
+</Dataset>
+"""
+
+
+def make_mesh_codes(product, mesh_count):
+    """隣り合うメッシュが並ぶように、メッシュコードのリストを作成する
+
+    Args:
+        product (str): "DEM5A" or "DEM10B"
+        mesh_count (int): メッシュ数
+
+    Returns:
+        list: メッシュコードのリスト
+
+    Notes:
+        1次メッシュ「6441」から順に、2次メッシュは8×8、3次メッシュは10×10で埋めていく
+
+    """
+    mesh_codes = []
+    for index in range(mesh_count):
+        if PRODUCTS[product]["digits"] == 6:
+            first_index, second_index = divmod(index, 64)
+            third_code = ""
+        else:
+            second_total, third_index = divmod(index, 100)
+            first_index, second_index = divmod(second_total, 64)
+            third_code = "%d%d" % divmod(third_index, 10)
+        first_code = "64%02d" % (41 + first_index)
+        second_code = "%d%d" % divmod(second_index, 8)
+        mesh_codes.append(int(first_code + second_code + third_code))
+    return mesh_codes
+
+
+def get_mesh_bounds(mesh_code):
+    """メッシュコードから左下と右上の緯度経度を算出する
+
+    Args:
+        mesh_code (int): 2次メッシュ（6桁）or 3次メッシュ（8桁）のメッシュコード
+
+    Returns:
+        tuple: 左下の緯度・経度、右上の緯度・経度
+
+    """
+    code = str(mesh_code)
+    lat = int(code[:2]) / 1.5 + int(code[4]) * 5 / 60
+    lon = int(code[2:4]) + 100 + int(code[5]) * 7.5 / 60
+    if len(code) == 6:
+        return lat, lon, lat + 5 / 60, lon + 7.5 / 60
+    lat += int(code[6]) * 30 / 3600
+    lon += int(code[7]) * 45 / 3600
+    return lat, lon, lat + 30 / 3600, lon + 45 / 3600
+
+
+def make_xml(mesh_code, product="DEM5A", seed=0, no_data_ratio=0.05):
+    """1メッシュ分の合成xmlを作成する
+
+    Args:
+        mesh_code (int): メッシュコード
+        product (str): "DEM5A" or "DEM10B"
+        seed (int): 標高値の乱数のシード
+        no_data_ratio (float): データなしとする点の割合
+
+    Returns:
+        str: xmlの文字列
+
+    Notes:
+        標高値はなだらかな起伏に乱数を加えたもので、一部の点を「データなし,-9999.」とする
+
+    """
+    x_length, y_length = PRODUCTS[product]["grid"]
+    lower_lat, lower_lon, upper_lat, upper_lon = get_mesh_bounds(mesh_code)
+    rng = random.Random(seed)
+
+    lines = []
+    for y in range(y_length):
+        for x in range(x_length):
+            if rng.random() < no_data_ratio:
+                lines.append("データなし,-9999.")
+            else:
+                height = 500 + 3 * (x - y) + rng.uniform(-2, 2)
+                lines.append("地表面,%.2f" % height)
+
+    return (
+        XML_HEAD.format(
+            mesh_code=mesh_code,
+            product=product,
+            lower_lat=lower_lat,
+            lower_lon=lower_lon,
+            upper_lat=upper_lat,
+            upper_lon=upper_lon,
+            high_x=x_length - 1,
+            high_y=y_length - 1)
+        + "\n".join(lines)
+        + "\n"
+        + XML_TAIL
+    )
+
+
+def write_zip(zip_path, product="DEM5A", mesh_count=4, seed=0):
+    """基盤地図情報のダウンロードファイルと同じ構成の、合成xmlを格納したzipを作成する
+
+    Args:
+        zip_path (Path): 作成するzipのパス
+        product (str): "DEM5A" or "DEM10B"
+        mesh_count (int): メッシュ数
+        seed (int): 標高値の乱数のシード
+
+    Returns:
+        list: 格納したメッシュコードのリスト
+
+    """
+    mesh_codes = make_mesh_codes(product, mesh_count)
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zip_data:
+        for index, mesh_code in enumerate(mesh_codes):
+            code = str(mesh_code)
+            mesh_name = "-".join(filter(None, (code[:4], code[4:6], code[6:])))
+            zip_data.writestr(
+                f"FG-GML-{mesh_name}-{product}-20200101.xml",
+                make_xml(mesh_code, product, seed=seed + index))
+    return mesh_codes
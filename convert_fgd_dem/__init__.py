@@ -1,3 +1,28 @@
-from .converter import Converter
-from .dem import Dem
-from .geotiff import Geotiff
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .converter import Converter  # noqa: F401
+    from .dem import Dem  # noqa: F401
+    from .geotiff import Geotiff, Product  # noqa: F401
+
+# GDAL・NumPyを読み込むモジュールは、属性が参照された時点で読み込む（--helpなどの起動を速くするため）
+_LAZY_ATTRIBUTES = {
+    "Converter": ".converter",
+    "Dem": ".dem",
+    "Geotiff": ".geotiff",
+    "Product": ".geotiff",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(_LAZY_ATTRIBUTES[name], __name__)
+    return getattr(module, name)
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
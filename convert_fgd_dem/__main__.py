@@ -1,6 +1,12 @@
+import json
+import sys
+import time
+
 import click
 
-from convert_fgd_dem import Converter
+from convert_fgd_dem.batch import collect_import_paths, print_summary, run_batch
+from convert_fgd_dem.profiler import NullProfiler, Profiler, json_lines_callback
+from convert_fgd_dem.watch import run_watch
 
 
 @click.command()
@@ -9,7 +15,10 @@ from convert_fgd_dem import Converter
     required=False,
     type=str,
     default="./DEM/FG-GML-6441-32-DEM5A.zip",
-    help="変換対象のパスを指定（「xml」「.xmlが格納されたディレクトリ」「.xmlが格納された.zip」が対象です。） default=./DEM/FG-GML-6441-32-DEM5A.zip",
+    help=(
+        "変換対象のパスを指定（「xml」「.xmlが格納されたディレクトリ」「.xmlが格納された.zip」が対象です。）"
+        " default=./DEM/FG-GML-6441-32-DEM5A.zip"
+    ),
 )
 @click.option(
     "--output_path",
@@ -32,14 +41,307 @@ from convert_fgd_dem import Converter
     default=False,
     help="terrain rgbを作成するか選択 default=False",
 )
-def main(import_path, output_path, output_epsg, rgbify):
-    converter = Converter(
-        import_path=import_path,
-        output_path=output_path,
-        output_epsg=output_epsg,
-        rgbify=rgbify,
-    )
-    converter.dem_to_geotiff()
+@click.option(
+    "--workers",
+    required=False,
+    type=int,
+    default=1,
+    help="xmlの読み込みに使用するプロセス数 default=1",
+)
+@click.option(
+    "--warp_memory_limit",
+    required=False,
+    type=int,
+    default=None,
+    help="投影変換で使用するメモリの上限（MB） default=GDALの既定値",
+)
+@click.option(
+    "--cog",
+    required=False,
+    type=bool,
+    default=False,
+    help="Cloud Optimized GeoTiffとして書き出すか選択 default=False",
+)
+@click.option(
+    "--compress",
+    required=False,
+    type=click.Choice(
+        ["DEFLATE", "ZSTD", "LERC", "LERC_DEFLATE", "LERC_ZSTD", "NONE"]),
+    default="DEFLATE",
+    help="COGの圧縮方式 default=DEFLATE",
+)
+@click.option(
+    "--max_z_error",
+    required=False,
+    type=float,
+    default=None,
+    help="LERC圧縮時の標高値の許容誤差（m）。指定しない場合は可逆 default=None",
+)
+@click.option(
+    "--dem_overview_resampling",
+    required=False,
+    type=str,
+    default="AVERAGE",
+    help="COGのオーバービュー作成時の標高値のリサンプリング方法 default=AVERAGE",
+)
+@click.option(
+    "--rgb_overview_resampling",
+    required=False,
+    type=str,
+    default="NEAREST",
+    help="COGのオーバービュー作成時のterrain rgbのリサンプリング方法 default=NEAREST",
+)
+@click.option(
+    "--cache_dir",
+    required=False,
+    type=str,
+    default=None,
+    help="解析済みメッシュのキャッシュを保存するディレクトリ（指定しない場合はキャッシュを使用しない） default=None",
+)
+@click.option(
+    "--cache_size",
+    required=False,
+    type=int,
+    default=1024,
+    help="キャッシュの合計サイズの上限（MB） default=1024",
+)
+@click.option(
+    "--batch",
+    required=False,
+    type=str,
+    default=None,
+    help=(
+        "複数のzipを一括で変換する場合に指定"
+        "（「zipが格納されたディレクトリ」「zipのパスを1行ずつ記載したファイル」「globのパターン」が対象です。）"
+        " default=None"
+    ),
+)
+@click.option(
+    "--merge",
+    required=False,
+    type=bool,
+    default=False,
+    help="--batchの全てのzipを結合して1つのGeoTiffを「出力先/merged」に出力するか選択 default=False",
+)
+@click.option(
+    "--jobs",
+    required=False,
+    type=int,
+    default=1,
+    help="--batchで同時に変換するプロセス数 default=1",
+)
+@click.option(
+    "--watch",
+    required=False,
+    type=str,
+    default=None,
+    help="指定したディレクトリを監視し、置かれたzipを順に変換し続ける（Ctrl+Cで停止します。） default=None",
+)
+@click.option(
+    "--poll_interval",
+    required=False,
+    type=float,
+    default=2.0,
+    help="--watchでディレクトリを確認する間隔（秒） default=2.0",
+)
+@click.option(
+    "--settle_seconds",
+    required=False,
+    type=float,
+    default=2.0,
+    help="--watchでzipの書き込み完了とみなすまでに、サイズと更新日時が変わらない秒数 default=2.0",
+)
+@click.option(
+    "--max_pending",
+    required=False,
+    type=int,
+    default=None,
+    help="--watchで同時に投入する変換の上限（超えた分は監視するディレクトリで待機します。） default=--jobsの2倍",
+)
+@click.option(
+    "--bbox",
+    required=False,
+    type=str,
+    default=None,
+    help="変換する範囲を「最小経度,最小緯度,最大経度,最大緯度」で指定（範囲と重なるメッシュのみを読み込み、範囲で切り取ります。） default=None",
+)
+@click.option(
+    "--mesh_codes",
+    required=False,
+    type=str,
+    default=None,
+    help="変換するメッシュのメッシュコードを「,」区切りで指定 default=None",
+)
+@click.option(
+    "--resolution",
+    required=False,
+    type=str,
+    default=None,
+    help="2次メッシュと3次メッシュを混在させる場合の出力の解像度（「finest」「coarsest」または秒で指定） default=None",
+)
+@click.option(
+    "--update",
+    required=False,
+    type=bool,
+    default=False,
+    help="既存のGeoTiffのうち、内容が変わったメッシュの範囲のみを書き換えるか選択（投影変換・COGなしの場合のみ） default=False",
+)
+@click.option(
+    "--tile_zoom",
+    required=False,
+    type=str,
+    default=None,
+    help="terrain rgbのXYZタイルを作成する場合のズームレベルを「最小,最大」で指定（「出力先/tiles」に書き出します。） default=None",
+)
+@click.option(
+    "--tile_format",
+    required=False,
+    type=click.Choice(["png", "webp"]),
+    default="png",
+    help="XYZタイルの画像形式 default=png",
+)
+@click.option(
+    "--info",
+    required=False,
+    type=bool,
+    default=False,
+    help="変換せずに、xmlのヘッダーから範囲とメッシュ毎のメタデータをJSONで表示するか選択 default=False",
+)
+@click.option(
+    "--profile",
+    required=False,
+    type=bool,
+    default=False,
+    help="段階毎の処理時間・メモリ使用量・入出力量を集計して表示するか選択（--batch以外） default=False",
+)
+@click.option(
+    "--profile_json",
+    required=False,
+    type=str,
+    default=None,
+    help="段階毎の処理時間などを1行ずつJSONで書き出すファイルのパス（--batch以外） default=None",
+)
+def main(
+        import_path,
+        output_path,
+        output_epsg,
+        rgbify,
+        workers,
+        warp_memory_limit,
+        cog,
+        compress,
+        max_z_error,
+        dem_overview_resampling,
+        rgb_overview_resampling,
+        cache_dir,
+        cache_size,
+        batch,
+        merge,
+        jobs,
+        watch,
+        poll_interval,
+        settle_seconds,
+        max_pending,
+        bbox,
+        mesh_codes,
+        resolution,
+        update,
+        tile_zoom,
+        tile_format,
+        info,
+        profile,
+        profile_json):
+    converter_options = {
+        "output_epsg": output_epsg,
+        "rgbify": rgbify,
+        "workers": workers,
+        "warp_memory_limit": warp_memory_limit,
+        "cog": cog,
+        "compress": compress,
+        "max_z_error": max_z_error,
+        "dem_overview_resampling": dem_overview_resampling,
+        "rgb_overview_resampling": rgb_overview_resampling,
+        "cache_dir": cache_dir,
+        "cache_size": cache_size,
+        "bbox": None if bbox is None else [
+            float(value) for value in bbox.split(",")],
+        "mesh_codes": None if mesh_codes is None else [
+            int(value) for value in mesh_codes.split(",")],
+        "resolution": resolution,
+        "tile_zoom": None if tile_zoom is None else [
+            int(value) for value in tile_zoom.split(",")],
+        "tile_format": tile_format,
+    }
+
+    if info:
+        # 標高値をデコードしないため、GDAL・NumPyを読み込まずに済む
+        from convert_fgd_dem.dem import Dem
+
+        dem = Dem(
+            import_path,
+            bbox=converter_options["bbox"],
+            mesh_codes=converter_options["mesh_codes"],
+            allow_mixed_mesh=True)
+        print(json.dumps(dem.get_info(), ensure_ascii=False, indent=2))
+        return
+
+    if watch is not None:
+        start = time.perf_counter()
+        results = run_watch(
+            watch,
+            output_path,
+            jobs=jobs,
+            poll_interval=poll_interval,
+            settle_seconds=settle_seconds,
+            max_pending=max_pending,
+            **converter_options,
+        )
+        if results:
+            print_summary(results, time.perf_counter() - start)
+        return
+
+    if batch is not None:
+        start = time.perf_counter()
+        results = run_batch(
+            collect_import_paths(batch),
+            output_path,
+            jobs=jobs,
+            merge=merge,
+            **converter_options,
+        )
+        print_summary(results, time.perf_counter() - start)
+        if any(result["status"] == "failed" for result in results):
+            sys.exit(1)
+        return
+
+    from convert_fgd_dem.converter import Converter
+
+    # 計測を指定しない場合は、段階毎の計測を行わない
+    # 集計結果を表示しない場合は、記録を保持せずJSONへの書き出しのみ行う
+    profiler = NullProfiler()
+    if profile or profile_json is not None:
+        profiler = Profiler(keep_records=profile)
+    profile_json_file = None
+    if profile_json is not None:
+        profile_json_file = open(profile_json, "w", encoding="utf-8")
+        profiler.callbacks.append(json_lines_callback(profile_json_file))
+
+    try:
+        with profiler.stage("total"):
+            converter = Converter(
+                import_path=import_path,
+                output_path=output_path,
+                update=update,
+                profiler=profiler,
+                **converter_options,
+            )
+            converter.dem_to_geotiff()
+    finally:
+        if profile_json_file is not None:
+            profile_json_file.close()
+
+    if profile:
+        profiler.print_summary()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,171 @@
+import glob
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+
+def collect_import_paths(batch):
+    """バッチ処理の指定から、変換対象のzipのパスのリストを作成する
+
+    Args:
+        batch (str): 「zipが格納されたディレクトリ」「zipのパスを1行ずつ記載したファイル」「globのパターン」のいずれか
+
+    Returns:
+        list: 変換対象のzipのパスのリスト
+
+    Notes:
+        ファイルに記載された相対パスは、そのファイルが格納されたディレクトリからのパスとして扱う
+        「#」から始まる行と空行は無視する
+
+    """
+    batch_path = Path(batch)
+    if batch_path.is_dir():
+        import_paths = sorted(batch_path.glob("*.zip"))
+
+    elif batch_path.is_file() and not batch_path.suffix == ".zip":
+        import_paths = []
+        with batch_path.open("r", encoding="utf-8") as manifest:
+            for line in manifest:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                import_path = Path(line)
+                if not import_path.is_absolute():
+                    import_path = batch_path.parent / import_path
+                import_paths.append(import_path)
+
+    else:
+        import_paths = [Path(path) for path in sorted(glob.glob(batch))]
+
+    if not import_paths:
+        raise Exception(f"変換対象のzipが存在しません：{batch}")
+    return import_paths
+
+
+def _convert(import_path, output_path, converter_options):
+    """1つのジョブを変換し、完了後に出力先へ移動する
+
+    Args:
+        import_path (Path or list): 変換対象のパス（結合する場合はそのリスト）
+        output_path (Path): 出力先のディレクトリ
+        converter_options (dict): Converterに渡すオプション
+
+    Returns:
+        float: 変換にかかった秒数
+
+    Notes:
+        途中で中断した場合に不完全な出力が残らないよう、一時ディレクトリに出力してから名前を変更する
+
+    """
+    # GDAL・NumPyの読み込みは、変換するプロセスで変換時にのみ行う
+    from convert_fgd_dem.converter import Converter
+
+    start = time.perf_counter()
+
+    partial_path = output_path.parent / f".{output_path.name}.partial"
+    if partial_path.exists():
+        shutil.rmtree(partial_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    converter = Converter(
+        import_path=import_path,
+        output_path=partial_path,
+        **converter_options)
+    converter.dem_to_geotiff()
+    partial_path.rename(output_path)
+
+    return time.perf_counter() - start
+
+
+def run_batch(
+        import_paths,
+        output_path,
+        jobs=1,
+        merge=False,
+        **converter_options):
+    """複数のzipをプロセスプールで変換する
+
+    Args:
+        import_paths (list): 変換対象のzipのパスのリスト
+        output_path (Path): 出力先のディレクトリ
+        jobs (int): 同時に変換するプロセス数
+        merge (bool): Trueの場合は全てのzipを結合して1つのGeoTiffを出力する
+        **converter_options: Converterに渡すオプション
+
+    Returns:
+        list: ジョブ毎の「名前・状態・秒数」の辞書のリスト
+
+    Notes:
+        merge=Falseの場合はzip毎に「出力先/zipのファイル名（拡張子なし）」に、
+        merge=Trueの場合は「出力先/merged」に出力する
+        出力先がすでに存在するジョブは完了済みとしてスキップするので、中断後に同じ指定で再実行すると続きから処理できる
+        merge=Falseで拡張子を除いたファイル名が重複するzipがある場合は、出力先が重なるためエラーとする
+
+    """
+    output_path = Path(output_path)
+    if merge:
+        # 結合する場合はzipの読み込みをプロセス数分並列化する
+        converter_options["workers"] = max(
+            jobs, converter_options.get("workers", 1))
+        job_list = [("merged", list(import_paths), output_path / "merged")]
+        jobs = 1
+    else:
+        job_list = [
+            (Path(import_path).stem, Path(import_path),
+             output_path / Path(import_path).stem)
+            for import_path in import_paths
+        ]
+        job_names = [name for name, _, _ in job_list]
+        duplicated_names = sorted(
+            {name for name in job_names if job_names.count(name) > 1})
+        if duplicated_names:
+            raise Exception(
+                f"ファイル名（拡張子なし）が重複するzipがあります：{', '.join(duplicated_names)}")
+
+    # ジョブの添字毎の結果（指定された順に並べるため）
+    results = {}
+    pending = []
+    for index, (name, import_path, job_output_path) in enumerate(job_list):
+        if job_output_path.exists():
+            results[index] = {"name": name, "status": "skipped", "seconds": 0.0}
+        else:
+            pending.append((index, name, import_path, job_output_path))
+
+    with ProcessPoolExecutor(max_workers=max(1, min(jobs, len(pending)))) as executor:
+        futures = [
+            (index, name, executor.submit(
+                _convert, import_path, job_output_path, converter_options))
+            for index, name, import_path, job_output_path in pending
+        ]
+        for index, name, future in futures:
+            try:
+                seconds = future.result()
+                results[index] = {"name": name, "status": "done", "seconds": seconds}
+            except Exception as e:
+                print(f"変換に失敗しました：{name}：{e}")
+                results[index] = {"name": name, "status": "failed", "seconds": 0.0}
+
+    return [results[index] for index in sorted(results)]
+
+
+def print_summary(results, total_seconds):
+    """ジョブ毎の処理時間の一覧を表示する
+
+    Args:
+        results (list): run_batchの戻り値
+        total_seconds (float): 全体の処理時間
+
+    """
+    name_width = max([len(result["name"]) for result in results] + [4])
+    for result in results:
+        print(
+            f"{result['name']:<{name_width}}  {result['status']:<7}  "
+            f"{result['seconds']:8.2f}s")
+    counts = {
+        status: len([result for result in results if result["status"] == status])
+        for status in ("done", "skipped", "failed")
+    }
+    print(
+        f"done={counts['done']} skipped={counts['skipped']} "
+        f"failed={counts['failed']} total={total_seconds:.2f}s")
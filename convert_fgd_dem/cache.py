@@ -0,0 +1,259 @@
+import dataclasses
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from convert_fgd_dem.dem import MeshData
+from convert_fgd_dem.mesh_index import content_hash
+
+# キャッシュの形式を変更した場合に古いキャッシュを使わないよう、キーに含めるバージョン
+CACHE_VERSION = 3
+
+
+class MeshCache:
+    """解析済みのメッシュ（メタデータと標高値）をディスクにキャッシュするクラス
+
+    Notes:
+        メッシュ毎に「<キー>.npy」（標高値）と「<キー>.json」（メタデータ）を保存する
+        キーはxmlを読み込まずに作成する（zip内のxmlはCRC32とサイズ、xmlファイルはパス・サイズ・更新日時）
+        合計サイズが上限を超えた場合は、最後に利用された日時が古いものから削除する
+        キャッシュの一覧と合計サイズは作成時に1度だけディレクトリを走査して保持し、以降は削除する場合のみディスクを操作する
+        そのため、他のプロセスが追加したキャッシュは、次に作成したインスタンスから合計サイズに含まれる
+
+    """
+
+    def __init__(self, cache_dir, max_size=1024):
+        """イニシャライザ
+
+        Args:
+            cache_dir (Path): キャッシュを保存するディレクトリ
+            max_size (int): キャッシュの合計サイズの上限（MB）
+
+        """
+        self.cache_dir: Path = Path(cache_dir)
+        self.max_size: int = max_size
+        # キー → 標高値のサイズ（最後に利用された日時が古い順）
+        self._entries: OrderedDict = OrderedDict()
+        self._total_size: int = 0
+        self._lock = threading.Lock()
+        self._scan()
+
+    @staticmethod
+    def make_key(xml_path, mesh_code):
+        """xmlを読み込まずにキャッシュのキーを作成する
+
+        Args:
+            xml_path (Path or ZipMember): xmlのパスオブジェクト
+            mesh_code (int): ヘッダーから読み込んだメッシュコード
+
+        Returns:
+            str: キャッシュのキー
+
+        Notes:
+            zip内のxmlはセントラルディレクトリのCRC32とサイズ、xmlファイルはパス・サイズ・更新日時から作成する
+            CRC32が記録されていないxmlのみ、内容を読み込んでハッシュ値を算出する
+
+        """
+        crc = getattr(xml_path, "crc", None)
+        if crc is not None:
+            identity = f"{crc:08x}-{xml_path.file_size}"
+        elif isinstance(xml_path, Path):
+            stat = xml_path.stat()
+            file_id = f"{xml_path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+            identity = hashlib.sha256(file_id.encode("utf-8")).hexdigest()[:16]
+        else:
+            identity = content_hash(xml_path)
+        return f"v{CACHE_VERSION}-{mesh_code}-{identity}"
+
+    def _scan(self):
+        """キャッシュのディレクトリを走査して、キャッシュの一覧と合計サイズを作成する"""
+        entries = []
+        if self.cache_dir.is_dir():
+            for array_path in self.cache_dir.glob("*.npy"):
+                if array_path.name.endswith(".tmp.npy"):
+                    continue
+                try:
+                    stat = array_path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, array_path.stem, stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._total_size += size
+
+    def _get_paths(self, key):
+        """キーに対応する標高値とメタデータのパスを返す
+
+        Args:
+            key (str): キャッシュのキー
+
+        Returns:
+            tuple: 標高値（.npy）とメタデータ（.json）のパス
+
+        """
+        return self.cache_dir / f"{key}.npy", self.cache_dir / f"{key}.json"
+
+    def get(self, key):
+        """キャッシュからメッシュを読み込む
+
+        Args:
+            key (str): キャッシュのキー
+
+        Returns:
+            MeshData or None: キャッシュが存在しない場合はNone
+
+        Notes:
+            標高値はメモリマップで読み込むため、実際に参照されるまでディスクから読み込まれない
+
+        """
+        array_path, meta_data_path = self._get_paths(key)
+        try:
+            with meta_data_path.open("r", encoding="utf-8") as meta_data_file:
+                meta_data = json.load(meta_data_file)
+            np_array = np.load(array_path, mmap_mode="r")
+            # 最後に利用された日時を更新する（削除する順番の判定に使用する）
+            os.utime(array_path)
+            os.utime(meta_data_path)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                # 他のプロセスが追加したキャッシュ
+                self._add_entry(key, array_path.stat().st_size)
+        return MeshData(**meta_data, np_array=np_array)
+
+    def put(self, key, mesh_data):
+        """メッシュをキャッシュに保存する
+
+        Args:
+            key (str): キャッシュのキー
+            mesh_data (MeshData): 保存するメッシュ
+
+        Notes:
+            書き込み途中のファイルを読み込まないよう、一時ファイルに書き込んでから置き換える
+            メタデータを後に書き込むので、メタデータが存在すれば標高値も書き込み済みとなる
+
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        array_path, meta_data_path = self._get_paths(key)
+        pid = os.getpid()
+
+        tmp_array_path = self.cache_dir / f"{key}.{pid}.tmp.npy"
+        np.save(tmp_array_path, mesh_data.np_array)
+        os.replace(tmp_array_path, array_path)
+
+        meta_data = {
+            field.name: getattr(mesh_data, field.name)
+            for field in dataclasses.fields(mesh_data)
+            if not field.name == "np_array"
+        }
+        tmp_meta_data_path = self.cache_dir / f"{key}.{pid}.tmp.json"
+        with tmp_meta_data_path.open("w", encoding="utf-8") as meta_data_file:
+            json.dump(meta_data, meta_data_file)
+        os.replace(tmp_meta_data_path, meta_data_path)
+
+        with self._lock:
+            self._add_entry(key, array_path.stat().st_size)
+            self._evict()
+
+    def _add_entry(self, key, size):
+        """キャッシュの一覧の末尾（最後に利用されたもの）に追加し、合計サイズを更新する
+
+        Args:
+            key (str): キャッシュのキー
+            size (int): 標高値のファイルのサイズ（バイト）
+
+        """
+        self._total_size -= self._entries.pop(key, 0)
+        self._entries[key] = size
+        self._total_size += size
+
+    def _evict(self):
+        """合計サイズが上限を超えている場合、最後に利用された日時が古いものから削除する"""
+        max_size_bytes = self.max_size * 1024 * 1024
+        while self._total_size > max_size_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_size -= size
+            # 他のプロセスが同時に削除している場合もあるので、存在しなくてもエラーにしない
+            for path in reversed(self._get_paths(key)):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MemoryMeshCache:
+    """解析済みのメッシュをメモリ上にキャッシュするクラス（MeshCacheと同じmake_key・get・putで扱える）
+
+    Notes:
+        標高値の合計サイズが上限を超えた場合は、最後に利用されたのが古いものから破棄する
+        スレッド間では共有できるが、プロセス間では共有できない（Demはキャッシュの読み書きを親プロセスで行うため、workersの指定に関わらず使用できる）
+        複数の変換で同じ配列を参照するため、保存した標高値は書き換えられないようにする
+
+    """
+
+    def __init__(self, max_size=256):
+        """イニシャライザ
+
+        Args:
+            max_size (int): キャッシュの合計サイズの上限（MB）
+
+        """
+        self.max_size: int = max_size
+        self._entries: OrderedDict = OrderedDict()
+        self._total_size: int = 0
+        self._lock = threading.Lock()
+
+    make_key = staticmethod(MeshCache.make_key)
+
+    def get(self, key):
+        """キャッシュからメッシュを取り出す
+
+        Args:
+            key (str): キャッシュのキー
+
+        Returns:
+            MeshData or None: キャッシュが存在しない場合はNone
+
+        """
+        with self._lock:
+            mesh_data = self._entries.get(key)
+            if mesh_data is not None:
+                self._entries.move_to_end(key)
+        return mesh_data
+
+    def put(self, key, mesh_data):
+        """メッシュをキャッシュに保存する
+
+        Args:
+            key (str): キャッシュのキー
+            mesh_data (MeshData): 保存するメッシュ
+
+        """
+        mesh_data.np_array.flags.writeable = False
+        with self._lock:
+            if key in self._entries:
+                self._total_size -= self._entries[key].np_array.nbytes
+            self._entries[key] = mesh_data
+            self._entries.move_to_end(key)
+            self._total_size += mesh_data.np_array.nbytes
+
+            max_size_bytes = self.max_size * 1024 * 1024
+            while self._total_size > max_size_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_size -= evicted.np_array.nbytes
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,10 +1,16 @@
+import math
+import tempfile
 from pathlib import Path
 
 import numpy as np
-from osgeo import gdal
+from osgeo import osr
 
+from convert_fgd_dem.cache import MeshCache
 from convert_fgd_dem.dem import Dem
-from convert_fgd_dem.geotiff import Geotiff
+from convert_fgd_dem.geotiff import Geotiff, Product
+from convert_fgd_dem.helpers import average_sums, sum_to_grid, warp
+from convert_fgd_dem.profiler import NullProfiler, Profiler
+from convert_fgd_dem.tiles import generate_tiles
 
 
 class Converter:
@@ -15,168 +21,953 @@ class Converter:
     def __init__(
             self,
             import_path,
-            output_path,
+            output_path=None,
             output_epsg="EPSG:4326",
-            rgbify=False):
-        self.import_path: Path = Path(import_path)
-        self.output_path: Path = Path(output_path)
+            rgbify=False,
+            workers=1,
+            memmap_dir=None,
+            warp_memory_limit=None,
+            cog=False,
+            compress="DEFLATE",
+            max_z_error=None,
+            dem_overview_resampling="AVERAGE",
+            rgb_overview_resampling="NEAREST",
+            cache_dir=None,
+            cache_size=1024,
+            cache=None,
+            bbox=None,
+            mesh_codes=None,
+            update=False,
+            profiler=None,
+            resolution=None,
+            tile_zoom=None,
+            tile_format="png"):
+        # 複数の入力を1つに結合する場合はパスのリストを受け付ける
+        if isinstance(import_path, (list, tuple)):
+            self.import_path: list = [Path(path) for path in import_path]
+        else:
+            self.import_path: Path = Path(import_path)
+        # to_array・to_datasetのみを使用する場合は、出力先を指定しなくてよい
+        self.output_path: Path = None if output_path is None else Path(output_path)
         if not output_epsg.startswith("EPSG:"):
             raise Exception("EPSGコードの指定が不正です。EPSG:〇〇の形式で入力してください")
         self.output_epsg: str = output_epsg
         self.rgbify: bool = rgbify
 
-        self.dem = Dem(self.import_path)
+        self.workers: int = workers
+        # 指定された場合、make_data_for_geotiffの配列をメモリではなくこのディレクトリ内の一時ファイルに作成する
+        self.memmap_dir: Path = None if memmap_dir is None else Path(memmap_dir)
+        # 投影変換で使用するメモリの上限（MB）
+        self.warp_memory_limit: int = warp_memory_limit
+        # Cloud Optimized GeoTiffとして書き出す場合の設定
+        self.cog: bool = cog
+        self.compress: str = compress
+        self.max_z_error: float = max_z_error
+        self.dem_overview_resampling: str = dem_overview_resampling
+        self.rgb_overview_resampling: str = rgb_overview_resampling
+
+        # 解析済みメッシュのキャッシュ（cache_dirが指定された場合のみ使用する）
+        # cacheを指定した場合は、MeshCacheの代わりにそのキャッシュ（MemoryMeshCacheなど）を使用する
+        self.cache: MeshCache = cache
+        if cache is None and cache_dir is not None:
+            self.cache = MeshCache(cache_dir, max_size=cache_size)
+
+        # 範囲（最小経度, 最小緯度, 最大経度, 最大緯度）・メッシュコードで変換対象を絞り込む場合の設定
+        if bbox is not None:
+            bbox = tuple(float(value) for value in bbox)
+            if not len(bbox) == 4 or bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+                raise Exception(
+                    f"範囲の指定が不正です。最小経度,最小緯度,最大経度,最大緯度の順に指定してください。bbox={bbox}")
+        self.bbox: tuple = bbox
+        self.mesh_codes: list = mesh_codes
+
+        # 更新モードでは、既存の成果物のうち内容が変わったメッシュの範囲のみを書き換える
+        self.update: bool = update
+        # 出力に含めるメッシュのメッシュコードとxmlの内容のハッシュ値（書き出し時に、解析したxmlから記録する）
+        self.mesh_hashes: dict = {}
+        # 段階毎の処理時間などの記録（指定しない場合は計測しない）
+        self.profiler: Profiler = NullProfiler() if profiler is None else profiler
+
+        # 出力の解像度（"finest"・"coarsest"・秒）。指定した場合は2次メッシュと3次メッシュを混在させられる
+        if resolution is not None and resolution not in ("finest", "coarsest"):
+            resolution = float(resolution)
+            if resolution <= 0:
+                raise Exception(f"解像度は正の値（秒）を指定してください。resolution={resolution}")
+        self.resolution = resolution
+
+        # 指定された場合、terrain rgbのXYZタイル（最小ズームレベル, 最大ズームレベル）を書き出す
+        if tile_zoom is not None:
+            tile_zoom = tuple(int(zoom) for zoom in tile_zoom)
+            if not len(tile_zoom) == 2 or not 0 <= tile_zoom[0] <= tile_zoom[1]:
+                raise Exception(
+                    f"ズームレベルの指定が不正です。最小ズームレベル,最大ズームレベルの順に指定してください。tile_zoom={tile_zoom}")
+        self.tile_zoom: tuple = tile_zoom
+        self.tile_format: str = tile_format
+
+        # xmlのヘッダーのみを読み込む（標高値は書き込み時にメッシュ毎にデコードする）
+        self.dem: Dem = Dem(
+            self.import_path,
+            workers=self.workers,
+            cache=self.cache,
+            bbox=self.bbox,
+            mesh_codes=self.mesh_codes,
+            profiler=self.profiler,
+            allow_mixed_mesh=self.resolution is not None)
+        if self.resolution is None:
+            self.pixel_size: dict = self.dem.index_entries[0].pixel_size
+            self.bounds_latlng: dict = self._calc_bounds_latlng(
+                self.dem.bounds_latlng)
+        else:
+            self.pixel_size: dict = self._calc_target_pixel_size()
+            self.bounds_latlng: dict = self._calc_bounds_latlng(
+                self._snap_bounds_to_grid(self.dem.bounds_latlng))
+
+    def _calc_target_pixel_size(self):
+        """resolutionの指定から出力のピクセルサイズを算出する
+
+        Returns:
+            dict: x/y方向のピクセルサイズ（度）。yはメッシュのピクセルサイズと同じく負の値
+
+        Notes:
+            xmlの緯度経度の丸め誤差を除くため、メッシュのピクセルサイズは秒単位で小数点以下6桁に丸める
+
+        """
+        if self.resolution in ("finest", "coarsest"):
+            select = min if self.resolution == "finest" else max
+            x_pixel_size, y_pixel_size = [
+                round(
+                    select([abs(entry.pixel_size[axis])
+                            for entry in self.dem.index_entries]) * 3600,
+                    6) / 3600
+                for axis in ("x", "y")
+            ]
+        else:
+            x_pixel_size = y_pixel_size = self.resolution / 3600
+        return {"x": x_pixel_size, "y": -y_pixel_size}
+
+    def _snap_bounds_to_grid(self, mesh_bounds_latlng):
+        """メッシュの範囲を、出力のピクセルの境界に合うよう外側に広げる
+
+        Args:
+            mesh_bounds_latlng (dict): 全メッシュを包括する左下と右上の緯度経度
+
+        Returns:
+            dict: 広げた左下と右上の緯度経度
+
+        Notes:
+            ピクセルの境界はメッシュの原点（経度100度・緯度0度）から数えるため、
+            2次メッシュ・3次メッシュの境界は解像度に関わらずピクセルの境界と一致する（3次メッシュを10mにする場合を除く）
+
+        """
+        # 浮動小数点の誤差でピクセルが1つ広がらないよう、わずかに許容する
+        epsilon = 1e-6
+        origin = {"lon": 100.0, "lat": 0.0}
+        pixel_size = {"lon": self.pixel_size["x"], "lat": abs(self.pixel_size["y"])}
+
+        snapped = {"lower_left": {}, "upper_right": {}}
+        for axis in ("lat", "lon"):
+            lower = (mesh_bounds_latlng["lower_left"][axis] - origin[axis]) / pixel_size[axis]
+            upper = (mesh_bounds_latlng["upper_right"][axis] - origin[axis]) / pixel_size[axis]
+            snapped["lower_left"][axis] = (
+                origin[axis] + math.floor(lower + epsilon) * pixel_size[axis])
+            snapped["upper_right"][axis] = (
+                origin[axis] + math.ceil(upper - epsilon) * pixel_size[axis])
+        return snapped
+
+    def _calc_bounds_latlng(self, mesh_bounds_latlng):
+        """出力画像の範囲の緯度経度を算出する
+
+        Args:
+            mesh_bounds_latlng (dict): 全メッシュを包括する左下と右上の緯度経度
+
+        Returns:
+            dict: 出力画像の左下と右上の緯度経度
+
+        Notes:
+            bboxが指定された場合は、メッシュの範囲をbboxで切り取り、ピクセルの境界に合うよう外側に広げる
+            bboxが指定されていない場合はメッシュの範囲をそのまま返す
+
+        """
+        if self.bbox is None:
+            return mesh_bounds_latlng
+
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        x_pixel_size = self.pixel_size["x"]
+        y_pixel_size = abs(self.pixel_size["y"])
+        origin_lon = mesh_bounds_latlng["lower_left"]["lon"]
+        origin_lat = mesh_bounds_latlng["lower_left"]["lat"]
+        # 浮動小数点の誤差でピクセルが1つ広がらないよう、わずかに許容する
+        epsilon = 1e-6
+
+        def snap(value, origin, pixel_size, limit, upper):
+            pixels = (value - origin) / pixel_size
+            if upper:
+                pixels = math.ceil(pixels - epsilon)
+            else:
+                pixels = math.floor(pixels + epsilon)
+            return origin + min(max(pixels, 0), limit) * pixel_size
+
+        x_limit = round(
+            (mesh_bounds_latlng["upper_right"]["lon"] - origin_lon) / x_pixel_size)
+        y_limit = round(
+            (mesh_bounds_latlng["upper_right"]["lat"] - origin_lat) / y_pixel_size)
+
+        return {
+            "lower_left": {
+                "lat": snap(min_lat, origin_lat, y_pixel_size, y_limit, False),
+                "lon": snap(min_lon, origin_lon, x_pixel_size, x_limit, False),
+            },
+            "upper_right": {
+                "lat": snap(max_lat, origin_lat, y_pixel_size, y_limit, True),
+                "lon": snap(max_lon, origin_lon, x_pixel_size, x_limit, True),
+            },
+        }
 
     def _calc_image_size(self):
-        """Dem境界の緯度経度とピクセルサイズから出力画像の大きさを算出する
+        """出力範囲の緯度経度とピクセルサイズから出力画像の大きさを算出する
 
         Returns:
             tuple: x/y方向の画像の大きさ
 
         """
-        lower_left_lat = self.dem.bounds_latlng["lower_left"]["lat"]
-        lower_left_lon = self.dem.bounds_latlng["lower_left"]["lon"]
-        upper_right_lat = self.dem.bounds_latlng["upper_right"]["lat"]
-        upper_right_lon = self.dem.bounds_latlng["upper_right"]["lon"]
+        lower_left_lat = self.bounds_latlng["lower_left"]["lat"]
+        lower_left_lon = self.bounds_latlng["lower_left"]["lon"]
+        upper_right_lat = self.bounds_latlng["upper_right"]["lat"]
+        upper_right_lon = self.bounds_latlng["upper_right"]["lon"]
 
         x_length = round(
             abs(
                 (upper_right_lon - lower_left_lon)
-                / self.dem.meta_data_list[0]["pixel_size"]["x"]
+                / self.pixel_size["x"]
             )
         )
         y_length = round(
             abs(
                 (upper_right_lat - lower_left_lat)
-                / self.dem.meta_data_list[0]["pixel_size"]["y"]
+                / self.pixel_size["y"]
             )
         )
 
         return x_length, y_length
 
-    def _combine_meta_data_and_contents(self):
-        """メッシュコードが同一のメタデータと標高値を結合する
+    def _calc_geo_transform(self, x_length, y_length):
+        """出力画像の大きさからGeoTiffのgeo_transformを算出する
+
+        Args:
+            x_length (int): x方向の画像の大きさ
+            y_length (int): y方向の画像の大きさ
 
         Returns:
+            list: GdalのDatasetクラスでSetGeoTransformするための情報
+
+        """
+        x_pixel_size = (
+            self.bounds_latlng["upper_right"]["lon"]
+            - self.bounds_latlng["lower_left"]["lon"]
+        ) / x_length
+        y_pixel_size = (
+            self.bounds_latlng["lower_left"]["lat"]
+            - self.bounds_latlng["upper_right"]["lat"]
+        ) / y_length
+
+        geo_transform = [
+            self.bounds_latlng["lower_left"]["lon"],
+            x_pixel_size,
+            0,
+            self.bounds_latlng["upper_right"]["lat"],
+            0,
+            y_pixel_size,
+        ]
+        return geo_transform
+
+    def _iter_mesh_windows(self, geo_transform, x_length, y_length, mesh_codes=None):
+        """メッシュ毎に、出力画像内での書き込み位置と標高値を返す
+
+        Args:
+            geo_transform (list): 出力画像のgeo_transform
+            x_length (int): x方向の画像の大きさ
+            y_length (int): y方向の画像の大きさ
+            mesh_codes (list): 指定した場合はこのメッシュコードのメッシュのみを返す
+
+        Yields:
+            tuple: 書き込み開始位置の列・行と標高値（np.array）
+
+        Notes:
+            出力画像からはみ出す部分は切り取り、出力画像と重ならないメッシュは返さない
+            resolutionが指定された場合は、メッシュを出力のピクセルサイズに変換してから返す
+            メッシュコード順では2次メッシュ（6桁）が3次メッシュ（8桁）より先になるため、粗いメッシュから順に返る
+            出力画像と重ならないメッシュも含め、デコードしたメッシュのハッシュ値をmesh_hashesに記録する
 
         """
-        mesh_data_list = []
+        x_pixel_size = geo_transform[1]
+        y_pixel_size = geo_transform[5]
+        # メッシュの境界をまたぐ出力の行・列・セルの、メッシュの種類毎の合計とセル数（resolution指定時のみ使用する）
+        # 境界を共有する全てのメッシュを合計した時点で取り除かれる
+        seam_cells = {}
+
+        # メッシュコード順に、メッシュを1つずつデコードして取り出す
+        for data in self.dem.iter_mesh_data(mesh_codes):
+            self.mesh_hashes[data.mesh_code] = data.content_hash
+            if self.resolution is not None:
+                column_start, row_start, np_array = self._resample_mesh(
+                    data, geo_transform, seam_cells)
+                yield from self._clip_window(
+                    column_start, row_start, np_array, x_length, y_length)
+                continue
+
+            # 読み込んだarrayの左下の座標を取得
+            lower_left_lat = data.lower_corner["lat"]
+            lower_left_lon = data.lower_corner["lon"]
+
+            # (0, 0)からの距離を算出
+            lat_distance = lower_left_lat - \
+                self.bounds_latlng["lower_left"]["lat"]
+            lon_distance = lower_left_lon - \
+                self.bounds_latlng["lower_left"]["lon"]
 
-        # 辞書のリストをメッシュコードをKeyにしてソート
-        sort_metadata_list = sorted(
-            self.dem.meta_data_list, key=lambda x: x["mesh_code"]
+            # numpy上の座標を取得(ピクセルサイズが少数のため誤差が出るから四捨五入)
+            x_coordinate = round(lon_distance / x_pixel_size)
+            y_coordinate = round(lat_distance / (-y_pixel_size))
+
+            # 書き込みを開始する行と列を算出
+            row_start = int(y_length - (y_coordinate + data.grid_length["y"]))
+            column_start = int(x_coordinate)
+
+            yield from self._clip_window(
+                column_start, row_start, data.np_array, x_length, y_length)
+
+    @staticmethod
+    def _clip_window(column_start, row_start, np_array, x_length, y_length):
+        """出力画像に収まる部分のみを切り出す
+
+        Args:
+            column_start (int): 書き込みを開始する列
+            row_start (int): 書き込みを開始する行
+            np_array (numpy.ndarray): 標高値の配列
+            x_length (int): x方向の画像の大きさ
+            y_length (int): y方向の画像の大きさ
+
+        Yields:
+            tuple: 書き込み開始位置の列・行と切り出した標高値（出力画像と重ならない場合は何も返さない）
+
+        """
+        clip_row_start = max(0, -row_start)
+        clip_column_start = max(0, -column_start)
+        clip_row_end = min(np_array.shape[0], y_length - row_start)
+        clip_column_end = min(np_array.shape[1], x_length - column_start)
+        if clip_row_end <= clip_row_start or clip_column_end <= clip_column_start:
+            return
+
+        yield (
+            column_start + clip_column_start,
+            row_start + clip_row_start,
+            np_array[clip_row_start:clip_row_end,
+                     clip_column_start:clip_column_end],
         )
-        sort_contents_list = sorted(
-            self.dem.np_array_list, key=lambda x: x["mesh_code"]
+
+    @staticmethod
+    def _map_axis(offset, ratio, length):
+        """1方向について、メッシュのセルと出力のセルの対応を算出する
+
+        Args:
+            offset (float): 出力画像の端からメッシュの端までの距離（出力のピクセル数）
+            ratio (float): メッシュのピクセルサイズ / 出力のピクセルサイズ
+            length (int): メッシュのセル数
+
+        Returns:
+            tuple: 参照するメッシュのセルの添字と、書き込む出力のセルの添字（いずれも単調増加）
+
+        Notes:
+            出力の方が粗い場合は、メッシュの各セルの中心が含まれる出力のセルに集約する（平均する）
+            出力の方が細かい場合は、出力の各セルの中心が含まれるメッシュのセルを複製する
+
+        """
+        # 浮動小数点の誤差でセルが1つずれないよう、わずかに許容する
+        epsilon = 1e-6
+        if ratio <= 1 + epsilon:
+            source_indexes = np.arange(length)
+            target_indexes = np.floor(
+                offset + (source_indexes + 0.5) * ratio).astype(np.int64)
+        else:
+            target_start = math.ceil(offset - 0.5 - epsilon)
+            target_end = math.ceil(offset + length * ratio - 0.5 - epsilon)
+            target_indexes = np.arange(target_start, target_end)
+            source_indexes = np.clip(
+                np.floor((target_indexes + 0.5 - offset) / ratio).astype(np.int64),
+                0,
+                length - 1)
+        return source_indexes, target_indexes
+
+    @staticmethod
+    def _straddle_edges(offset, ratio, length):
+        """1方向について、メッシュの始め・終わりの境界をまたぐ出力のセルがあるかを判定する
+
+        Args:
+            offset (float): 出力画像の端からメッシュの端までの距離（出力のピクセル数）
+            ratio (float): メッシュのピクセルサイズ / 出力のピクセルサイズ
+            length (int): メッシュのセル数
+
+        Returns:
+            tuple: 始め・終わりの境界で、隣のメッシュの端のセルと同じ出力のセルに集約されるか
+
+        Notes:
+            _map_axisと同じく、境界の両側のメッシュのセルの中心が同じ出力のセルに含まれるかで判定する
+            出力の方が細かい場合や、メッシュの境界がピクセルの境界と一致する場合はまたがない
+
+        """
+        if ratio > 1 + 1e-6:
+            return False, False
+        end = offset + length * ratio
+        return (
+            math.floor(offset - ratio / 2) == math.floor(offset + ratio / 2),
+            math.floor(end - ratio / 2) == math.floor(end + ratio / 2),
         )
-        # メタデータとコンテンツを結合
-        for metadata, content in zip(sort_metadata_list, sort_contents_list):
-            metadata.update(content)
-            mesh_data_list.append(metadata)
 
-        return mesh_data_list
+    @staticmethod
+    def _merge_seam_cells(
+            seam_cells, mesh_kind, column_start, row_start, values, counts, edges):
+        """変換後のメッシュの外周のセルに、同じ種類の隣のメッシュで集約済みの合計とセル数を加える
+
+        Args:
+            seam_cells (dict): 境界をまたぐ出力の行・列・セル毎の合計とセル数（更新される）
+            mesh_kind (int): メッシュの種類（メッシュコードの桁数）
+            column_start (int): 書き込みを開始する列
+            row_start (int): 書き込みを開始する行
+            values (numpy.ndarray): 変換後の合計の配列（外周のセルが更新される）
+            counts (numpy.ndarray): 変換後のセル数の配列（外周のセルが更新される）
+            edges (tuple): 上・下・左・右の境界をまたぐ出力のセルがあるか（_straddle_edgesの結果）
+
+        Notes:
+            メッシュの境界がピクセルの境界と一致しない場合、境界をまたぐ出力のセルは両方のメッシュのセルを集約する
+            後から書き込むメッシュの値で上書きされるため、先に書き込んだメッシュの分も合計して平均を正しくする
+            重なり順を保つため、種類（2次メッシュ・3次メッシュ）の異なるメッシュの値とは合計しない
+            境界の行・列（角を除く）は2つのメッシュ、角のセルは最大4つのメッシュで共有されるため、
+            全てのメッシュの値を合計した時点でseam_cellsから取り除く
+
+        """
+        top, bottom, left, right = edges
+        last_row = values.shape[0] - 1
+        last_column = values.shape[1] - 1
+
+        # 境界の行・列は、隣のメッシュと同じ範囲の配列をまとめて合計する
+        lines = []
+        if top:
+            lines.append(((mesh_kind, "row", row_start, column_start), (0, slice(1, -1))))
+        if bottom:
+            lines.append(
+                ((mesh_kind, "row", row_start + last_row, column_start), (-1, slice(1, -1))))
+        if left:
+            lines.append(
+                ((mesh_kind, "column", column_start, row_start), (slice(1, -1), 0)))
+        if right:
+            lines.append(
+                ((mesh_kind, "column", column_start + last_column, row_start),
+                 (slice(1, -1), -1)))
+        for key, index in lines:
+            previous = seam_cells.pop(key, None)
+            if previous is None:
+                seam_cells[key] = (values[index].copy(), counts[index].copy())
+            else:
+                values[index] += previous[0]
+                counts[index] += previous[1]
+
+        # 角のセルは、またぐ境界の数に応じて2つまたは4つのメッシュの値を合計する
+        corners = (
+            (0, 0, top, left),
+            (0, last_column, top, right),
+            (last_row, 0, bottom, left),
+            (last_row, last_column, bottom, right),
+        )
+        for row, column, row_straddles, column_straddles in corners:
+            mesh_count = 2 ** (row_straddles + column_straddles)
+            if mesh_count == 1:
+                continue
+            key = (mesh_kind, row_start + row, column_start + column)
+            previous_value, previous_count, merged_count = seam_cells.pop(key, (0, 0, 0))
+            values[row, column] += previous_value
+            counts[row, column] += previous_count
+            if merged_count + 1 < mesh_count:
+                seam_cells[key] = (values[row, column], counts[row, column], merged_count + 1)
+
+    @staticmethod
+    def _merge_small_mesh_cells(seam_cells, mesh_kind, column_start, row_start, values, counts):
+        """出力の2ピクセルより小さいメッシュについて、外周のセルに隣のメッシュの合計とセル数を加える
+
+        Args:
+            seam_cells (dict): 出力のセル毎の合計とセル数（更新される）
+            mesh_kind (int): メッシュの種類（メッシュコードの桁数）
+            column_start (int): 書き込みを開始する列
+            row_start (int): 書き込みを開始する行
+            values (numpy.ndarray): 変換後の合計の配列（外周のセルが更新される）
+            counts (numpy.ndarray): 変換後のセル数の配列（外周のセルが更新される）
+
+        Notes:
+            1つの出力のセルを共有するメッシュの数が決まらないため、セル毎に合計し、seam_cellsから取り除かない
+            メッシュより出力のセルが大きいため、外周のセルの数は出力のセル数程度に収まる
+
+        """
+        y_length, x_length = values.shape
+        edge = np.zeros(values.shape, dtype=bool)
+        edge[[0, y_length - 1], :] = True
+        edge[:, [0, x_length - 1]] = True
+        for row, column in zip(*np.nonzero(edge)):
+            key = (mesh_kind, row_start + row, column_start + column)
+            if key in seam_cells:
+                previous_value, previous_count, _ = seam_cells[key]
+                values[row, column] += previous_value
+                counts[row, column] += previous_count
+            seam_cells[key] = (values[row, column], counts[row, column], 0)
+
+    def _resample_mesh(self, data, geo_transform, seam_cells=None):
+        """メッシュの標高値を出力のピクセルサイズに変換する
+
+        Args:
+            data (MeshData): メッシュ
+            geo_transform (list): 出力画像のgeo_transform
+            seam_cells (dict): 指定した場合、メッシュの境界をまたぐセルに隣のメッシュの値も含めて平均する
+
+        Returns:
+            tuple: 書き込み開始位置の列・行と変換後の標高値（np.array）
+
+        Notes:
+            細かくする場合はセルの複製、粗くする場合はnodataを除いた平均で、ループを使わずに変換する
+
+        """
+        x_pixel_size = geo_transform[1]
+        y_pixel_size = -geo_transform[5]
+        y_length, x_length = data.np_array.shape
+
+        row_offset = (geo_transform[3] - data.upper_corner["lat"]) / y_pixel_size
+        row_ratio = abs(data.pixel_size["y"]) / y_pixel_size
+        column_offset = (data.lower_corner["lon"] - geo_transform[0]) / x_pixel_size
+        column_ratio = data.pixel_size["x"] / x_pixel_size
+        row_sources, row_targets = self._map_axis(row_offset, row_ratio, y_length)
+        column_sources, column_targets = self._map_axis(
+            column_offset, column_ratio, x_length)
+
+        values, counts = sum_to_grid(
+            data.np_array[np.ix_(row_sources, column_sources)],
+            row_targets,
+            column_targets)
+        column_start = int(column_targets[0])
+        row_start = int(row_targets[0])
+        if seam_cells is not None:
+            edges = (
+                self._straddle_edges(row_offset, row_ratio, y_length)
+                + self._straddle_edges(column_offset, column_ratio, x_length))
+            mesh_kind = len(str(data.mesh_code))
+            # 境界がピクセルの境界と一致する場合（整数倍の解像度など）は、隣のメッシュとセルを共有しない
+            if any(edges) and min(y_length * row_ratio, x_length * column_ratio) < 2:
+                self._merge_small_mesh_cells(
+                    seam_cells, mesh_kind, column_start, row_start, values, counts)
+            elif any(edges):
+                self._merge_seam_cells(
+                    seam_cells, mesh_kind, column_start, row_start, values, counts, edges)
+        return column_start, row_start, average_sums(values, counts)
+
+    def _create_dem_array(self, x_length, y_length):
+        """全xmlを包括する、nodataで埋めた配列を作成する
+
+        Args:
+            x_length (int): x方向の画像の大きさ
+            y_length (int): y方向の画像の大きさ
+
+        Returns:
+            numpy.ndarray or numpy.memmap: 全xmlを包括する配列
+
+        Notes:
+            memmap_dirが指定された場合は一時ファイルをメモリマップした配列を返すため、大きさの上限はない
+            一時ファイルは作成直後に削除されるので、配列が破棄されるとディスクからも解放される
+
+        """
+        if self.memmap_dir is None:
+            # グリッドセルサイズが10000以上なら処理を終了
+            if x_length >= 10000 or y_length >= 10000:
+                raise Exception(
+                    f"セルサイズが大きすぎます。x={x_length}・y={y_length}")
+            dem_array = np.empty((y_length, x_length), np.float32)
+        else:
+            self.memmap_dir.mkdir(parents=True, exist_ok=True)
+            with tempfile.TemporaryFile(dir=self.memmap_dir) as scratch_file:
+                dem_array = np.memmap(
+                    scratch_file,
+                    dtype=np.float32,
+                    mode="w+",
+                    shape=(y_length, x_length))
+        dem_array.fill(-9999)
+        return dem_array
 
     def make_data_for_geotiff(self):
         """Demの情報からGeoTiff作成に必要な情報を生成する
 
         Returns:
 
+        Notes:
+            全xmlを包括する配列をメモリ上に作成するため、大きさに上限を設けている（memmap_dir指定時を除く）
+            GeoTiffの書き出しのみであればdem_to_geotiffを使用すること（メッシュ毎に書き込むため上限はない）
+
         """
         # 全xmlを包括するグリッドセル数
         image_size = self._calc_image_size()
         x_length = image_size[0]
         y_length = image_size[1]
 
-        # グリッドセルサイズが10000以上なら処理を終了
-        if x_length >= 10000 or y_length >= 10000:
-            raise Exception(f"セルサイズが大きすぎます。x={x_length}・y={y_length}")
-
         # 全xmlを包括する配列を作成
-        dem_array = np.empty((y_length, x_length), np.float32)
-        dem_array.fill(-9999)
+        with self.profiler.stage("array_fill", cells=x_length * y_length):
+            dem_array = self._create_dem_array(x_length, y_length)
+
+        geo_transform = self._calc_geo_transform(x_length, y_length)
+
+        with self.profiler.stage("mosaic") as record:
+            record["cells"] = 0
+            for column_start, row_start, np_array in self._iter_mesh_windows(
+                    geo_transform, x_length, y_length):
+                # スライスで大きい配列に代入
+                row_end = row_start + np_array.shape[0]
+                column_end = column_start + np_array.shape[1]
+                if self.resolution is None:
+                    dem_array[row_start:row_end, column_start:column_end] = np_array
+                else:
+                    # 後から書き込む細かいメッシュの値を優先し、nodataの部分は粗いメッシュの値を残す
+                    np.copyto(
+                        dem_array[row_start:row_end, column_start:column_end],
+                        np_array,
+                        where=np_array != -9999)
+                record["cells"] += np_array.size
 
-        x_pixel_size = (
-            self.dem.bounds_latlng["upper_right"]["lon"]
-            - self.dem.bounds_latlng["lower_left"]["lon"]
-        ) / x_length
-        y_pixel_size = (
-            self.dem.bounds_latlng["lower_left"]["lat"]
-            - self.dem.bounds_latlng["upper_right"]["lat"]
-        ) / y_length
+        data_for_geotiff = (
+            geo_transform,
+            dem_array,
+            x_length,
+            y_length,
+            self.output_path,
+        )
+        return data_for_geotiff
 
-        # メタデータと標高値を結合
-        data_list = self._combine_meta_data_and_contents()
+    def to_array(self):
+        """ファイルを作成せずに、全メッシュを結合した標高値の配列を返す
 
-        # メッシュのメッシュコードを取り出す
-        for data in data_list:
-            # 読み込んだarrayの左下の座標を取得
-            lower_left_lat = data["lower_corner"]["lat"]
-            lower_left_lon = data["lower_corner"]["lon"]
+        Returns:
+            tuple: 標高値の配列（nodataは-9999）・geo_transform・座標参照系（EPSG:4326のWKT）
 
-            # (0, 0)からの距離を算出
-            lat_distance = lower_left_lat - \
-                self.dem.bounds_latlng["lower_left"]["lat"]
-            lon_distance = lower_left_lon - \
-                self.dem.bounds_latlng["lower_left"]["lon"]
+        Notes:
+            配列はEPSG:4326のまま返す（投影変換する場合はto_datasetを使用すること）
+            make_data_for_geotiffと同じく、memmap_dirを指定しない場合は大きさに上限がある
 
-            # numpy上の座標を取得(ピクセルサイズが少数のため誤差が出るから四捨五入)
-            x_coordinate = round(lon_distance / x_pixel_size)
-            y_coordinate = round(lat_distance / (-y_pixel_size))
+        """
+        geo_transform, dem_array, _, _, _ = self.make_data_for_geotiff()
 
-            # グリッドセルサイズ
-            x_len = data["grid_length"]["x"]
-            y_len = data["grid_length"]["y"]
+        ref = osr.SpatialReference()
+        ref.ImportFromEPSG(4326)
+        return dem_array, geo_transform, ref.ExportToWkt()
 
-            # スライスで指定する範囲を算出
-            row_start = int(y_length - (y_coordinate + y_len))
-            row_end = int(row_start + y_len)
-            column_start = int(x_coordinate)
-            column_end = int(column_start + x_len)
+    def to_dataset(self, epsg=None, rgbify=False):
+        """ファイルを作成せずに、全メッシュを結合したGDALのMEMデータセットを返す
 
-            # データから標高値の配列を取得
-            np_array = data["np_array"]
-            # スライスで大きい配列に代入
-            dem_array[row_start:row_end, column_start:column_end] = np_array
+        Args:
+            epsg (str): 投影変換する場合のEPSGコード。Noneの場合はoutput_epsg
+            rgbify (bool): Trueの場合はterrain rgb（3バンド・Byte）、それ以外は標高値（1バンド・Float32）
 
-        geo_transform = [
-            self.dem.bounds_latlng["lower_left"]["lon"],
-            x_pixel_size,
-            0,
-            self.dem.bounds_latlng["upper_right"]["lat"],
-            0,
-            y_pixel_size,
-        ]
+        Returns:
+            gdal.Dataset: 全メッシュを書き込んだMEMデータセット
 
-        data_for_geotiff = (
+        Notes:
+            メッシュ毎にMEMデータセットへ書き込み、投影変換もメモリ上で行うため、ファイルの読み書きは発生しない
+            データセットのメタデータには、dem_to_geotiffの成果物と同じくメッシュ毎のハッシュ値を記録する
+
+        """
+        epsg = self.output_epsg if epsg is None else epsg
+        if not epsg.startswith("EPSG:"):
+            raise Exception("EPSGコードの指定が不正です。EPSG:〇〇の形式で入力してください")
+        product = Product("", rgbify=rgbify, epsg=epsg)
+
+        x_length, y_length = self._calc_image_size()
+        geo_transform = self._calc_geo_transform(x_length, y_length)
+        geotiff = Geotiff(
             geo_transform,
-            dem_array,
+            None,
             x_length,
             y_length,
-            self.output_path,
-        )
-        return data_for_geotiff
+            self.output_path)
+
+        with self.profiler.stage("open_products", cells=x_length * y_length):
+            dst_ds = geotiff.create(
+                product.band_count, product.dtype, in_memory=True)
+            geotiff.fill_no_data(dst_ds, product.rgbify)
+        self.mesh_hashes = {}
+        self._write_mesh_windows(geotiff, [product], [dst_ds], geo_transform)
+        geotiff.set_mesh_hashes(dst_ds, self.mesh_hashes)
+
+        if product.reproject:
+            with self.profiler.stage("warp", cells=x_length * y_length):
+                dst_ds = warp(
+                    epsg=product.epsg,
+                    no_data_value=-9999,
+                    source_ds=dst_ds,
+                    warp_memory_limit=self.warp_memory_limit)
+        return dst_ds
+
+    def _write_mesh_windows(
+            self,
+            geotiff,
+            products,
+            datasets,
+            geo_transform,
+            mesh_codes=None):
+        """読み込んだメッシュを、全ての成果物のデータセットに書き込む
+
+        Args:
+            geotiff (Geotiff):
+            products (list): 書き出す成果物（Product）のリスト
+            datasets (list): 成果物毎のデータセットのリスト
+            geo_transform (list): 出力画像のgeo_transform
+            mesh_codes (list): 指定した場合はこのメッシュコードのメッシュのみを書き込む
+
+        Notes:
+            標高値とterrain rgbのバンドの配列は、それぞれメッシュ毎に一度だけ作成する
+            terrain rgbへの変換とGDALへの書き込みは、メッシュ毎に別の段階として記録する
 
-    def dem_to_geotiff(self):
         """
-        処理を一括で行い、選択されたディレクトリに入っているxmlをGeoTiffにコンバートして指定したディレクトリに吐き出す
-        rgbify=Trueの場合、terrainRGBも作成
+        for x_offset, y_offset, np_array in self._iter_mesh_windows(
+                geo_transform, geotiff.x_length, geotiff.y_length, mesh_codes):
+            band_arrays_cache = {}
+            for product, dst_ds in zip(products, datasets):
+                if product.rgbify not in band_arrays_cache:
+                    stage_name = "rgbify" if product.rgbify else "band_array"
+                    with self.profiler.stage(stage_name, cells=np_array.size):
+                        band_arrays_cache[product.rgbify] = geotiff.make_band_arrays(
+                            np_array, product.rgbify)
+                with self.profiler.stage("gdal_write", cells=np_array.size):
+                    if self.resolution is None:
+                        geotiff.write_block(
+                            dst_ds,
+                            band_arrays_cache[product.rgbify],
+                            x_offset,
+                            y_offset)
+                    else:
+                        # 後から書き込む細かいメッシュの値を優先し、nodataの部分は粗いメッシュの値を残す
+                        geotiff.merge_block(
+                            dst_ds,
+                            band_arrays_cache[product.rgbify],
+                            x_offset,
+                            y_offset,
+                            np_array != -9999)
+
+    def write_products(self, products):
+        """メッシュを一度だけ走査して、複数の成果物を同時に書き出す
+
+        Args:
+            products (list): 書き出す成果物（Product）のリスト
+
+        Notes:
+            メッシュ毎の標高値を全ての成果物に書き込むため、標高値の読み込み・保持は成果物の数に関わらず一度で済む
+            terrain rgbへの変換も、メッシュ毎に一度だけ行う
+            各成果物のメタデータに、含まれるメッシュのメッシュコードとxmlのハッシュ値を記録する
+
         """
-        data_for_geotiff = self.make_data_for_geotiff()
+        file_names = [product.file_name for product in products]
+        if not len(file_names) == len(set(file_names)):
+            raise Exception(f"成果物のファイル名が重複しています。file_names={file_names}")
 
-        geotiff = Geotiff(*data_for_geotiff)
+        x_length, y_length = self._calc_image_size()
+        geo_transform = self._calc_geo_transform(x_length, y_length)
 
-        geotiff.write(1, gdal.GDT_Float32)
+        geotiff = Geotiff(
+            geo_transform,
+            None,
+            x_length,
+            y_length,
+            self.output_path)
+
+        with self.profiler.stage("open_products", cells=x_length * y_length * len(products)):
+            datasets = [geotiff.open_product(product) for product in products]
+        self.mesh_hashes = {}
+        self._write_mesh_windows(geotiff, products, datasets, geo_transform)
+
+        for dst_ds in datasets:
+            geotiff.set_mesh_hashes(dst_ds, self.mesh_hashes)
+        # データセットを閉じられるよう、ループ変数に残った参照も手放す
+        del dst_ds
+
+        # データセットへの参照がリストに残らないよう、リストから取り除いて渡す
+        for product in products:
+            if product.reproject:
+                stage_name = "warp"
+            elif product.cog:
+                stage_name = "cog"
+            else:
+                stage_name = "flush"
+            with self.profiler.stage(stage_name, cells=x_length * y_length):
+                temporary_path = geotiff.close_product(
+                    datasets.pop(0),
+                    product,
+                    warp_memory_limit=self.warp_memory_limit)
+                # close_productから戻った時点でデータセットは閉じているので、一時的なGeoTiffを削除できる
+                if temporary_path is not None:
+                    geotiff.delete_dataset(temporary_path)
+
+    def update_products(self, products):
+        """既存の成果物のうち、内容が変わったメッシュの範囲のみを書き換える
+
+        Args:
+            products (list): 更新する成果物（Product）のリスト
 
-        if not self.output_epsg == "EPSG:4326":
-            geotiff.resampling(epsg=self.output_epsg)
+        Returns:
+            list: 書き換えたメッシュのメッシュコードのリスト（変更がない場合は空）
 
+        Notes:
+            メタデータに記録されたハッシュ値と異なるメッシュのみ標高値をデコードする
+            ハッシュ値の算出に読み込んだxmlはデコード時にキャッシュのキーとして再利用される
+            投影変換・COGの成果物は全体を作り直す必要があるため対象外
+            入力から取り除かれたメッシュの範囲はそのまま残す
+            解像度の異なるメッシュを重ねる（resolution指定時）場合は、重なり順を保てないため対象外
+
+        """
+        if self.resolution is not None:
+            raise Exception("解像度を指定した変換（resolution）では、既存の成果物の更新はできません")
+
+        x_length, y_length = self._calc_image_size()
+        geo_transform = self._calc_geo_transform(x_length, y_length)
+
+        geotiff = Geotiff(
+            geo_transform,
+            None,
+            x_length,
+            y_length,
+            self.output_path)
+
+        datasets = [geotiff.open_existing_product(product) for product in products]
+
+        with self.profiler.stage("hash"):
+            mesh_hashes = self.dem.get_content_hashes()
+        changed_mesh_codes = set()
+        recorded_hashes = {}
+        for dst_ds in datasets:
+            product_hashes = geotiff.get_mesh_hashes(dst_ds)
+            changed_mesh_codes.update(
+                mesh_code for mesh_code, mesh_hash in mesh_hashes.items()
+                if not product_hashes.get(mesh_code) == mesh_hash)
+            recorded_hashes.update(product_hashes)
+        self.mesh_hashes = {**recorded_hashes, **mesh_hashes}
+
+        if not changed_mesh_codes:
+            return []
+
+        self._write_mesh_windows(
+            geotiff,
+            products,
+            datasets,
+            geo_transform,
+            mesh_codes=sorted(changed_mesh_codes))
+
+        with self.profiler.stage("flush"):
+            for dst_ds in datasets:
+                geotiff.set_mesh_hashes(dst_ds, self.mesh_hashes)
+                dst_ds.FlushCache()
+
+        return sorted(changed_mesh_codes)
+
+    def _make_products(self):
+        """オプションから、書き出す成果物（Product）のリストを作成する
+
+        Returns:
+            list: 書き出す成果物（Product）のリスト
+
+        """
+        products = [
+            Product(
+                "output.tif",
+                epsg=self.output_epsg,
+                cog=self.cog,
+                compress=self.compress,
+                max_z_error=self.max_z_error,
+                overview_resampling=self.dem_overview_resampling,
+            )
+        ]
         if self.rgbify:
-            geotiff.write(
-                3,
-                gdal.GDT_Byte,
-                file_name="rgbify.tif",
-                rgbify=self.rgbify
+            products.append(
+                Product(
+                    "rgbify.tif",
+                    rgbify=True,
+                    epsg=self.output_epsg,
+                    cog=self.cog,
+                    compress=self.compress,
+                    overview_resampling=self.rgb_overview_resampling,
+                )
             )
+        return products
+
+    def _get_tile_source(self, products):
+        """タイルの作成に使う、EPSG:4326の標高値のGeoTiffを決める
+
+        Args:
+            products (list): 書き出す成果物（Product）のリスト
+
+        Returns:
+            Product: タイルの作成に使う成果物
+
+        Notes:
+            標高値の成果物がEPSG:4326・COGなしであればそれを返し、
+            それ以外の場合は一時的な成果物を返す（成果物に加えても、メッシュの走査は一度で済む）
+
+        """
+        for product in products:
+            if not product.rgbify and not product.reproject and not product.cog:
+                return product
+        return Product(".tiles_source.tif")
+
+    def write_tiles(self, source_path):
+        """EPSG:4326の標高値のGeoTiffから、terrain rgbのXYZタイルを「出力先/tiles」に書き出す
 
-            if not self.output_epsg == "EPSG:4326":
-                geotiff.resampling(epsg=self.output_epsg, file_name="rgbify.tif")
+        Args:
+            source_path (Path): EPSG:4326の標高値のGeoTiff
+
+        Returns:
+            dict: ズームレベル毎の書き出したタイル数
+
+        """
+        min_zoom, max_zoom = self.tile_zoom
+        with self.profiler.stage("tiles"):
+            return generate_tiles(
+                source_path,
+                self.bounds_latlng,
+                self.output_path / "tiles",
+                min_zoom,
+                max_zoom,
+                tile_format=self.tile_format,
+                workers=self.workers)
+
+    def dem_to_geotiff(self):
+        """
+        処理を一括で行い、選択されたディレクトリに入っているxmlをGeoTiffにコンバートして指定したディレクトリに吐き出す
+        rgbify=Trueの場合、terrainRGBも作成
+        全体の配列は作成せず、メッシュ毎に対応する範囲へ書き込むため、メモリ使用量は最大のメッシュ分に収まる
+        （投影変換する場合は、EPSG:4326の中間データをメモリ上に保持する）
+        update=Trueの場合は、既存の成果物のうち内容が変わったメッシュの範囲のみを書き換える（成果物がまだ存在しない場合は全体を書き出す）
+        tile_zoomが指定された場合は、書き出した標高値からterrain rgbのXYZタイルも作成する
+        """
+        if self.output_path is None:
+            raise Exception("出力先（output_path）が指定されていません。ファイルに書き出さない場合はto_array・to_datasetを使用してください")
+        products = self._make_products()
+        tile_source = None
+        temporary_source = False
+        if self.tile_zoom is not None:
+            tile_source = self._get_tile_source(products)
+            temporary_source = tile_source not in products
+            if temporary_source:
+                products.append(tile_source)
+
+        if self.update and all(
+                (self.output_path / product.file_name).exists() for product in products):
+            changed_mesh_codes = self.update_products(products)
+            # 変更がなく、タイルも作成済みであればタイルを作り直さない
+            if not changed_mesh_codes and (self.output_path / "tiles").exists():
+                tile_source = None
+        else:
+            self.write_products(products)
+
+        if tile_source is not None:
+            source_path = self.output_path / tile_source.file_name
+            self.write_tiles(source_path)
+            if temporary_source:
+                Geotiff.delete_dataset(source_path)
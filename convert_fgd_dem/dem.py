@@ -1,97 +1,327 @@
-import os
-import shutil
-import xml.etree.ElementTree as et
+import re
+import warnings
 import zipfile
-from pathlib import Path
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+from typing import TYPE_CHECKING
+from xml.parsers import expat
+
+from convert_fgd_dem.mesh_index import (
+    METADATA_TAGS,
+    TUPLE_LIST_TAG,
+    HashingReader,
+    MeshIndex,
+    content_hash,
+)
+from convert_fgd_dem.profiler import NullProfiler, Profiler
+
+# メタデータのみを扱う場合にNumPyを読み込まないよう、NumPyは標高値をデコードする関数内で読み込む
+if TYPE_CHECKING:
+    import numpy as np
+
+# gml:tupleListの各行「地表面,354.15」から標高値以外（種別とカンマ）を取り除くためのパターン
+TUPLE_LABEL_PATTERN = re.compile(r"[^,\s]*,")
+# xmlの解析時に一度に読み込み、文字データとして受け取る大きさ（バイト）
+XML_BUFFER_SIZE = 64 * 1024
+
+
+@dataclass(frozen=True)
+class ZipMember:
+    """zipファイル内のxmlを解凍せずに扱うためのクラス
+
+    Notes:
+        Pathオブジェクトと同じように「suffix」「open("rb")」で扱えるようにしている
+        crc・file_sizeはzipのセントラルディレクトリに記録された値（xmlを解凍せずにキャッシュのキーを作成するために使用する）
+
+    """
+
+    archive_path: Path
+    name: str
+    crc: int = None
+    file_size: int = None
+
+    def __str__(self):
+        return f"{self.archive_path}/{self.name}"
+
+    @property
+    def suffix(self):
+        return PurePosixPath(self.name).suffix
+
+    @contextmanager
+    def open(self, mode="rb"):
+        """zipファイル内のxmlをファイルオブジェクトとして開く
 
-import numpy as np
+        Args:
+            mode (str): 読み込みモード（"rb"のみ対応）
+
+        Yields:
+            zipfile.ZipExtFile: xmlのファイルオブジェクト
+
+        """
+        if not mode == "rb":
+            raise Exception("zipファイル内のxmlはバイナリの読み込みのみ対応しています")
+        with zipfile.ZipFile(self.archive_path, "r") as zip_data:
+            with zip_data.open(self.name, "r") as xml_file:
+                yield xml_file
+
+
+@dataclass
+class MeshData:
+    """1メッシュ分のメタデータと標高値を保持するクラス
+
+    Notes:
+        xmlから取り出した文字列は保持せず、整形済みのメタデータとデコード済みの標高値のみを持つ
+        content_hashは解析時に同時に算出したxmlの内容のSHA-256（成果物のメタデータ・キャッシュのキーに使用する）
+
+    """
+
+    mesh_code: int
+    lower_corner: dict
+    upper_corner: dict
+    grid_length: dict
+    start_point: dict
+    pixel_size: dict
+    np_array: "np.ndarray"
+    content_hash: str = None
+
+
+class TupleListDecoder:
+    """gml:tupleListの文字データを少しずつ受け取り、float32の配列に標高値を書き込むクラス
+
+    Notes:
+        配列はgml:highから求めたグリッドのセル数で最初に確保し、受け取った分だけ順に書き込む
+        tupleList全体の文字列やfloat64の配列を作らないため、メモリ使用量はグリッドの大きさと受け取る単位で決まる
+        グリッドのセル数を超えた分の標高値は解釈のみ行い、書き込まずに切り捨てる
+
+    """
+
+    def __init__(self, size):
+        """イニシャライザ
+
+        Args:
+            size (int): 書き込む標高値の数の上限（グリッドのセル数）
+
+        """
+        import numpy as np
+
+        self.items: np.ndarray = np.empty(size, np.float32)
+        # 解釈した標高値の数（行数）
+        self.count: int = 0
+        # 前回受け取った文字データの末尾の、改行で終わっていない行
+        self._rest: str = ""
+
+    def feed(self, text):
+        """文字データを受け取り、改行で終わっている行までを標高値に変換する
+
+        Args:
+            text (str): gml:tupleListの文字データの一部
+
+        """
+        text = self._rest + text
+        line_end = text.rfind("\n")
+        if line_end < 0:
+            self._rest = text
+            return
+        self._rest = text[line_end + 1:]
+        self._decode(text[:line_end])
+
+    def close(self):
+        """残りの文字データを変換し、書き込んだ標高値の配列を返す
+
+        Returns:
+            numpy.ndarray: 標高値を格納した1次元配列（グリッドのセル数を超えた分は含まない）
+
+        """
+        self._decode(self._rest)
+        self._rest = ""
+        return self.items[:min(self.count, self.items.size)]
+
+    def _decode(self, text):
+        """改行区切りの行を一括でfloat32に変換して、配列の続きに書き込む
+
+        Args:
+            text (str): 「地表面,354.15」のような行が改行区切りで並んだ文字列
+
+        Notes:
+            一度float64として解釈してからfloat32に変換することで、
+            値毎にfloat()してfloat32の配列に代入していた従来の結果と一致させている
+            np.fromstringは解釈できない値があるとそこで読み込みを止めるため、行数と一致しない場合はエラーとする
+
+        """
+        import numpy as np
+
+        values, row_count = TUPLE_LABEL_PATTERN.subn(" ", text)
+        if row_count == 0 and not values.strip():
+            return
+        with warnings.catch_warnings():
+            # 解釈できない値がある場合の警告は、行数の確認でエラーにするため表示しない
+            warnings.simplefilter("ignore", DeprecationWarning)
+            decoded = np.fromstring(values, dtype=np.float64, sep=" ")
+        if not decoded.size == row_count:
+            raise Exception(
+                f"gml:tupleListの標高値を解釈できません。行数={row_count}・解釈できた値の数={decoded.size}")
+
+        start = min(self.count, self.items.size)
+        end = min(self.count + row_count, self.items.size)
+        self.items[start:end] = decoded[:end - start]
+        self.count += row_count
 
 
 class Dem:
     """DEMのxmlからメタデータを取り出すクラス"""
 
-    def __init__(self, import_path):
+    def __init__(
+            self,
+            import_path,
+            workers=1,
+            cache=None,
+            bbox=None,
+            mesh_codes=None,
+            profiler=None,
+            allow_mixed_mesh=False):
         """イニシャライザ
 
         Args:
-            import_path (Path): 取り込み対象のパスオブジェクト
+            import_path (Path or list): 取り込み対象のパスオブジェクト（複数の入力を結合する場合はそのリスト）
+            workers (int): xmlの読み込みに使用するプロセス数
+            cache (MeshCache): 解析済みメッシュのキャッシュ。Noneの場合はキャッシュを使用しない
+            bbox (tuple): 指定した場合は範囲（最小経度, 最小緯度, 最大経度, 最大緯度）と重なるメッシュのみを読み込む
+            mesh_codes (list): 指定した場合はこのメッシュコードのメッシュのみを読み込む
+            profiler (Profiler): 段階毎の処理時間などを記録する。Noneの場合は計測しない
+            allow_mixed_mesh (bool): Trueの場合は2次メッシュと3次メッシュの混在を許可する（呼び出し側で解像度を揃えること）
 
         Notes:
             「meta_data」とはDEMを構成する「メッシュコード・左下と右上の緯度経度・グリッドサイズ・初期位置・ピクセルサイズ」のことを指す
             「content」とはメッシュコード・メタデータ・標高値のことを指す
+            初期化時はxmlのヘッダーのみを読み込み、範囲・メッシュコードの一覧・メッシュ毎のメタデータ（index_entries）を作成する
+            標高値はiter_mesh_data・get_mesh_data・mesh_data_listで参照された時点で、メッシュ毎にデコードする
 
         """
         self.import_path: Path = import_path
-        self.xml_paths: list = self._get_xml_paths()
+        if workers < 1:
+            raise Exception(f"ワーカー数は1以上を指定してください。workers={workers}")
+        self.workers: int = workers
+        self.cache = cache
+        self.bbox: tuple = bbox
+        self.mesh_codes: list = mesh_codes
+        self.profiler: Profiler = NullProfiler() if profiler is None else profiler
+        self.allow_mixed_mesh: bool = allow_mixed_mesh
+
+        with self.profiler.stage("scan_headers"):
+            self.index_entries: list = self._get_index_entries()
+        self.xml_paths: list = [entry.xml_path for entry in self.index_entries]
+        self.mesh_code_list: list = [
+            entry.mesh_code for entry in self.index_entries]
+        self._check_mesh_codes()
+
+        self.bounds_latlng: dict = MeshIndex.get_bounds_latlng(self.index_entries)
 
-        self.all_content_list: list = []
-        self.mesh_code_list: list = []
-        self.meta_data_list: list = []
-        self.elevation_list: list = []
-        self._get_xml_content_list()
+        # デコード済みのメッシュ（index_entriesの添字毎）。mesh_data_list・get_mesh_dataで参照したもののみ保持する
+        self._loaded_mesh_data: dict = {}
+        # 算出済みのxmlの内容のハッシュ値（index_entriesの添字毎）。同じxmlのハッシュ値を何度も算出しないよう保持する
+        self._content_hashes: dict = {}
+
+    @staticmethod
+    def _is_xml_member(name):
+        """zipファイル内のメンバーが取り込み対象のxmlかどうかを判定する
+
+        Args:
+            name (str): zipファイル内のメンバー名
 
-        self.np_array_list: list = []
-        self._store_np_array_list()
+        Returns:
+            bool: 取り込み対象のxmlであればTrue
 
-        self.bounds_latlng: dict = {}
-        self._store_bounds_latlng()
+        """
+        member_path = PurePosixPath(name)
+        if not member_path.suffix == ".xml":
+            return False
+        # macOSでzip圧縮時に作成されるゴミファイルは除外する
+        if "__MACOSX" in member_path.parts or member_path.name.startswith("._"):
+            return False
+        return True
 
-    def _unzip_dem(self, dest_dir):
-        """DEMが格納されたzipファイルを解凍する
+    @staticmethod
+    def _get_zip_members(zip_path):
+        """zipファイルを解凍せずに、格納されたxmlのリストを作成する
 
         Args:
-            dest_dir (Path): 解凍先のディレクトリパス
+            zip_path (Path): zipファイルのパスオブジェクト
+
+        Returns:
+            list: zipファイル内のxmlを格納したリスト
+
+        Notes:
+            圧縮のされ方によってフォルダ構成が異なるため、階層を問わずxmlを対象とする
+
+        """
+        with zipfile.ZipFile(zip_path, "r") as zip_data:
+            infos = [
+                info for info in zip_data.infolist() if Dem._is_xml_member(info.filename)]
+        return [
+            ZipMember(zip_path, info.filename, crc=info.CRC, file_size=info.file_size)
+            for info in sorted(infos, key=lambda info: info.filename)
+        ]
+
+    def _get_index_entries(self):
+        """xmlのヘッダーのみを読み込み、範囲内・指定のメッシュの索引を作成する
+
+        Returns:
+            list: IndexEntryのリスト（xmlのパス順）
 
         """
-        with zipfile.ZipFile(self.import_path, "r") as zip_data:
-            # 圧縮のされ方が違うため（？）、解凍後のフォルダ構成が異なるのでひとまず展開して後ほど移動
-            zip_data.extractall(path=dest_dir)
-            # macOSでzip解凍時に作成されるゴミファイルを削除
-            garbage_dir = dest_dir / "__MACOSX"
-            if garbage_dir.exists():
-                shutil.rmtree(garbage_dir)
-
-            # 解凍後のディレクトリの中に同名ディレクトリが作成されていなければreturn
-            if dest_dir.glob(".xml"):
-                return
-
-            # 作成されていれば、サブディレクトリから取り出す
-            for path in zip_data.namelist():
-                if path.endswith(".xml"):
-                    try:
-                        shutil.move(dest_dir / path, dest_dir)
-                    except shutil.Error:
-                        print(
-                            f"ファイルがすでに存在しています。"
-                            f"ファイルの移動をスキップし、オリジナルファイルを削除します：{dest_dir / path}")
-                        os.remove(dest_dir / path)
-                        continue
-            # 内部に親フォルダと同名ディレクトリが残るので削除
-            if (dest_dir / self.import_path.stem).exists():
-                (dest_dir / self.import_path.stem).rmdir()
-
-    def _get_xml_paths(self):
-        """指定したパスからxmlのPathオブジェクトのリストを作成
+        mesh_index = MeshIndex(self.list_xml_paths(self.import_path))
+        entries = mesh_index.query(bbox=self.bbox, mesh_codes=self.mesh_codes)
+        if not entries:
+            raise Exception(
+                f"指定された範囲・メッシュコードに該当するxmlが存在しません。"
+                f"bbox={self.bbox}・mesh_codes={self.mesh_codes}")
+        return entries
+
+    @staticmethod
+    def list_xml_paths(import_path):
+        """指定したパスからxmlのPathオブジェクト（zipの場合はZipMember）のリストを作成
+
+        Args:
+            import_path (Path or list): 取り込み対象のパスオブジェクト（複数の入力を結合する場合はそのリスト）
 
         Returns:
             list: xmlのパスを格納したリスト
 
         """
-        if self.import_path.is_dir():
-            xml_paths = [
-                xml_path for xml_path in self.import_path.glob("*.xml")]
-            if xml_paths is None:
+        if isinstance(import_path, (list, tuple)):
+            import_paths = import_path
+        else:
+            import_paths = [import_path]
+
+        xml_paths = []
+        for path in import_paths:
+            xml_paths.extend(Dem._get_xml_paths_from(Path(path)))
+        return xml_paths
+
+    @staticmethod
+    def _get_xml_paths_from(import_path):
+        """1つの入力のパスからxmlのPathオブジェクト（zipの場合はZipMember）のリストを作成
+
+        Args:
+            import_path (Path): 取り込み対象のパスオブジェクト
+
+        Returns:
+            list: xmlのパスを格納したリスト
+
+        """
+        if import_path.is_dir():
+            xml_paths = sorted(import_path.glob("*.xml"))
+            if not xml_paths:
                 raise Exception("指定ディレクトリに.xmlが存在しません")
 
-        elif self.import_path.suffix == ".xml":
-            xml_paths = [self.import_path]
+        elif import_path.suffix == ".xml":
+            xml_paths = [import_path]
 
-        elif self.import_path.suffix == ".zip":
-            extract_dir = self.import_path.parent / self.import_path.stem
-            # 指定ディレクトリにunzip
-            self._unzip_dem(extract_dir)
-            xml_paths = [
-                xml_path for xml_path in extract_dir.glob("*.xml")]
+        elif import_path.suffix == ".zip":
+            xml_paths = Dem._get_zip_members(import_path)
             if not xml_paths:
                 raise Exception("指定のパスにxmlファイルが存在しません")
         else:
@@ -144,66 +374,82 @@ class Dem:
 
         return meta_data
 
-    def get_xml_content(self, xml_path):
+    @staticmethod
+    def get_xml_content(xml_path):
         """xmlを読み込んでメッシュコード・メタデータ・標高値を取得する
 
         Args:
-            xml_path (Path):　xmlのパスオブジェクト
+            xml_path (Path or ZipMember):　xmlのパスオブジェクト
 
         Returns:
-            dict: メッシュコード・メタデータ・標高値を格納した辞書
+            dict: メッシュコード・メタデータ・標高値・xmlの内容のハッシュ値を格納した辞書
+
+        Notes:
+            ハッシュ値は解析のために読み込んだバイト列から算出するため、xmlを読み直さない
+            gml:tupleListは文字データを受け取る度にTupleListDecoderで配列に書き込み、全体を文字列として保持しない
 
         """
         if not xml_path.suffix == ".xml":
             raise Exception("指定できる形式は.xmlのみです")
 
-        name_space = {
-            "dataset": "http://fgd.gsi.go.jp/spec/2008/FGD_GMLSchema",
-            "gml": "http://www.opengis.net/gml/3.2",
-        }
-
-        tree = et.parse(xml_path)
-        root = tree.getroot()
-
-        mesh_code = int(
-            root.find(
-                "dataset:DEM//dataset:mesh",
-                name_space).text)
-
-        raw_metadata = {
-            "mesh_code": mesh_code,
-            "lower_corner": root.find(
-                "dataset:DEM//dataset:coverage//gml:boundedBy//gml:Envelope//gml:lowerCorner",
-                name_space,
-            ).text,
-            "upper_corner": root.find(
-                "dataset:DEM//dataset:coverage//gml:boundedBy//gml:Envelope//gml:upperCorner",
-                name_space,
-            ).text,
-            "grid_length": root.find(
-                "dataset:DEM//dataset:coverage//gml:gridDomain//gml:Grid//gml:high",
-                name_space,
-            ).text,
-            "start_point": root.find(
-                "dataset:DEM//dataset:coverage//gml:coverageFunction//gml:GridFunction//gml:startPoint",
-                name_space,
-            ).text,
-        }
-
-        meta_data = self._format_metadata(raw_metadata)
-
-        tuple_list = root.find(
-            "dataset:DEM//dataset:coverage//gml:rangeSet//gml:DataBlock//gml:tupleList",
-            name_space,
-        ).text
-
-        # gml:tupleList先頭の改行を削除したのち、[[地表面,354.15]...]のようなlistのlistを作成
-        if tuple_list.startswith("\n"):
-            strip_tuple_list = tuple_list.strip()
-            items = [item.split(",")[1]
-                     for item in strip_tuple_list.split("\n")]
-        else:
-            items = [item.split(",")[1] for item in tuple_list.split("\n")]
+        raw_metadata = {}
+        items = None
+        decoder = None
+        # 文字データを集めている要素のキー（gml:tupleListの場合はTUPLE_LIST_TAG）と、集めた文字データ
+        text_key = None
+        texts = []
+
+        def start_element(name, attributes):
+            nonlocal text_key, decoder
+            # namespace_separatorを「}」とした要素名に「{」を付け、ElementTreeと同じ形式にする
+            tag = "{" + name
+            key = METADATA_TAGS.get(tag)
+            if key is not None and key not in raw_metadata:
+                text_key = key
+                texts.clear()
+            elif tag == TUPLE_LIST_TAG and decoder is None:
+                # gml:highはgml:tupleListより前にあるため、グリッドのセル数で配列を確保できる
+                if "grid_length" not in raw_metadata:
+                    raise Exception(f"gml:tupleListより前にgml:highが存在しません：{xml_path}")
+                grids = raw_metadata["grid_length"].split(" ")
+                decoder = TupleListDecoder((int(grids[0]) + 1) * (int(grids[1]) + 1))
+                text_key = TUPLE_LIST_TAG
+
+        def character_data(data):
+            if text_key == TUPLE_LIST_TAG:
+                decoder.feed(data)
+            elif text_key is not None:
+                texts.append(data)
+
+        def end_element(name):
+            nonlocal text_key, items
+            if text_key == TUPLE_LIST_TAG:
+                items = decoder.close()
+            elif text_key is not None:
+                raw_metadata[text_key] = "".join(texts)
+            text_key = None
+
+        parser = expat.ParserCreate(namespace_separator="}")
+        # 文字データを行毎ではなく、まとめて受け取る
+        parser.buffer_text = True
+        parser.buffer_size = XML_BUFFER_SIZE
+        parser.StartElementHandler = start_element
+        parser.CharacterDataHandler = character_data
+        parser.EndElementHandler = end_element
+        with xml_path.open("rb") as xml_file:
+            reader = HashingReader(xml_file)
+            parser.ParseFile(reader)
+            xml_hash = reader.hexdigest()
+
+        missing_keys = [
+            key for key in METADATA_TAGS.values() if key not in raw_metadata]
+        if missing_keys or items is None:
+            raise Exception(f"xmlに必要な要素が存在しません：{xml_path}")
+
+        mesh_code = int(raw_metadata["mesh_code"])
+        raw_metadata["mesh_code"] = mesh_code
+
+        meta_data = Dem._format_metadata(raw_metadata)
 
         elevation = {"mesh_code": mesh_code, "items": items}
 
@@ -211,6 +457,7 @@ class Dem:
             "mesh_code": mesh_code,
             "meta_data": meta_data,
             "elevation": elevation,
+            "content_hash": xml_hash,
         }
 
     def _check_mesh_codes(self):
@@ -218,7 +465,7 @@ class Dem:
 
         Raises:
             - メッシュコードが6桁 or 8桁以外の場合はエラー
-            - 2次メッシュと3次メッシュが混合している場合にエラー
+            - 2次メッシュと3次メッシュが混合している場合にエラー（allow_mixed_meshがTrueの場合を除く）
 
         """
         third_mesh_codes = []
@@ -234,41 +481,221 @@ class Dem:
                 raise Exception(f"メッシュコードが不正です。mesh_code={mesh_code}")
 
         # どちらもTrue、つまり要素が存在しているときにraise
-        if all((third_mesh_codes, second_mesh_codes)):
+        if all((third_mesh_codes, second_mesh_codes)) and not self.allow_mixed_mesh:
             raise Exception("2次メッシュと3次メッシュが混合しています。")
 
-    def _get_xml_content_list(self):
-        """xmlのリストを読み込んでメタデータと標高値のリストを作成する"""
-        self.all_content_list = [
-            self.get_xml_content(xml_path) for xml_path in self.xml_paths
-        ]
+    @staticmethod
+    def _load_xml_content(xml_path):
+        """xmlを読み込んで、メタデータと標高値（np.array）を格納したMeshDataを返す
 
-        self.mesh_code_list = [item["mesh_code"]
-                               for item in self.all_content_list]
-        self._check_mesh_codes()
+        Args:
+            xml_path (Path or ZipMember): xmlのパスオブジェクト
+
+        Returns:
+            MeshData: メタデータと標高値（np.array）
+
+        Notes:
+            プロセスプールのワーカーからは標高値の文字列ではなく、デコード済みの配列のみを返す
+
+        """
+        content = Dem.get_xml_content(xml_path)
+        np_array = Dem._get_np_array(content)["np_array"]
+        mesh_data = MeshData(
+            **content["meta_data"],
+            np_array=np_array,
+            content_hash=content["content_hash"])
+        return mesh_data
+
+    def _load_mesh_data(self, indexes):
+        """指定した添字のメッシュを読み込み、指定した順に返す
+
+        Args:
+            indexes (list): index_entriesの添字のリスト
+
+        Yields:
+            MeshData: メタデータと標高値（np.array）
+
+        Notes:
+            キャッシュが存在するメッシュはキャッシュから（標高値はメモリマップで）読み込み、残りのみxmlを解析する
+            workersが2以上の場合はプロセスプールで並列に読み込み、先読みはワーカー数の2倍までに抑える
+            （全メッシュを一度に投入しないので、取り出されていない結果が溜まり続けることはない）
+            読み込んだメッシュのメッシュコードがヘッダーのメッシュコードと異なる場合はエラー
+            キャッシュのキーはxmlを読み込まずに作成し、キャッシュへの保存はワーカーではなくこのプロセスで行う
+
+        """
+        workers = min(self.workers, len(indexes))
+        executor = None
+        prefetch = 1
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            prefetch = workers * 2
+
+        index_iter = iter(indexes)
+        pending = deque()
+
+        def submit_next():
+            index = next(index_iter, None)
+            if index is None:
+                return False
+            xml_path = self.xml_paths[index]
+            cache_key = None
+            if self.cache is not None:
+                cache_key = self.cache.make_key(xml_path, self.mesh_code_list[index])
+                mesh_data = self.cache.get(cache_key)
+                if mesh_data is not None:
+                    pending.append((index, mesh_data, None))
+                    return True
+            if executor is None:
+                pending.append((index, self._load_xml_content(xml_path), cache_key))
+            else:
+                pending.append(
+                    (index, executor.submit(self._load_xml_content, xml_path), cache_key))
+            return True
+
+        try:
+            while True:
+                while len(pending) < prefetch and submit_next():
+                    pass
+                if not pending:
+                    break
+                index, mesh_data, cache_key = pending.popleft()
+                if isinstance(mesh_data, Future):
+                    mesh_data = mesh_data.result()
+                if not mesh_data.mesh_code == self.mesh_code_list[index]:
+                    raise Exception(
+                        f"メッシュコードがヘッダーと一致しません：{self.xml_paths[index]}。"
+                        f"mesh_code={mesh_data.mesh_code}・expected={self.mesh_code_list[index]}")
+                if cache_key is not None:
+                    self.cache.put(cache_key, mesh_data)
+                self._content_hashes[index] = mesh_data.content_hash
+                yield mesh_data
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+    def iter_mesh_data(self, mesh_codes=None):
+        """メッシュコード順に、メッシュを1つずつデコードして返す
+
+        Args:
+            mesh_codes (list): 指定した場合はこのメッシュコードのメッシュのみを返す
+
+        Yields:
+            MeshData: メタデータと標高値（np.array）
+
+        Notes:
+            「xmlの解析→標高値のデコード→呼び出し側での書き込み」をメッシュ毎に行い、返したメッシュは保持しない
+            そのため、メモリ使用量は先読み分（ワーカー数の2倍）のメッシュ程度に収まる
+            mesh_data_list・get_mesh_dataでデコード済みのメッシュは、デコードし直さずに返す
+            標高値のデコードを待った時間を、メッシュ毎に「parse_xml」の段階として記録する
+
+        """
+        indexes = sorted(
+            range(len(self.index_entries)),
+            key=lambda index: self.mesh_code_list[index])
+        if mesh_codes is not None:
+            mesh_code_set = set(mesh_codes)
+            indexes = [
+                index for index in indexes
+                if self.mesh_code_list[index] in mesh_code_set]
+
+        pending_indexes = [
+            index for index in indexes if index not in self._loaded_mesh_data]
+        loaded_list = self._load_mesh_data(pending_indexes)
+        try:
+            for index in indexes:
+                mesh_data = self._loaded_mesh_data.get(index)
+                if mesh_data is None:
+                    with self.profiler.stage("parse_xml") as record:
+                        mesh_data = next(loaded_list)
+                        record["cells"] = mesh_data.np_array.size
+                yield mesh_data
+        finally:
+            loaded_list.close()
+
+    def get_content_hashes(self):
+        """メッシュ毎のxmlの内容のハッシュ値を、標高値をデコードせずに返す
+
+        Returns:
+            dict: メッシュコードとハッシュ値の辞書
+
+        Notes:
+            デコード済みのメッシュは解析時に算出したハッシュ値を使い、残りのみxmlを読み込んで算出する
+            算出したハッシュ値は保持し、その後のデコードではキャッシュのキーに再利用する
+
+        """
+        for index, entry in enumerate(self.index_entries):
+            if index not in self._content_hashes:
+                self._content_hashes[index] = content_hash(entry.xml_path)
+        return {
+            entry.mesh_code: self._content_hashes[index]
+            for index, entry in enumerate(self.index_entries)
+        }
+
+    def get_info(self):
+        """xmlのヘッダーから、範囲とメッシュ毎のメタデータを返す（標高値はデコードしない）
 
-        self.meta_data_list = [item["meta_data"]
-                               for item in self.all_content_list]
-        self.elevation_list = [item["elevation"]
-                               for item in self.all_content_list]
-
-    def _store_bounds_latlng(self):
-        """対象の全Demから緯度経度の最大・最小値を取得"""
-        lower_left_lat = min([meta_data["lower_corner"]["lat"]
-                              for meta_data in self.meta_data_list])
-        lower_left_lon = min([meta_data["lower_corner"]["lon"]
-                              for meta_data in self.meta_data_list])
-        upper_right_lat = max([meta_data["upper_corner"]["lat"]
-                               for meta_data in self.meta_data_list])
-        upper_right_lon = max([meta_data["upper_corner"]["lon"]
-                               for meta_data in self.meta_data_list])
-
-        bounds_latlng = {
-            "lower_left": {"lat": lower_left_lat, "lon": lower_left_lon},
-            "upper_right": {"lat": upper_right_lat, "lon": upper_right_lon},
+        Returns:
+            dict: メッシュ数・全メッシュを包括する左下と右上の緯度経度・メッシュ毎のメタデータ
+
+        """
+        return {
+            "mesh_count": len(self.index_entries),
+            "bounds_latlng": self.bounds_latlng,
+            "meshes": [
+                {
+                    "mesh_code": entry.mesh_code,
+                    "xml_path": str(entry.xml_path),
+                    "lower_corner": entry.lower_corner,
+                    "upper_corner": entry.upper_corner,
+                    "grid_length": entry.grid_length,
+                    "pixel_size": entry.pixel_size,
+                }
+                for entry in self.index_entries
+            ],
         }
 
-        self.bounds_latlng = bounds_latlng
+    def get_mesh_data(self, mesh_code):
+        """指定したメッシュコードのメッシュを返す（初回の参照時にデコードする）
+
+        Args:
+            mesh_code (int): メッシュコード
+
+        Returns:
+            MeshData: メタデータと標高値（np.array）
+
+        """
+        if mesh_code not in self.mesh_code_list:
+            raise Exception(f"メッシュが存在しません。mesh_code={mesh_code}")
+        index = self.mesh_code_list.index(mesh_code)
+        if index not in self._loaded_mesh_data:
+            with self.profiler.stage("parse_xml") as record:
+                self._loaded_mesh_data[index] = next(self._load_mesh_data([index]))
+                record["cells"] = self._loaded_mesh_data[index].np_array.size
+        return self._loaded_mesh_data[index]
+
+    @property
+    def mesh_data_list(self):
+        """全メッシュのリスト（xmlのパス順）
+
+        Notes:
+            初回の参照時に全メッシュをデコードして保持する
+            全メッシュを保持しないで済むよう、可能な限りiter_mesh_dataを使用すること
+
+        """
+        pending_indexes = [
+            index for index in range(len(self.index_entries))
+            if index not in self._loaded_mesh_data]
+        if pending_indexes:
+            with self.profiler.stage("parse_xml") as record:
+                for index, mesh_data in zip(
+                        pending_indexes, self._load_mesh_data(pending_indexes)):
+                    self._loaded_mesh_data[index] = mesh_data
+                record["cells"] = sum(
+                    [self._loaded_mesh_data[index].np_array.size
+                     for index in pending_indexes])
+        return [
+            self._loaded_mesh_data[index]
+            for index in range(len(self.index_entries))]
 
     @staticmethod
     def _get_np_array(content):
@@ -281,6 +708,8 @@ class Dem:
             dict: メッシュコードと標高値（np.array）を格納した辞書
 
         """
+        import numpy as np
+
         mesh_code = content["mesh_code"]
         meta_data = content["meta_data"]
         elevation = content["elevation"]["items"]
@@ -296,25 +725,13 @@ class Dem:
         start_point_y = meta_data["start_point"]["y"]
 
         # 標高を格納
-        # データの並びは北西端から南東端に向かっているので行毎に座標を配列に入れていく
-        index = 0
-        for y in range(start_point_y, y_length):
-            for x in range(start_point_x, x_length):
-                try:
-                    insert_value = float(elevation[index])
-                    array[y][x] = insert_value
-                # データの行数とグリッドのサイズは必ずしもピッタリ合うわけではないのでインデックスのサイズをはみ出したらループを停止
-                except IndexError:
-                    break
-                index += 1
-            start_point_x = 0
+        # データの並びは北西端から南東端に向かっているので、初期位置からの1次元の並びとして一括で代入する
+        # データの行数とグリッドのサイズは必ずしもピッタリ合うわけではないので、はみ出した分は切り捨てる
+        flat_array = array.reshape(-1)
+        start_index = min(start_point_y * x_length + start_point_x, flat_array.size)
+        values = elevation[:flat_array.size - start_index]
+        flat_array[start_index:start_index + values.size] = values
 
         np_array = {"mesh_code": mesh_code, "np_array": array}
 
         return np_array
-
-    def _store_np_array_list(self):
-        """Demからメッシュコードと標高値のnp.arrayを格納した辞書のリストを作成する"""
-        self.np_array_list = [
-            self._get_np_array(content) for content in self.all_content_list
-        ]
@@ -1,15 +1,85 @@
+import json
+import math
+from dataclasses import dataclass
 from pathlib import Path
 
 from osgeo import gdal, osr
 import numpy as np
 
 from .helpers import (
-    convert_height_to_R,
-    convert_height_to_G,
-    convert_height_to_B,
+    NO_DATA_RGB,
+    convert_height_to_rgb,
+    iter_rgb_blocks,
     warp
 )
 
+# 配列からGeoTiffへ書き込む際の1回あたりの行数（memmapの配列も少しずつ読み込めるようにする）
+BLOCK_ROWS = 256
+
+# 成果物に含まれるメッシュのメッシュコードと、xmlの内容のハッシュ値を記録するメタデータのキー
+MESH_METADATA_KEY = "FGD_MESHES"
+
+
+@dataclass
+class Product:
+    """書き出すGeoTiff（成果物）の種類を表すクラス
+
+    Notes:
+        rgbify=Trueの場合はterrain rgb（3バンド・Byte）、それ以外は標高値（1バンド・Float32）を書き出す
+        epsgがEPSG:4326以外の場合は、メモリ上のEPSG:4326のデータから投影変換して書き出す
+
+    """
+
+    file_name: str = "output.tif"
+    rgbify: bool = False
+    epsg: str = "EPSG:4326"
+    # Cloud Optimized GeoTiffとして書き出す場合の設定
+    cog: bool = False
+    compress: str = "DEFLATE"
+    max_z_error: float = None
+    overview_resampling: str = None
+
+    @property
+    def band_count(self):
+        return 3 if self.rgbify else 1
+
+    @property
+    def dtype(self):
+        return gdal.GDT_Byte if self.rgbify else gdal.GDT_Float32
+
+    @property
+    def reproject(self):
+        return not self.epsg == "EPSG:4326"
+
+    def make_cog_options(self):
+        """COGドライバの作成オプションを作成する
+
+        Returns:
+            list: COGドライバの作成オプション
+
+        Notes:
+            terrain rgbは平均すると別の標高値になってしまうため、オーバービューの既定のリサンプリングはNEARESTとする
+            LERCの許容誤差（MAX_Z_ERROR）は標高値にのみ設定し、terrain rgbは可逆のままとする
+
+        """
+        overview_resampling = self.overview_resampling
+        if overview_resampling is None:
+            overview_resampling = "NEAREST" if self.rgbify else "AVERAGE"
+
+        options = [
+            f"COMPRESS={self.compress}",
+            "NUM_THREADS=ALL_CPUS",
+            "OVERVIEWS=AUTO",
+            f"OVERVIEW_RESAMPLING={overview_resampling}",
+            "BIGTIFF=IF_SAFER",
+        ]
+        if self.compress.startswith("LERC"):
+            if self.max_z_error is not None and not self.rgbify:
+                options.append(f"MAX_Z_ERROR={self.max_z_error}")
+        elif not self.compress == "NONE":
+            options.append("PREDICTOR=YES")
+        return options
+
 
 class Geotiff:
     """GeoTiffを生成するためのクラス"""
@@ -24,7 +94,7 @@ class Geotiff:
         """イニシャライザ
         Args:
             geo_transform (list): GdalのDatasetクラスでSetGeoTransformするための情報
-            np_array ():
+            np_array (): メッシュ毎に書き込む（open_product・write_block）場合はNone
             x_length (int):
             y_length (int):
             output_path (Path):
@@ -53,27 +123,23 @@ class Geotiff:
             dst_ds (gdalのドライバ):
             no_data_value (int):
         """
+        # 配列全体を一度に変換・コピーしないよう、行のブロック毎にセットする
+        # self.np_arrayは書き換えないので、同じインスタンスで続けて別のGeoTiffを書き出せる
         if rgbify:
-            func_R = np.frompyfunc(convert_height_to_R, 1, 1)
-            func_G = np.frompyfunc(convert_height_to_G, 2, 1)
-            func_B = np.frompyfunc(convert_height_to_B, 3, 1)
-
-            r_arr = func_R(self.np_array)
-            g_arr = func_G(self.np_array, r_arr)
-            b_arr = func_B(self.np_array, r_arr, g_arr)
-
-            self.np_array = np.array([r_arr, g_arr, b_arr])
-
-            # 3バンドにnumpyのarrayをセット
-            for band in range(1, band_count + 1):
-                raster_band = dst_ds.GetRasterBand(band)
-                raster_band.WriteArray(self.np_array[band - 1])
+            for row_start, rgb_block in iter_rgb_blocks(
+                    self.np_array, BLOCK_ROWS, no_data_value):
+                # 3バンドにnumpyのarrayをセット
+                for band in range(1, band_count + 1):
+                    raster_band = dst_ds.GetRasterBand(band)
+                    raster_band.WriteArray(rgb_block[band - 1], 0, row_start)
 
         else:
-            # 作成したラスターの第一バンドを取得し、numpyのarrayをセット
+            # 作成したラスターの第一バンドを取得し、nodataを設定
             raster_band = dst_ds.GetRasterBand(1)
-            raster_band.WriteArray(self.np_array)
             raster_band.SetNoDataValue(no_data_value)
+            for row_start in range(0, self.y_length, BLOCK_ROWS):
+                block = self.np_array[row_start:row_start + BLOCK_ROWS]
+                raster_band.WriteArray(block, 0, row_start)
 
     def write(
         self,
@@ -91,19 +157,7 @@ class Geotiff:
             no_data_value (int):
             rgbify (bool):
         """
-        if not self.output_path.exists():
-            self.output_path.mkdir()
-        created_tiff_path = self.output_path / file_name
-
-        driver = gdal.GetDriverByName("GTiff")
-        dst_ds = driver.Create(
-            str(created_tiff_path.resolve()),
-            self.x_length,
-            self.y_length,
-            band_count,
-            dtype
-        )
-        dst_ds.SetGeoTransform(self.geo_transform)
+        dst_ds = self.create(band_count, dtype, file_name)
 
         self.make_raster_bands(
             rgbify,
@@ -112,32 +166,287 @@ class Geotiff:
             no_data_value
         )
 
+        # ディスクへの書き出し
+        dst_ds.FlushCache()
+
+    def create(self, band_count, dtype, file_name="output.tif", in_memory=False):
+        """座標とグリッドサイズを設定した空のGeoTiffを作成
+        Args:
+            band_count (int):
+            dtype (gdalのピクセルデータタイプ):
+            file_name (str):
+            in_memory (bool): Trueの場合はファイルを作成せず、GDALのMEMデータセットを作成する
+        Returns:
+            gdal.Dataset: 作成したGeoTiffのデータセット
+        Notes:
+            部分的な書き込みでメモリ使用量を抑えられるようにタイル化し、4GBを超える場合はBigTIFFで作成する
+        """
+        if in_memory:
+            driver = gdal.GetDriverByName("MEM")
+            dst_ds = driver.Create(
+                "",
+                self.x_length,
+                self.y_length,
+                band_count,
+                dtype
+            )
+        else:
+            if not self.output_path.exists():
+                self.output_path.mkdir()
+            created_tiff_path = self.output_path / file_name
+
+            driver = gdal.GetDriverByName("GTiff")
+            dst_ds = driver.Create(
+                str(created_tiff_path.resolve()),
+                self.x_length,
+                self.y_length,
+                band_count,
+                dtype,
+                options=["TILED=YES", "BIGTIFF=IF_SAFER"]
+            )
+        dst_ds.SetGeoTransform(self.geo_transform)
+
         ref = osr.SpatialReference()
         ref.ImportFromEPSG(4326)
         dst_ds.SetProjection(ref.ExportToWkt())
 
-        # ディスクへの書き出し
+        return dst_ds
+
+    @staticmethod
+    def fill_no_data(dst_ds, rgbify, no_data_value=-9999):
+        """メッシュが存在しない範囲のために、データセット全体をnodataで埋める
+        Args:
+            dst_ds (gdal.Dataset):
+            rgbify (bool):
+            no_data_value (int):
+        """
+        if rgbify:
+            for band, fill_value in enumerate(NO_DATA_RGB, start=1):
+                dst_ds.GetRasterBand(band).Fill(fill_value)
+        else:
+            raster_band = dst_ds.GetRasterBand(1)
+            raster_band.SetNoDataValue(no_data_value)
+            raster_band.Fill(no_data_value)
+
+    @staticmethod
+    def make_band_arrays(np_array, rgbify, no_data_value=-9999):
+        """標高値の配列から、バンド毎に書き込む配列を作成する
+        Args:
+            np_array (numpy.ndarray): 標高値の配列
+            rgbify (bool):
+            no_data_value (int):
+        Returns:
+            numpy.ndarray: (バンド数, 行数, 列数)の配列
+        """
+        if rgbify:
+            return convert_height_to_rgb(np_array, no_data_value)
+        return np_array[np.newaxis]
+
+    @staticmethod
+    def write_block(dst_ds, band_arrays, x_offset, y_offset):
+        """バンド毎の配列をデータセットの指定した位置に書き込む
+        Args:
+            dst_ds (gdal.Dataset):
+            band_arrays (numpy.ndarray): (バンド数, 行数, 列数)の配列
+            x_offset (int): 書き込みを開始する列
+            y_offset (int): 書き込みを開始する行
+        """
+        for band, band_array in enumerate(band_arrays, start=1):
+            dst_ds.GetRasterBand(band).WriteArray(
+                band_array, x_offset, y_offset)
+
+    @staticmethod
+    def merge_block(dst_ds, band_arrays, x_offset, y_offset, mask):
+        """バンド毎の配列のうち、maskがTrueのセルのみをデータセットに書き込む
+        Args:
+            dst_ds (gdal.Dataset):
+            band_arrays (numpy.ndarray): (バンド数, 行数, 列数)の配列
+            x_offset (int): 書き込みを開始する列
+            y_offset (int): 書き込みを開始する行
+            mask (numpy.ndarray): 書き込むセルをTrueとした(行数, 列数)の配列
+        Notes:
+            書き込み済みの範囲を読み込んで合成するため、maskがFalseのセルは元の値のまま残る
+        """
+        y_size, x_size = mask.shape
+        for band, band_array in enumerate(band_arrays, start=1):
+            raster_band = dst_ds.GetRasterBand(band)
+            current = raster_band.ReadAsArray(x_offset, y_offset, x_size, y_size)
+            raster_band.WriteArray(
+                np.where(mask, band_array, current), x_offset, y_offset)
+
+    @staticmethod
+    def _get_cog_source_name(product):
+        """COGに変換する前の、一時的なGeoTiffのファイル名を返す
+        Args:
+            product (Product):
+        Returns:
+            str: 一時的なGeoTiffのファイル名
+        """
+        return f".{product.file_name}.tmp.tif"
+
+    def open_product(self, product, no_data_value=-9999):
+        """成果物を書き込むための、nodataで埋めたデータセットを作成する
+        Args:
+            product (Product):
+            no_data_value (int):
+        Returns:
+            gdal.Dataset: 作成したデータセット（投影変換する場合はMEMデータセット）
+        Notes:
+            COGは作成後に書き込めないため、一時的なタイル化GeoTiffに書き込んでからclose_productで変換する
+        """
+        file_name = product.file_name
+        if product.cog and not product.reproject:
+            file_name = self._get_cog_source_name(product)
+        dst_ds = self.create(
+            product.band_count,
+            product.dtype,
+            file_name,
+            in_memory=product.reproject)
+        self.fill_no_data(dst_ds, product.rgbify, no_data_value)
+        return dst_ds
+
+    def open_existing_product(self, product):
+        """既存の成果物を、書き換えるために更新モードで開く
+        Args:
+            product (Product):
+        Returns:
+            gdal.Dataset: 更新モードで開いたデータセット
+        Notes:
+            画像の大きさ・バンド数・geo_transformが、これから書き込むメッシュの配置と一致することを確認する
+        """
+        if product.reproject or product.cog:
+            raise Exception(
+                f"既存の成果物の更新は、投影変換なし・COGなしのGeoTiffのみ対応しています。file_name={product.file_name}")
+
+        product_path = self.output_path / product.file_name
+        if not product_path.exists():
+            raise Exception(f"更新する成果物が存在しません：{product_path}")
+        dst_ds = gdal.Open(str(product_path.resolve()), gdal.GA_Update)
+        if dst_ds is None:
+            raise Exception(f"成果物を開けませんでした：{product_path}")
+
+        geo_transform = dst_ds.GetGeoTransform()
+        if not (
+            dst_ds.RasterXSize == self.x_length
+            and dst_ds.RasterYSize == self.y_length
+            and dst_ds.RasterCount == product.band_count
+            and all(
+                math.isclose(actual, expected, rel_tol=1e-9, abs_tol=1e-12)
+                for actual, expected in zip(geo_transform, self.geo_transform)
+            )
+        ):
+            raise Exception(
+                f"既存の成果物の範囲がメッシュの配置と一致しません：{product_path}。"
+                f"geo_transform={geo_transform}・expected={self.geo_transform}")
+        return dst_ds
+
+    @staticmethod
+    def get_mesh_hashes(dst_ds):
+        """データセットのメタデータから、メッシュコードとハッシュ値の対応を読み込む
+        Args:
+            dst_ds (gdal.Dataset):
+        Returns:
+            dict: メッシュコードとハッシュ値の辞書（記録されていない場合は空）
+        """
+        mesh_hashes = dst_ds.GetMetadataItem(MESH_METADATA_KEY)
+        if not mesh_hashes:
+            return {}
+        return {
+            int(mesh_code): content_hash
+            for mesh_code, content_hash in json.loads(mesh_hashes).items()
+        }
+
+    @staticmethod
+    def set_mesh_hashes(dst_ds, mesh_hashes):
+        """メッシュコードとハッシュ値の対応をデータセットのメタデータに記録する
+        Args:
+            dst_ds (gdal.Dataset):
+            mesh_hashes (dict): メッシュコードとハッシュ値の辞書
+        Notes:
+            投影変換・COGへの変換ではメタデータが引き継がれるため、書き込み先のデータセットに記録すればよい
+        """
+        dst_ds.SetMetadataItem(
+            MESH_METADATA_KEY,
+            json.dumps(
+                {str(mesh_code): mesh_hashes[mesh_code]
+                 for mesh_code in sorted(mesh_hashes)}))
+
+    def close_product(
+            self,
+            dst_ds,
+            product,
+            no_data_value=-9999,
+            warp_memory_limit=None):
+        """書き込みが完了したデータセットを書き出す（必要に応じて投影変換する）
+        Args:
+            dst_ds (gdal.Dataset): open_productで作成したデータセット
+            product (Product):
+            no_data_value (int):
+            warp_memory_limit (int): 投影変換で使用するメモリの上限（MB）
+        Returns:
+            Path or None: 削除が必要な一時的なGeoTiffのパス（COGに変換した場合のみ）
+        Notes:
+            一時的なGeoTiffは、呼び出し元がデータセットへの参照を全て手放してから、delete_datasetで削除すること
+            （開いたままのファイルを削除すると、Windowsでは失敗し、最後の書き込みが失われる場合がある）
+        """
         dst_ds.FlushCache()
+        if product.reproject:
+            self.resampling(
+                file_name=product.file_name,
+                epsg=product.epsg,
+                no_data_value=no_data_value,
+                source_ds=dst_ds,
+                warp_memory_limit=warp_memory_limit,
+                cog_options=product.make_cog_options() if product.cog else None)
+
+        elif product.cog:
+            created_cog_path = self.output_path / product.file_name
+            cog_ds = gdal.Translate(
+                str(created_cog_path.resolve()),
+                dst_ds,
+                format="COG",
+                creationOptions=product.make_cog_options())
+            cog_ds.FlushCache()
+            return self.output_path / self._get_cog_source_name(product)
+
+        return None
+
+    @staticmethod
+    def delete_dataset(dataset_path):
+        """閉じたGeoTiffを、付随するファイルも含めて削除する
+        Args:
+            dataset_path (Path): 削除するGeoTiffのパス
+        """
+        gdal.GetDriverByName("GTiff").Delete(str(Path(dataset_path).resolve()))
 
     def resampling(
             self,
             source_path=None,
             file_name="output.tif",
             epsg="EPSG:3857",
-            no_data_value=-9999):
+            no_data_value=-9999,
+            source_ds=None,
+            warp_memory_limit=None,
+            cog_options=None):
         """EPSG:4326のTiffから新たなGeoTiffを出力する
         Args:
             source_path (Path):
             file_name (str):
             epsg (str):
             no_data_value (int):
+            source_ds (gdal.Dataset): EPSG:4326のデータセット。指定した場合はファイルを読み直さずに投影変換する
+            warp_memory_limit (int): 投影変換で使用するメモリの上限（MB）
+            cog_options (list): 指定した場合はこの作成オプションでCOGとして書き出す
         """
-        if source_path is None:
+        if source_path is None and source_ds is None:
             source_path = self.output_path / file_name
         warp(
             source_path=source_path,
             file_name=file_name,
             epsg=epsg,
             output_path=self.output_path,
-            no_data_value=no_data_value
+            no_data_value=no_data_value,
+            source_ds=source_ds,
+            warp_memory_limit=warp_memory_limit,
+            cog_options=cog_options
         )
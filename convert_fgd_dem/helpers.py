@@ -1,3 +1,4 @@
+import numpy as np
 from osgeo import gdal
 
 
@@ -6,7 +7,10 @@ def warp(
         file_name="output.tif",
         output_path=None,
         epsg="EPSG:3857",
-        no_data_value="None"):
+        no_data_value="None",
+        source_ds=None,
+        warp_memory_limit=None,
+        cog_options=None):
     """
     EPSG:4326のTiffから新たなGeoTiffを出力する
     Args:
@@ -15,28 +19,59 @@ def warp(
         output_path (Path or None):
         epsg (str):
         no_data_value (int):
+        source_ds (gdal.Dataset or None): 変換元のデータセット。指定した場合はsource_pathを読まずにこちらを投影変換する
+        warp_memory_limit (int or None): 投影変換で使用するメモリの上限（MB）。Noneの場合はGDALの既定値
+        cog_options (list or None): 指定した場合はこの作成オプションでCOG（Cloud Optimized GeoTiff）として書き出す
+    Returns:
+        gdal.Dataset: 投影変換したデータセット
+    Notes:
+        投影変換は全CPUを使用してマルチスレッドで行う
+        output_pathがNoneの場合はファイルを作成せず、GDALのMEMデータセットに投影変換する（source_dsの指定が必要）
     """
+    warp_options = {
+        "multithread": True,
+        "warpOptions": ["NUM_THREADS=ALL_CPUS"],
+    }
+    if warp_memory_limit is not None:
+        warp_options["warpMemoryLimit"] = warp_memory_limit
 
-    if not output_path.exists():
-        output_path.mkdir()
-    if source_path is None:
-        source_path = output_path / file_name
+    if output_path is None:
+        if source_ds is None or cog_options is not None:
+            raise Exception("メモリ上での投影変換には変換元のデータセットが必要です（COGは作成できません）")
+        warp_path = ""
+        warp_options["format"] = "MEM"
+    else:
+        if not output_path.exists():
+            output_path.mkdir()
+        if source_path is None:
+            source_path = output_path / file_name
 
-    if file_name is None:
-        file_name = "".join(f"dem_{epsg.lower()}.tif".split(":"))
+        if file_name is None:
+            file_name = "".join(f"dem_{epsg.lower()}.tif".split(":"))
 
-    warp_path = str((output_path / file_name).resolve())
-    src_path = str(source_path.resolve())
+        warp_path = str((output_path / file_name).resolve())
+        if source_ds is None:
+            source_ds = str(source_path.resolve())
+
+        if cog_options is not None:
+            warp_options["format"] = "COG"
+            warp_options["creationOptions"] = cog_options
 
     resampled_ras = gdal.Warp(
         warp_path,
-        src_path,
+        source_ds,
         srcSRS="EPSG:4326",
         dstSRS=epsg,
         dstNodata=no_data_value,
-        resampleAlg="near"
+        resampleAlg="near",
+        **warp_options
     )
     resampled_ras.FlushCache()
+    return resampled_ras
+
+
+# nodataを標高値0として計算したterrain rgbの値
+NO_DATA_RGB = (1, 134, 160)
 
 
 def convert_height_to_R(height, no_data_value=-9999):
@@ -66,3 +101,120 @@ def convert_height_to_B(height, r_value, g_value, no_data_value=-9999):
     g_min_height = 256
     offset_height = int(height * 10) + 100000
     return offset_height - r_value * r_min_height - g_value * g_min_height
+
+
+def convert_height_to_rgb(height_array, no_data_value=-9999):
+    """標高値の配列をterrain rgbのR・G・Bの3バンドの配列（uint8）に一括で変換する
+
+    Args:
+        height_array (numpy.ndarray): 標高値の配列
+        no_data_value (int): nodataとして扱う標高値
+
+    Returns:
+        numpy.ndarray: R・G・Bの順に並んだ(3, 行数, 列数)の配列
+
+    Notes:
+        convert_height_to_R/G/Bを1画素ずつ呼び出した場合と同じ値になる
+        int(height * 10)と一致させるため、float64で計算してから0方向に切り捨てている
+
+    """
+    r_min_height = 65536
+    g_min_height = 256
+    height_array = np.asarray(height_array)
+
+    offset_height = np.trunc(
+        height_array.astype(np.float64) * 10).astype(np.int64) + 100000
+    r_array = offset_height // r_min_height
+    g_array = (offset_height - r_array * r_min_height) // g_min_height
+    b_array = offset_height - r_array * r_min_height - g_array * g_min_height
+
+    rgb_array = np.stack((r_array, g_array, b_array)).astype(np.uint8)
+
+    # nodataを標高値0として計算
+    no_data_mask = height_array == no_data_value
+    for band_index, no_data_rgb in enumerate(NO_DATA_RGB):
+        rgb_array[band_index][no_data_mask] = no_data_rgb
+
+    return rgb_array
+
+
+def iter_rgb_blocks(height_array, block_rows=256, no_data_value=-9999):
+    """標高値の配列を行のブロック毎にterrain rgbに変換する
+
+    Args:
+        height_array (numpy.ndarray): 標高値の配列（np.memmapも可）
+        block_rows (int): 1ブロックあたりの行数
+        no_data_value (int): nodataとして扱う標高値
+
+    Yields:
+        tuple: ブロックの開始行と、R・G・Bの順に並んだ(3, 行数, 列数)の配列
+
+    """
+    for row_start in range(0, height_array.shape[0], block_rows):
+        block = height_array[row_start:row_start + block_rows]
+        yield row_start, convert_height_to_rgb(block, no_data_value)
+
+
+def sum_to_grid(np_array, row_indexes, column_indexes, no_data_value=-9999):
+    """細かい配列を、nodataを除いた合計とセル数で粗いグリッドに集約する
+
+    Args:
+        np_array (numpy.ndarray): 標高値の配列
+        row_indexes (numpy.ndarray): 各行が属する集約先の行（単調増加）
+        column_indexes (numpy.ndarray): 各列が属する集約先の列（単調増加）
+        no_data_value (int): nodataとして扱う標高値
+
+    Returns:
+        tuple: 集約後の合計（float64）と有効なセル数（int64）の配列
+
+    Notes:
+        集約先の行・列が連続する範囲毎にnp.add.reduceatで合計するため、ループを使わずに計算できる
+        集約先のセルの大きさは元のセルの整数倍でなくてもよい
+
+    """
+    valid = np_array != no_data_value
+    values = np.where(valid, np_array, 0).astype(np.float64)
+    counts = valid.astype(np.int64)
+
+    row_starts = np.flatnonzero(np.r_[True, row_indexes[1:] != row_indexes[:-1]])
+    column_starts = np.flatnonzero(
+        np.r_[True, column_indexes[1:] != column_indexes[:-1]])
+    for starts, axis in ((row_starts, 0), (column_starts, 1)):
+        values = np.add.reduceat(values, starts, axis=axis)
+        counts = np.add.reduceat(counts, starts, axis=axis)
+    return values, counts
+
+
+def average_sums(values, counts, no_data_value=-9999):
+    """sum_to_gridで集約した合計とセル数から平均を算出する
+
+    Args:
+        values (numpy.ndarray): 合計の配列
+        counts (numpy.ndarray): 有効なセル数の配列
+        no_data_value (int): nodataとして扱う標高値
+
+    Returns:
+        numpy.ndarray: 平均の配列（有効な値が1つもないセルはnodata）
+
+    """
+    averaged = np.full(values.shape, no_data_value, dtype=np.float32)
+    has_value = counts > 0
+    averaged[has_value] = values[has_value] / counts[has_value]
+    return averaged
+
+
+def average_to_grid(np_array, row_indexes, column_indexes, no_data_value=-9999):
+    """細かい配列を、nodataを除いた平均で粗いグリッドに集約する
+
+    Args:
+        np_array (numpy.ndarray): 標高値の配列
+        row_indexes (numpy.ndarray): 各行が属する集約先の行（単調増加）
+        column_indexes (numpy.ndarray): 各列が属する集約先の列（単調増加）
+        no_data_value (int): nodataとして扱う標高値
+
+    Returns:
+        numpy.ndarray: 集約後の配列（有効な値が1つもないセルはnodata）
+
+    """
+    values, counts = sum_to_grid(np_array, row_indexes, column_indexes, no_data_value)
+    return average_sums(values, counts, no_data_value)
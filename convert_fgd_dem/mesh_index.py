@@ -0,0 +1,211 @@
+import hashlib
+import xml.etree.ElementTree as et
+from dataclasses import dataclass
+
+DATASET_NAME_SPACE = "{http://fgd.gsi.go.jp/spec/2008/FGD_GMLSchema}"
+GML_NAME_SPACE = "{http://www.opengis.net/gml/3.2}"
+
+# 読み取り対象の要素のタグと、生のメタデータを格納する辞書のKeyの対応
+METADATA_TAGS = {
+    DATASET_NAME_SPACE + "mesh": "mesh_code",
+    GML_NAME_SPACE + "lowerCorner": "lower_corner",
+    GML_NAME_SPACE + "upperCorner": "upper_corner",
+    GML_NAME_SPACE + "high": "grid_length",
+    GML_NAME_SPACE + "startPoint": "start_point",
+}
+TUPLE_LIST_TAG = GML_NAME_SPACE + "tupleList"
+
+# ヘッダー（gml:tupleListより前）に含まれる要素
+HEADER_KEYS = ("mesh_code", "lower_corner", "upper_corner", "grid_length")
+
+
+class HashingReader:
+    """読み込んだバイト列から、xmlの内容のハッシュ値を同時に算出するファイルオブジェクトのラッパー
+
+    Notes:
+        解析しながらハッシュ値を算出できるため、ハッシュ値のためだけにxmlを読み直さずに済む
+
+    """
+
+    def __init__(self, file):
+        """イニシャライザ
+
+        Args:
+            file: バイナリモードで開いたファイルオブジェクト
+
+        """
+        self.file = file
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        chunk = self.file.read(size)
+        self.sha256.update(chunk)
+        return chunk
+
+    def hexdigest(self):
+        """ファイルの末尾まで読み込み、内容のSHA-256（16進数）を返す"""
+        for _ in iter(lambda: self.read(1024 * 1024), b""):
+            pass
+        return self.sha256.hexdigest()
+
+
+def content_hash(xml_path):
+    """xmlの内容のハッシュ値を算出する
+
+    Args:
+        xml_path (Path or ZipMember): xmlのパスオブジェクト
+
+    Returns:
+        str: xmlの内容のSHA-256（16進数）
+
+    """
+    with xml_path.open("rb") as xml_file:
+        return HashingReader(xml_file).hexdigest()
+
+
+@dataclass(frozen=True)
+class IndexEntry:
+    """索引に登録する1メッシュ分の情報"""
+
+    mesh_code: int
+    xml_path: object
+    lower_corner: dict
+    upper_corner: dict
+    grid_length: dict
+
+    @property
+    def pixel_size(self):
+        """ピクセルサイズ（Dem._format_metadataと同じ計算）"""
+        return {
+            "x": (self.upper_corner["lon"] - self.lower_corner["lon"]) / self.grid_length["x"],
+            "y": (self.lower_corner["lat"] - self.upper_corner["lat"]) / self.grid_length["y"],
+        }
+
+    def intersects(self, bbox):
+        """メッシュの範囲が指定した範囲と重なるかを判定する
+
+        Args:
+            bbox (tuple): 範囲（最小経度, 最小緯度, 最大経度, 最大緯度）
+
+        Returns:
+            bool: 重なる場合はTrue（辺が接するだけの場合はFalse）
+
+        """
+        min_lon, min_lat, max_lon, max_lat = bbox
+        return (
+            self.lower_corner["lon"] < max_lon
+            and self.upper_corner["lon"] > min_lon
+            and self.lower_corner["lat"] < max_lat
+            and self.upper_corner["lat"] > min_lat
+        )
+
+
+class MeshIndex:
+    """xmlのヘッダーのみを読み込み、メッシュコード・xmlのパス・範囲の索引を作成するクラス"""
+
+    def __init__(self, xml_paths):
+        """イニシャライザ
+
+        Args:
+            xml_paths (list): xmlのパスオブジェクト（Path or ZipMember）のリスト
+
+        """
+        self.entries: list = [self.scan_xml_header(xml_path) for xml_path in xml_paths]
+
+    @classmethod
+    def from_entries(cls, entries):
+        """作成済みのIndexEntryから、xmlを読み込まずに索引を作成する
+
+        Args:
+            entries (list): IndexEntryのリスト
+
+        Returns:
+            MeshIndex:
+
+        """
+        mesh_index = cls([])
+        mesh_index.entries = list(entries)
+        return mesh_index
+
+    @staticmethod
+    def scan_xml_header(xml_path):
+        """xmlのヘッダーのみを読み込んで、メッシュコードと範囲を取得する
+
+        Args:
+            xml_path (Path or ZipMember): xmlのパスオブジェクト
+
+        Returns:
+            IndexEntry: メッシュコード・xmlのパス・範囲
+
+        Notes:
+            gml:tupleListの開始タグで読み込みを打ち切るため、標高値の部分はほとんど読み込まれない
+
+        """
+        raw_metadata = {}
+        with xml_path.open("rb") as xml_file:
+            for event, element in et.iterparse(xml_file, events=("start", "end")):
+                if event == "start":
+                    if element.tag == TUPLE_LIST_TAG:
+                        break
+                    continue
+                key = METADATA_TAGS.get(element.tag)
+                if key in HEADER_KEYS and key not in raw_metadata:
+                    raw_metadata[key] = element.text
+                element.clear()
+
+        missing_keys = [key for key in HEADER_KEYS if key not in raw_metadata]
+        if missing_keys:
+            raise Exception(f"xmlに必要な要素が存在しません：{xml_path}")
+
+        lowers = raw_metadata["lower_corner"].split(" ")
+        uppers = raw_metadata["upper_corner"].split(" ")
+        grids = raw_metadata["grid_length"].split(" ")
+        return IndexEntry(
+            mesh_code=int(raw_metadata["mesh_code"]),
+            xml_path=xml_path,
+            lower_corner={"lat": float(lowers[0]), "lon": float(lowers[1])},
+            upper_corner={"lat": float(uppers[0]), "lon": float(uppers[1])},
+            grid_length={"x": int(grids[0]) + 1, "y": int(grids[1]) + 1},
+        )
+
+    def query(self, bbox=None, mesh_codes=None):
+        """範囲・メッシュコードに該当するメッシュを返す
+
+        Args:
+            bbox (tuple): 範囲（最小経度, 最小緯度, 最大経度, 最大緯度）。Noneの場合は範囲で絞り込まない
+            mesh_codes (list): メッシュコードのリスト。Noneの場合はメッシュコードで絞り込まない
+
+        Returns:
+            list: 該当するIndexEntryのリスト
+
+        """
+        entries = self.entries
+        if mesh_codes is not None:
+            mesh_code_set = {int(mesh_code) for mesh_code in mesh_codes}
+            entries = [
+                entry for entry in entries if entry.mesh_code in mesh_code_set]
+        if bbox is not None:
+            entries = [entry for entry in entries if entry.intersects(bbox)]
+        return entries
+
+    @staticmethod
+    def get_bounds_latlng(entries):
+        """メッシュ全体を包括する緯度経度の最大・最小値を取得する
+
+        Args:
+            entries (list): IndexEntryのリスト
+
+        Returns:
+            dict: 左下と右上の緯度経度（Dem.bounds_latlngと同じ形式）
+
+        """
+        return {
+            "lower_left": {
+                "lat": min([entry.lower_corner["lat"] for entry in entries]),
+                "lon": min([entry.lower_corner["lon"] for entry in entries]),
+            },
+            "upper_right": {
+                "lat": max([entry.upper_corner["lat"] for entry in entries]),
+                "lon": max([entry.upper_corner["lon"] for entry in entries]),
+            },
+        }
@@ -0,0 +1,204 @@
+import json
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:
+    # Windowsにはresourceモジュールが存在しないため、CPU時間とメモリ使用量は記録しない
+    resource = None
+
+
+def _get_max_rss_mb():
+    """プロセス開始からの最大常駐メモリ（MB）を返す"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOSはバイト、Linuxはキロバイト単位
+    if sys.platform == "darwin":
+        return max_rss / 1024 / 1024
+    return max_rss / 1024
+
+
+def _get_cpu_seconds():
+    """自プロセスと終了済みの子プロセス（プロセスプールのワーカー）のCPU時間の合計を返す"""
+    if resource is None:
+        return time.process_time()
+    cpu_seconds = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        cpu_seconds += usage.ru_utime + usage.ru_stime
+    return cpu_seconds
+
+
+def _get_io_bytes():
+    """自プロセスの読み込み・書き込みバイト数を返す
+
+    Returns:
+        tuple: 読み込み・書き込みバイト数（/proc/self/ioが存在しない環境ではNone）
+
+    Notes:
+        ページキャッシュへの読み書きも含むrchar・wcharを使用する
+
+    """
+    try:
+        with open("/proc/self/io", "r") as io_file:
+            counters = dict(
+                line.split(":", 1) for line in io_file.read().splitlines())
+    except OSError:
+        return None, None
+    return int(counters["rchar"]), int(counters["wchar"])
+
+
+class Profiler:
+    """処理の段階毎に、処理時間・メモリ使用量・入出力量を記録するクラス"""
+
+    def __init__(self, callbacks=None, keep_records=True):
+        """イニシャライザ
+
+        Args:
+            callbacks (list): 段階が終了する度に記録（dict）を渡して呼び出す関数のリスト
+            keep_records (bool): Falseの場合は記録をrecordsに保持せず、callbacksへの通知のみ行う
+
+        Notes:
+            集計（summarize）しない場合はkeep_records=Falseとし、長時間の実行で記録が増え続けないようにする
+
+        """
+        self.callbacks: list = list(callbacks or [])
+        self.keep_records: bool = keep_records
+        self.records: list = []
+
+    @contextmanager
+    def stage(self, name, cells=None):
+        """withで囲んだ処理を1つの段階として記録する
+
+        Args:
+            name (str): 段階の名前
+            cells (int): 処理したセル数（処理後に決まる場合は、返された記録の"cells"に設定する）
+
+        Yields:
+            dict: 段階の記録
+
+        Notes:
+            記録には「段階の名前・経過時間・CPU時間・最大常駐メモリ・読み込み/書き込みバイト数・セル数」が含まれる
+            CPU時間には、段階内で終了したプロセスプールのワーカーの分も含まれる
+            最大常駐メモリはプロセス開始からの最大値なので、それまでの段階の値を下回らない
+
+        """
+        record = {"stage": name, "cells": cells}
+        read_bytes, write_bytes = _get_io_bytes()
+        cpu_seconds = _get_cpu_seconds()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["wall_seconds"] = time.perf_counter() - start
+            record["cpu_seconds"] = _get_cpu_seconds() - cpu_seconds
+            record["max_rss_mb"] = _get_max_rss_mb()
+            end_read_bytes, end_write_bytes = _get_io_bytes()
+            record["read_bytes"] = (
+                None if read_bytes is None else end_read_bytes - read_bytes)
+            record["write_bytes"] = (
+                None if write_bytes is None else end_write_bytes - write_bytes)
+
+            if self.keep_records:
+                self.records.append(record)
+            for callback in self.callbacks:
+                callback(record)
+
+    def summarize(self):
+        """段階の名前毎に記録を集計する
+
+        Returns:
+            list: 段階の名前毎の集計結果（最初に記録された順）
+
+        """
+        summary = {}
+        for record in self.records:
+            total = summary.setdefault(
+                record["stage"],
+                {
+                    "stage": record["stage"],
+                    "count": 0,
+                    "cells": None,
+                    "wall_seconds": 0.0,
+                    "cpu_seconds": 0.0,
+                    "max_rss_mb": None,
+                    "read_bytes": None,
+                    "write_bytes": None,
+                })
+            total["count"] += 1
+            total["wall_seconds"] += record["wall_seconds"]
+            total["cpu_seconds"] += record["cpu_seconds"]
+            for key in ("cells", "read_bytes", "write_bytes"):
+                if record[key] is not None:
+                    total[key] = (total[key] or 0) + record[key]
+            if record["max_rss_mb"] is not None:
+                total["max_rss_mb"] = max(total["max_rss_mb"] or 0.0, record["max_rss_mb"])
+        return list(summary.values())
+
+    def print_summary(self):
+        """段階毎の集計結果を表示する"""
+        print(
+            f"{'stage':<16} {'count':>5} {'wall':>9} {'cpu':>9} {'cells/s':>14} "
+            f"{'max_rss':>10} {'read':>10} {'write':>10}")
+        for total in self.summarize():
+            cells_per_second = ""
+            if total["cells"] is not None and total["wall_seconds"] > 0:
+                cells_per_second = f"{total['cells'] / total['wall_seconds']:,.0f}"
+            max_rss_mb = "" if total["max_rss_mb"] is None else f"{total['max_rss_mb']:.1f}MB"
+            read_mb = ""
+            if total["read_bytes"] is not None:
+                read_mb = f"{total['read_bytes'] / 1024 / 1024:.1f}MB"
+            write_mb = ""
+            if total["write_bytes"] is not None:
+                write_mb = f"{total['write_bytes'] / 1024 / 1024:.1f}MB"
+            print(
+                f"{total['stage']:<16} {total['count']:>5} "
+                f"{total['wall_seconds']:>8.3f}s {total['cpu_seconds']:>8.3f}s "
+                f"{cells_per_second:>14} {max_rss_mb:>10} "
+                f"{read_mb:>10} {write_mb:>10}")
+
+
+class NullProfiler:
+    """何も計測・記録しないProfiler（計測を指定しない場合に、段階毎の計測の負荷を避けるために使用する）"""
+
+    callbacks: tuple = ()
+    records: tuple = ()
+
+    @staticmethod
+    def stage(name, cells=None):
+        """Profiler.stageと同じ形の記録を返すだけで、計測しないコンテキストマネージャーを返す
+
+        Args:
+            name (str): 段階の名前
+            cells (int): 処理したセル数
+
+        Returns:
+            contextlib.nullcontext: 段階の記録（dict）を返すコンテキストマネージャー
+
+        """
+        return nullcontext({"stage": name, "cells": cells})
+
+    @staticmethod
+    def summarize():
+        """記録がないため、常に空のリストを返す"""
+        return []
+
+
+def json_lines_callback(json_file):
+    """段階の記録を1行ずつJSONとして書き込むコールバックを作成する
+
+    Args:
+        json_file (file object): 書き込み先のファイルオブジェクト
+
+    Returns:
+        callable: Profilerのcallbacksに渡す関数
+
+    """
+    def write_record(record):
+        json_file.write(json.dumps(record) + "\n")
+        json_file.flush()
+
+    return write_record
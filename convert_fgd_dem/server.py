@@ -0,0 +1,538 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import uuid
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import click
+
+from convert_fgd_dem.mesh_index import MeshIndex
+
+# レスポンスを送信する単位（バイト）
+CHUNK_SIZE = 1024 * 1024
+# formatの指定毎の「terrain rgbにするか・ダウンロード時のファイル名」
+RESPONSE_FORMATS = {
+    "geotiff": (False, "output.tif"),
+    "terrain-rgb": (True, "rgbify.tif"),
+}
+STATUS_MESSAGES = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    422: "Unprocessable Entity",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+}
+
+
+class HttpError(Exception):
+    """HTTPのエラーレスポンスとして返す例外"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status: int = status
+        self.message: str = message
+
+
+class ResponseAborted(Exception):
+    """レスポンスの送信を開始した後に失敗した場合の例外
+
+    Notes:
+        ステータスとヘッダーは送信済みでエラーレスポンスを送り直せないため、接続を閉じるのみとする
+
+    """
+
+
+def encode_geotiff(dst_ds):
+    """データセットをGDALの仮想メモリ上のGeoTiffとして書き出す
+
+    Args:
+        dst_ds (gdal.Dataset): 書き出すデータセット
+
+    Returns:
+        str: 書き出したGeoTiffの仮想ファイルのパス（読み込み後にgdal.Unlinkで削除すること）
+
+    """
+    from osgeo import gdal
+
+    vsi_path = f"/vsimem/convert_fgd_dem/{uuid.uuid4().hex}.tif"
+    encoded_ds = gdal.Translate(
+        vsi_path,
+        dst_ds,
+        format="GTiff",
+        creationOptions=["TILED=YES", "COMPRESS=DEFLATE", "BIGTIFF=IF_SAFER"])
+    encoded_ds.FlushCache()
+    encoded_ds = None
+    return vsi_path
+
+
+def _parse_query(query):
+    """クエリ文字列をConverterのオプションとレスポンスの形式に変換する
+
+    Args:
+        query (str): クエリ文字列
+
+    Returns:
+        tuple: Converterに渡すオプション・terrain rgbにするか・EPSGコード・ファイル名
+
+    """
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+
+    response_format = params.get("format", "geotiff")
+    if response_format not in RESPONSE_FORMATS:
+        raise HttpError(
+            400, f"formatは{'・'.join(RESPONSE_FORMATS)}のいずれかを指定してください。format={response_format}")
+    rgbify, file_name = RESPONSE_FORMATS[response_format]
+
+    epsg = params.get("epsg", "EPSG:4326")
+    if not epsg.startswith("EPSG:"):
+        raise HttpError(400, "EPSGコードの指定が不正です。EPSG:〇〇の形式で入力してください")
+
+    converter_options = {}
+    try:
+        if "bbox" in params:
+            converter_options["bbox"] = [
+                float(value) for value in params["bbox"].split(",")]
+        if "mesh_codes" in params:
+            converter_options["mesh_codes"] = [
+                int(value) for value in params["mesh_codes"].split(",")]
+        if "resolution" in params:
+            converter_options["resolution"] = params["resolution"]
+    except ValueError as e:
+        raise HttpError(400, f"クエリの指定が不正です：{e}")
+    return converter_options, rgbify, epsg, file_name
+
+
+class ConvertServer:
+    """DEMの変換をHTTPで受け付けるasyncioのサーバー
+
+    Notes:
+        POST /convert はリクエストボディのzipを、GET /convert はarchive_dir内のzipをbboxなどで絞り込んで変換する
+        クエリでformat（geotiff・terrain-rgb）・epsg・bbox・mesh_codes・resolutionを指定できる
+        archive_dir内のzipの索引は起動時に作成し、zipの追加・更新・削除（更新日時の変化）があった場合のみ作り直す
+        GET /convert では、索引から該当するメッシュを含むzipのみをConverterに渡す
+        変換（xmlの解析・GeoTiffの作成）はスレッドプールで行い、同時に変換する数はmax_concurrencyまでに制限する
+        デコード済みのメッシュはメモリ上のLRUキャッシュに保持し、リクエスト間で再利用する
+        レスポンスはchunkedで少しずつ送信する
+
+    """
+
+    def __init__(
+            self,
+            archive_dir=None,
+            max_concurrency=2,
+            cache_size=256,
+            max_body_size=512,
+            warp_memory_limit=None):
+        """イニシャライザ
+
+        Args:
+            archive_dir (Path): GET /convert で変換対象とするzipが格納されたディレクトリ。Noneの場合はPOSTのみ受け付ける
+            max_concurrency (int): 同時に変換する数
+            cache_size (int): デコード済みのメッシュのキャッシュの合計サイズの上限（MB）
+            max_body_size (int): POSTで受け付けるzipのサイズの上限（MB）
+            warp_memory_limit (int): 投影変換で使用するメモリの上限（MB）
+
+        """
+        from convert_fgd_dem.cache import MemoryMeshCache
+
+        self.archive_dir: Path = None if archive_dir is None else Path(archive_dir)
+        self.max_concurrency: int = max_concurrency
+        self.max_body_size: int = max_body_size
+        self.warp_memory_limit: int = warp_memory_limit
+        self.cache: MemoryMeshCache = MemoryMeshCache(max_size=cache_size)
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=max_concurrency)
+        # archive_dir内のzip毎の「更新日時・IndexEntryのリスト」（_refresh_archive_indexで更新する）
+        self.archive_entries: dict = {}
+        self._archive_lock: threading.Lock = threading.Lock()
+        # イベントループ上で作成する必要があるため、startで作成する
+        self.semaphore: asyncio.Semaphore = None
+        self.server: asyncio.AbstractServer = None
+
+    async def start(self, host="127.0.0.1", port=8000):
+        """サーバーを起動する
+
+        Args:
+            host (str): 待ち受けるアドレス（既定はローカルホストのみ）
+            port (int): 待ち受けるポート（0の場合は空いているポート）
+
+        Returns:
+            asyncio.AbstractServer: 起動したサーバー
+
+        """
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self.archive_dir is not None:
+            # ヘッダーの読み込みで変換を待たせないよう、変換用とは別のスレッドで行う
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._refresh_archive_index)
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def close(self):
+        """サーバーを停止し、スレッドプールを終了する"""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+    async def handle(self, reader, writer):
+        """1つの接続で1つのリクエストを処理する
+
+        Args:
+            reader (asyncio.StreamReader):
+            writer (asyncio.StreamWriter):
+
+        """
+        try:
+            await self._handle_request(reader, writer)
+        except HttpError as e:
+            await self._send_text(writer, e.status, e.message)
+        except ResponseAborted:
+            # 送信途中のレスポンスは終端のチャンクを送らずに接続を閉じ、不完全であることをクライアントに伝える
+            pass
+        except Exception as e:
+            await self._send_text(writer, 500, f"変換に失敗しました：{e}")
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _handle_request(self, reader, writer):
+        """リクエストを読み込み、パスに応じて処理する"""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise HttpError(431, "リクエストヘッダーが大きすぎます")
+        except asyncio.IncompleteReadError:
+            return
+
+        request_line, *header_lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = request_line.split(" ")
+        except ValueError:
+            raise HttpError(400, "リクエストが不正です")
+        headers = {}
+        for line in header_lines:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        url = urlsplit(target)
+        if url.path == "/health":
+            await self._send_json(
+                writer, {"status": "ok", "cached_meshes": len(self.cache)})
+            return
+        if not url.path == "/convert":
+            raise HttpError(404, f"存在しないパスです：{url.path}")
+
+        converter_options, rgbify, epsg, file_name = _parse_query(url.query)
+        if method == "POST":
+            with tempfile.TemporaryDirectory() as temp_dir:
+                import_path = Path(temp_dir) / "upload.zip"
+                await self._receive_body(reader, writer, headers, import_path)
+                vsi_path = await self._convert(
+                    import_path, converter_options, rgbify, epsg)
+        elif method == "GET":
+            if self.archive_dir is None:
+                raise HttpError(404, "zipの格納先（archive_dir）が設定されていません")
+            if "bbox" not in converter_options and "mesh_codes" not in converter_options:
+                raise HttpError(400, "bboxまたはmesh_codesを指定してください")
+            import_paths = await asyncio.get_running_loop().run_in_executor(
+                None,
+                self._find_archives,
+                converter_options.get("bbox"),
+                converter_options.get("mesh_codes"))
+            if not import_paths:
+                raise HttpError(
+                    404, f"指定された範囲・メッシュコードに該当するzipが存在しません：{self.archive_dir}")
+            vsi_path = await self._convert(
+                import_paths, converter_options, rgbify, epsg)
+        else:
+            raise HttpError(405, f"対応していないメソッドです：{method}")
+
+        await self._send_file(writer, vsi_path, file_name)
+
+    def _refresh_archive_index(self):
+        """archive_dir内のzipのうち、追加・更新されたもののみヘッダーを読み込み、索引を更新する
+
+        Notes:
+            zipの一覧と更新日時のみを確認するため、変更がない場合はzipを開かない
+            読み込めないzipは警告を表示して索引から除き、更新されるまで読み込み直さない
+
+        """
+        from convert_fgd_dem.dem import Dem
+
+        with self._archive_lock:
+            current_mtimes = {}
+            for zip_path in self.archive_dir.glob("*.zip"):
+                try:
+                    current_mtimes[zip_path] = zip_path.stat().st_mtime_ns
+                except FileNotFoundError:
+                    continue
+
+            for zip_path in set(self.archive_entries) - set(current_mtimes):
+                del self.archive_entries[zip_path]
+            for zip_path, mtime in current_mtimes.items():
+                if zip_path in self.archive_entries and self.archive_entries[zip_path][0] == mtime:
+                    continue
+                try:
+                    entries = MeshIndex(Dem.list_xml_paths(zip_path)).entries
+                except Exception as e:
+                    warnings.warn(f"zipを索引に追加できませんでした：{zip_path}：{e}")
+                    entries = []
+                self.archive_entries[zip_path] = (mtime, entries)
+
+    def _find_archives(self, bbox=None, mesh_codes=None):
+        """索引を更新し、範囲・メッシュコードに該当するメッシュを含むzipを返す
+
+        Args:
+            bbox (tuple): 範囲（最小経度, 最小緯度, 最大経度, 最大緯度）
+            mesh_codes (list): メッシュコードのリスト
+
+        Returns:
+            list: 該当するzipのパスのリスト
+
+        """
+        self._refresh_archive_index()
+        with self._archive_lock:
+            mesh_index = MeshIndex.from_entries(
+                entry
+                for _, entries in self.archive_entries.values()
+                for entry in entries)
+        entries = mesh_index.query(bbox=bbox, mesh_codes=mesh_codes)
+        return sorted({entry.xml_path.archive_path for entry in entries})
+
+    async def _receive_body(self, reader, writer, headers, import_path):
+        """リクエストボディのzipをファイルに書き込む
+
+        Args:
+            reader (asyncio.StreamReader):
+            writer (asyncio.StreamWriter):
+            headers (dict): 小文字のヘッダー名と値の辞書
+            import_path (Path): 書き込み先
+
+        Notes:
+            ファイルへの書き込みはイベントループを止めないよう、変換用とは別のスレッドで行う
+
+        """
+        try:
+            content_length = int(headers["content-length"])
+        except (KeyError, ValueError):
+            raise HttpError(411, "Content-Lengthを指定してください")
+        if content_length > self.max_body_size * 1024 * 1024:
+            raise HttpError(
+                413, f"zipが大きすぎます（上限{self.max_body_size}MB）")
+
+        if headers.get("expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await writer.drain()
+
+        loop = asyncio.get_running_loop()
+        remaining = content_length
+        zip_file = await loop.run_in_executor(None, import_path.open, "wb")
+        try:
+            while remaining > 0:
+                chunk = await reader.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise HttpError(400, "リクエストボディが途中で途切れました")
+                await loop.run_in_executor(None, zip_file.write, chunk)
+                remaining -= len(chunk)
+        finally:
+            await loop.run_in_executor(None, zip_file.close)
+
+    async def _convert(self, import_path, converter_options, rgbify, epsg):
+        """同時に変換する数を制限しつつ、スレッドプールで変換する
+
+        Returns:
+            str: 変換したGeoTiffの仮想ファイルのパス
+
+        """
+        loop = asyncio.get_running_loop()
+        async with self.semaphore:
+            return await loop.run_in_executor(
+                self.executor,
+                self._convert_sync,
+                import_path,
+                converter_options,
+                rgbify,
+                epsg)
+
+    def _convert_sync(self, import_path, converter_options, rgbify, epsg):
+        """Converterでメッシュを読み込み、GeoTiffを仮想メモリ上に作成する（スレッドプールで実行する）"""
+        from convert_fgd_dem.converter import Converter
+
+        try:
+            converter = Converter(
+                import_path,
+                cache=self.cache,
+                warp_memory_limit=self.warp_memory_limit,
+                **converter_options)
+            dst_ds = converter.to_dataset(epsg=epsg, rgbify=rgbify)
+        except Exception as e:
+            raise HttpError(422, f"変換できませんでした：{e}")
+        return encode_geotiff(dst_ds)
+
+    async def _send_file(self, writer, vsi_path, file_name):
+        """仮想メモリ上のGeoTiffをchunkedで送信し、送信後に削除する
+
+        Raises:
+            ResponseAborted: ヘッダーの送信後に失敗した場合（エラーレスポンスは送信できない）
+
+        """
+        from osgeo import gdal
+
+        writer.write(
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: image/tiff\r\n"
+            f'Content-Disposition: attachment; filename="{file_name}"\r\n'
+            "Transfer-Encoding: chunked\r\n"
+            "Connection: close\r\n"
+            "\r\n".encode("latin-1"))
+        vsi_file = None
+        try:
+            vsi_file = gdal.VSIFOpenL(vsi_path, "rb")
+            while True:
+                chunk = gdal.VSIFReadL(1, CHUNK_SIZE, vsi_file)
+                if not chunk:
+                    break
+                writer.write(b"%X\r\n%s\r\n" % (len(chunk), chunk))
+                # 送信が追いつくまで次を読み込まない
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        except Exception as e:
+            raise ResponseAborted(f"レスポンスの送信に失敗しました：{e}") from e
+        finally:
+            if vsi_file is not None:
+                gdal.VSIFCloseL(vsi_file)
+            gdal.Unlink(vsi_path)
+
+    @staticmethod
+    async def _send(writer, status, content_type, body):
+        """ステータスとボディを送信する"""
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_MESSAGES[status]}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n"
+            "\r\n".encode("latin-1") + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _send_text(self, writer, status, message):
+        await self._send(
+            writer, status, "text/plain; charset=utf-8", message.encode("utf-8"))
+
+    async def _send_json(self, writer, content, status=200):
+        await self._send(
+            writer, status, "application/json",
+            json.dumps(content, ensure_ascii=False).encode("utf-8"))
+
+
+async def serve(host="127.0.0.1", port=8000, **server_options):
+    """サーバーを起動し、停止されるまで待ち受ける
+
+    Args:
+        host (str): 待ち受けるアドレス
+        port (int): 待ち受けるポート
+        **server_options: ConvertServerに渡すオプション
+
+    """
+    convert_server = ConvertServer(**server_options)
+    server = await convert_server.start(host, port)
+    print(f"listening on http://{host}:{server.sockets[0].getsockname()[1]}")
+    try:
+        await server.serve_forever()
+    finally:
+        await convert_server.close()
+
+
+@click.command()
+@click.option(
+    "--host",
+    required=False,
+    type=str,
+    default="127.0.0.1",
+    help="待ち受けるアドレス default=127.0.0.1",
+)
+@click.option(
+    "--port",
+    required=False,
+    type=int,
+    default=8000,
+    help="待ち受けるポート default=8000",
+)
+@click.option(
+    "--archive_dir",
+    required=False,
+    type=str,
+    default=None,
+    help="GET /convert で変換対象とするzipが格納されたディレクトリ default=None",
+)
+@click.option(
+    "--max_concurrency",
+    required=False,
+    type=int,
+    default=os.cpu_count() or 1,
+    help="同時に変換する数 default=CPU数",
+)
+@click.option(
+    "--cache_size",
+    required=False,
+    type=int,
+    default=256,
+    help="デコード済みのメッシュをメモリ上に保持する合計サイズの上限（MB） default=256",
+)
+@click.option(
+    "--max_body_size",
+    required=False,
+    type=int,
+    default=512,
+    help="POSTで受け付けるzipのサイズの上限（MB） default=512",
+)
+@click.option(
+    "--warp_memory_limit",
+    required=False,
+    type=int,
+    default=None,
+    help="投影変換で使用するメモリの上限（MB） default=GDALの既定値",
+)
+def main(
+        host,
+        port,
+        archive_dir,
+        max_concurrency,
+        cache_size,
+        max_body_size,
+        warp_memory_limit):
+    try:
+        asyncio.run(
+            serve(
+                host,
+                port,
+                archive_dir=archive_dir,
+                max_concurrency=max_concurrency,
+                cache_size=cache_size,
+                max_body_size=max_body_size,
+                warp_memory_limit=warp_memory_limit,
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+import math
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from osgeo import gdal
+
+from convert_fgd_dem.helpers import average_to_grid, convert_height_to_rgb
+
+# EPSG:3857の赤道の半周（m）
+HALF_CIRCUMFERENCE = 20037508.342789244
+TILE_SIZE = 256
+# タイルの形式毎の「GDALのドライバ名・拡張子・作成オプション」
+TILE_FORMATS = {
+    "png": ("PNG", "png", []),
+    "webp": ("WEBP", "webp", ["LOSSLESS=TRUE"]),
+}
+
+
+def lonlat_to_tile(lon, lat, zoom):
+    """緯度経度を含むXYZタイルの番号を返す
+
+    Args:
+        lon (float): 経度
+        lat (float): 緯度
+        zoom (int): ズームレベル
+
+    Returns:
+        tuple: タイルのx・y
+
+    """
+    tile_count = 2 ** zoom
+    x = int((lon + 180) / 360 * tile_count)
+    y = int(
+        (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * tile_count)
+    return (
+        min(max(x, 0), tile_count - 1),
+        min(max(y, 0), tile_count - 1),
+    )
+
+
+def get_tile_bounds(x, y, zoom):
+    """XYZタイルの範囲をEPSG:3857の座標で返す
+
+    Args:
+        x (int): タイルのx
+        y (int): タイルのy
+        zoom (int): ズームレベル
+
+    Returns:
+        tuple: 最小x・最小y・最大x・最大y（m）
+
+    """
+    tile_length = 2 * HALF_CIRCUMFERENCE / 2 ** zoom
+    min_x = -HALF_CIRCUMFERENCE + x * tile_length
+    max_y = HALF_CIRCUMFERENCE - y * tile_length
+    return min_x, max_y - tile_length, min_x + tile_length, max_y
+
+
+def get_tile_range(bounds_latlng, zoom):
+    """範囲を覆うXYZタイルの一覧を返す
+
+    Args:
+        bounds_latlng (dict): 左下と右上の緯度経度
+        zoom (int): ズームレベル
+
+    Returns:
+        list: タイルのx・yのリスト
+
+    """
+    min_x, min_y = lonlat_to_tile(
+        bounds_latlng["lower_left"]["lon"],
+        bounds_latlng["upper_right"]["lat"],
+        zoom)
+    max_x, max_y = lonlat_to_tile(
+        bounds_latlng["upper_right"]["lon"],
+        bounds_latlng["lower_left"]["lat"],
+        zoom)
+    return [
+        (x, y)
+        for x in range(min_x, max_x + 1)
+        for y in range(min_y, max_y + 1)
+    ]
+
+
+def _get_scratch_path(scratch_dir, zoom, x, y):
+    """下位のズームレベルの作成に使う、タイルの標高値の一時ファイルのパスを返す"""
+    return Path(scratch_dir) / f"{zoom}-{x}-{y}.npy"
+
+
+def write_tile_image(heights, tile_path, tile_format="png", no_data_value=-9999):
+    """タイルの標高値をterrain rgbの画像として書き出す
+
+    Args:
+        heights (numpy.ndarray): タイルの標高値（TILE_SIZE×TILE_SIZE）
+        tile_path (Path): 書き出す画像のパス
+        tile_format (str): "png" or "webp"
+        no_data_value (int): nodataとして扱う標高値
+
+    """
+    driver_name, _, options = TILE_FORMATS[tile_format]
+    rgb_array = convert_height_to_rgb(heights, no_data_value)
+
+    mem_ds = gdal.GetDriverByName("MEM").Create(
+        "", TILE_SIZE, TILE_SIZE, 3, gdal.GDT_Byte)
+    for band, band_array in enumerate(rgb_array, start=1):
+        mem_ds.GetRasterBand(band).WriteArray(band_array)
+
+    tile_path.parent.mkdir(parents=True, exist_ok=True)
+    tile_ds = gdal.GetDriverByName(driver_name).CreateCopy(
+        str(tile_path), mem_ds, options=options)
+    # 参照を手放して、画像をファイルに書き出す
+    tile_ds.FlushCache()
+    del tile_ds
+
+
+def _init_worker():
+    """ワーカーの初期化（タイル毎に.aux.xmlが作成されないようにする）"""
+    gdal.SetConfigOption("GDAL_PAM_ENABLED", "NO")
+
+
+def render_tiles(
+        source_path,
+        tiles,
+        zoom,
+        tile_dir,
+        scratch_dir,
+        tile_format="png",
+        resample_alg="bilinear",
+        no_data_value=-9999):
+    """最大ズームレベルのタイルを、EPSG:4326のGeoTiffから投影変換して書き出す
+
+    Args:
+        source_path (Path): EPSG:4326の標高値のGeoTiff
+        tiles (list): タイルのx・yのリスト
+        zoom (int): ズームレベル
+        tile_dir (Path): タイルの出力先
+        scratch_dir (Path): 下位のズームレベルの作成に使う標高値の一時ファイルの保存先
+        tile_format (str): "png" or "webp"
+        resample_alg (str): 投影変換のリサンプリング方法
+        no_data_value (int): nodataとして扱う標高値
+
+    Returns:
+        list: 書き出したタイルのx・yのリスト（全てnodataのタイルは書き出さない）
+
+    """
+    _, extension, _ = TILE_FORMATS[tile_format]
+    written_tiles = []
+    for x, y in tiles:
+        tile_ds = gdal.Warp(
+            "",
+            str(source_path),
+            format="MEM",
+            outputBounds=get_tile_bounds(x, y, zoom),
+            width=TILE_SIZE,
+            height=TILE_SIZE,
+            srcSRS="EPSG:4326",
+            dstSRS="EPSG:3857",
+            srcNodata=no_data_value,
+            dstNodata=no_data_value,
+            outputType=gdal.GDT_Float32,
+            resampleAlg=resample_alg)
+        heights = tile_ds.GetRasterBand(1).ReadAsArray()
+        tile_ds = None
+
+        if np.all(heights == no_data_value):
+            continue
+        write_tile_image(
+            heights,
+            Path(tile_dir) / str(zoom) / str(x) / f"{y}.{extension}",
+            tile_format,
+            no_data_value)
+        np.save(_get_scratch_path(scratch_dir, zoom, x, y), heights)
+        written_tiles.append((x, y))
+    return written_tiles
+
+
+def build_parent_tiles(
+        tiles,
+        zoom,
+        tile_dir,
+        scratch_dir,
+        tile_format="png",
+        no_data_value=-9999):
+    """1つ上のズームレベルの4枚のタイルを結合・縮小して、タイルを書き出す
+
+    Args:
+        tiles (list): 作成するタイルのx・yのリスト
+        zoom (int): 作成するタイルのズームレベル
+        tile_dir (Path): タイルの出力先
+        scratch_dir (Path): 標高値の一時ファイルの保存先
+        tile_format (str): "png" or "webp"
+        no_data_value (int): nodataとして扱う標高値
+
+    Returns:
+        list: 書き出したタイルのx・yのリスト
+
+    Notes:
+        画像ではなく一時ファイルの標高値から作成するため、nodataを区別したまま平均できる
+        読み込んだ子タイルの一時ファイルはその場で削除する
+
+    """
+    _, extension, _ = TILE_FORMATS[tile_format]
+    # 子タイル2×2枚分の配列の各セルが属する、親タイルのセル
+    half_indexes = np.arange(TILE_SIZE * 2) // 2
+
+    written_tiles = []
+    for x, y in tiles:
+        children = np.full(
+            (TILE_SIZE * 2, TILE_SIZE * 2), no_data_value, dtype=np.float32)
+        for dx in (0, 1):
+            for dy in (0, 1):
+                child_path = _get_scratch_path(
+                    scratch_dir, zoom + 1, x * 2 + dx, y * 2 + dy)
+                if not child_path.exists():
+                    continue
+                children[
+                    dy * TILE_SIZE:(dy + 1) * TILE_SIZE,
+                    dx * TILE_SIZE:(dx + 1) * TILE_SIZE,
+                ] = np.load(child_path)
+                child_path.unlink()
+
+        heights = average_to_grid(
+            children, half_indexes, half_indexes, no_data_value)
+        if np.all(heights == no_data_value):
+            continue
+        write_tile_image(
+            heights,
+            Path(tile_dir) / str(zoom) / str(x) / f"{y}.{extension}",
+            tile_format,
+            no_data_value)
+        np.save(_get_scratch_path(scratch_dir, zoom, x, y), heights)
+        written_tiles.append((x, y))
+    return written_tiles
+
+
+def _split(items, chunk_count):
+    """リストをおおよそ同じ大きさのchunk_count個に分割する"""
+    chunk_size = max(1, math.ceil(len(items) / chunk_count))
+    return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+def generate_tiles(
+        source_path,
+        bounds_latlng,
+        tile_dir,
+        min_zoom,
+        max_zoom,
+        tile_format="png",
+        workers=1,
+        resample_alg="bilinear",
+        no_data_value=-9999):
+    """EPSG:4326の標高値のGeoTiffから、terrain rgbのXYZタイルを作成する
+
+    Args:
+        source_path (Path): EPSG:4326の標高値のGeoTiff
+        bounds_latlng (dict): タイルを作成する範囲の左下と右上の緯度経度
+        tile_dir (Path): タイルの出力先（{z}/{x}/{y}.{拡張子}で書き出す）
+        min_zoom (int): 最小ズームレベル
+        max_zoom (int): 最大ズームレベル
+        tile_format (str): "png" or "webp"
+        workers (int): タイルの作成に使用するプロセス数
+        resample_alg (str): 最大ズームレベルの投影変換のリサンプリング方法
+        no_data_value (int): nodataとして扱う標高値
+
+    Returns:
+        dict: ズームレベル毎の書き出したタイル数
+
+    Notes:
+        最大ズームレベルのみ投影変換し、それより小さいズームレベルは子タイルの標高値を平均して作成する
+        全てnodataのタイルは書き出さない
+
+    """
+    if tile_format not in TILE_FORMATS:
+        raise Exception(f"タイルの形式が不正です。tile_format={tile_format}")
+    if not 0 <= min_zoom <= max_zoom:
+        raise Exception(
+            f"ズームレベルの指定が不正です。min_zoom={min_zoom}・max_zoom={max_zoom}")
+
+    tile_counts = {}
+    with tempfile.TemporaryDirectory(dir=Path(tile_dir).parent) as scratch_dir, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        tiles = get_tile_range(bounds_latlng, max_zoom)
+        futures = [
+            executor.submit(
+                render_tiles,
+                source_path,
+                chunk,
+                max_zoom,
+                tile_dir,
+                scratch_dir,
+                tile_format,
+                resample_alg,
+                no_data_value)
+            for chunk in _split(tiles, workers * 4)
+        ]
+        tiles = [tile for future in futures for tile in future.result()]
+        tile_counts[max_zoom] = len(tiles)
+
+        for zoom in range(max_zoom - 1, min_zoom - 1, -1):
+            parents = sorted({(x // 2, y // 2) for x, y in tiles})
+            futures = [
+                executor.submit(
+                    build_parent_tiles,
+                    chunk,
+                    zoom,
+                    tile_dir,
+                    scratch_dir,
+                    tile_format,
+                    no_data_value)
+                for chunk in _split(parents, workers * 4)
+            ]
+            tiles = [tile for future in futures for tile in future.result()]
+            tile_counts[zoom] = len(tiles)
+
+    return tile_counts
@@ -0,0 +1,173 @@
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from convert_fgd_dem.batch import _convert
+
+
+def _init_worker():
+    """ワーカーの起動時にGDALを読み込み、ドライバを登録しておく
+
+    Notes:
+        ジョブ毎に読み込み・初期化の時間がかからないよう、プロセスを使い回す前提で最初に一度だけ行う
+
+    """
+    from osgeo import gdal
+
+    gdal.AllRegister()
+
+
+class SpoolWatcher:
+    """ディレクトリに置かれたzipのうち、書き込みが完了したものを検出するクラス
+
+    Notes:
+        サイズと更新日時がsettle_seconds以上変わらず、zipとして読み込めるものを書き込み完了とみなす
+        一度検出したzipは、内容（サイズ・更新日時）が変わらない限り再度検出しない
+
+    """
+
+    def __init__(self, watch_dir, settle_seconds=2.0):
+        """イニシャライザ
+
+        Args:
+            watch_dir (Path): 監視するディレクトリ
+            settle_seconds (float): 書き込み完了とみなすまでに、サイズと更新日時が変わらない秒数
+
+        """
+        self.watch_dir: Path = Path(watch_dir)
+        self.settle_seconds: float = settle_seconds
+        # zip毎の「最後に観測したサイズと更新日時・その値を最初に観測した時刻」
+        self._observed: dict = {}
+        # 検出済みのzipとその時点のサイズと更新日時
+        self._detected: dict = {}
+
+    def poll(self, now=None, limit=None):
+        """書き込みが完了した新しいzipを返す
+
+        Args:
+            now (float): 現在時刻（time.monotonic）。テスト用
+            limit (int): 返すzipの数の上限。Noneの場合は上限なし
+
+        Returns:
+            list: 新たに書き込みが完了したzipのパスのリスト（ファイル名順）
+
+        Notes:
+            上限を超えた分は検出済みとせず、次回以降の確認で（書き込み完了の判定を待たずに）返す
+
+        """
+        now = time.monotonic() if now is None else now
+        ready_paths = []
+        current_paths = set()
+        for zip_path in sorted(self.watch_dir.glob("*.zip")):
+            try:
+                stat = zip_path.stat()
+            except FileNotFoundError:
+                continue
+            current_paths.add(zip_path)
+            signature = (stat.st_size, stat.st_mtime_ns)
+
+            if self._detected.get(zip_path) == signature:
+                continue
+            observed = self._observed.get(zip_path)
+            if observed is None or not observed[0] == signature:
+                self._observed[zip_path] = (signature, now)
+                continue
+            if now - observed[1] < self.settle_seconds:
+                continue
+            if limit is not None and len(ready_paths) >= limit:
+                continue
+            # サイズが変わらなくても、末尾（セントラルディレクトリ）まで書き込まれていなければ待つ
+            if not zipfile.is_zipfile(zip_path):
+                continue
+
+            del self._observed[zip_path]
+            self._detected[zip_path] = signature
+            ready_paths.append(zip_path)
+
+        # 削除されたzipの記録は破棄する
+        for records in (self._observed, self._detected):
+            for zip_path in set(records) - current_paths:
+                del records[zip_path]
+        return ready_paths
+
+
+def run_watch(
+        watch_dir,
+        output_path,
+        jobs=1,
+        poll_interval=2.0,
+        settle_seconds=2.0,
+        max_pending=None,
+        max_polls=None,
+        **converter_options):
+    """ディレクトリを監視し、置かれたzipを起動済みのプロセスプールで順に変換する
+
+    Args:
+        watch_dir (Path): 監視するディレクトリ
+        output_path (Path): 出力先のディレクトリ（zip毎に「出力先/zipのファイル名（拡張子なし）」に出力する）
+        jobs (int): 同時に変換するプロセス数
+        poll_interval (float): ディレクトリを確認する間隔（秒）
+        settle_seconds (float): 書き込み完了とみなすまでに、サイズと更新日時が変わらない秒数
+        max_pending (int): プールに投入する変換の上限（既定はjobsの2倍）
+        max_polls (int): 指定した場合はこの回数だけ確認して、投入済みの変換の完了後に終了する
+        **converter_options: Converterに渡すオプション
+
+    Returns:
+        list: ジョブ毎の「名前・状態・秒数」の辞書のリスト
+
+    Notes:
+        変換中のジョブが上限に達している間はディレクトリを確認せず、待っているzipは監視するディレクトリに残す
+        空きができた分だけzipを検出して投入するため、待っているzipをメモリ上に溜め込まない
+        出力先がすでに存在するzipは完了済みとしてスキップする
+        Ctrl+Cで停止した場合は、未着手のジョブを取り消し、それまでの結果を返す（途中の出力は.partialのまま残る）
+
+    """
+    output_path = Path(output_path)
+    max_pending = jobs * 2 if max_pending is None else max_pending
+    watcher = SpoolWatcher(watch_dir, settle_seconds=settle_seconds)
+
+    results = []
+    running = {}
+    polls = 0
+    executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker)
+    try:
+        while True:
+            if max_polls is None or polls < max_polls:
+                # 変換中のジョブが上限に達している間は検出せず、空きの数だけ検出して投入する
+                if len(running) < max_pending:
+                    for import_path in watcher.poll(limit=max_pending - len(running)):
+                        if (output_path / import_path.stem).exists():
+                            results.append(
+                                {"name": import_path.stem, "status": "skipped", "seconds": 0.0})
+                            continue
+                        future = executor.submit(
+                            _convert,
+                            import_path,
+                            output_path / import_path.stem,
+                            converter_options)
+                        running[future] = import_path.stem
+                polls += 1
+            elif not running:
+                break
+
+            done, _ = wait(list(running), timeout=poll_interval,
+                           return_when=FIRST_COMPLETED)
+            if not running:
+                time.sleep(poll_interval)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    result = {"name": name, "status": "done",
+                              "seconds": future.result()}
+                except Exception as e:
+                    print(f"変換に失敗しました：{name}：{e}")
+                    result = {"name": name, "status": "failed", "seconds": 0.0}
+                print(f"{result['name']}  {result['status']}  {result['seconds']:.2f}s")
+                results.append(result)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+    return results
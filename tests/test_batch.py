@@ -0,0 +1,52 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from convert_fgd_dem.batch import run_batch
+
+
+class TestRunBatch(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_path = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_duplicated_names(self):
+        # 別のディレクトリの同じ名前のzipは、出力先が重なるためエラーとする
+        import_paths = [
+            self.temp_path / "a" / "FG-GML-6441-32-DEM5A.zip",
+            self.temp_path / "b" / "FG-GML-6441-32-DEM5A.zip",
+        ]
+        with self.assertRaises(Exception):
+            run_batch(import_paths, self.temp_path / "output")
+
+    def test_skip_existing(self):
+        import_paths = [self.temp_path / "b.zip", self.temp_path / "a.zip"]
+        for name in ("a", "b"):
+            (self.temp_path / "output" / name).mkdir(parents=True)
+
+        results = run_batch(import_paths, self.temp_path / "output")
+        self.assertEqual(
+            [(result["name"], result["status"]) for result in results],
+            [("b", "skipped"), ("a", "skipped")])
+
+    def test_merge_output(self):
+        # 結合する場合は出力先そのものではなく「出力先/merged」に出力する
+        # 出力先のディレクトリが存在するだけではスキップしない
+        output_path = self.temp_path / "output"
+        output_path.mkdir()
+        # 存在しないzipなので変換に失敗する（スキップされずに変換が試みられる）
+        results = run_batch(
+            [self.temp_path / "a.zip"], output_path, merge=True)
+        self.assertEqual(results[0]["status"], "failed")
+
+        (output_path / "merged").mkdir()
+        results = run_batch(
+            [self.temp_path / "a.zip"], output_path, merge=True)
+        self.assertEqual(results[0]["status"], "skipped")
+
+
+if __name__ == "__main__":
+    unittest.main()
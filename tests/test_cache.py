@@ -0,0 +1,89 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+from benchmarks.fgd_synthetic import write_zip
+from convert_fgd_dem import Dem
+from convert_fgd_dem.cache import MeshCache
+from convert_fgd_dem.dem import MeshData, ZipMember
+
+
+def _make_mesh_data(mesh_code, y_length=512):
+    return MeshData(
+        mesh_code=mesh_code,
+        lower_corner={"lat": 0.0, "lon": 0.0},
+        upper_corner={"lat": 1.0, "lon": 1.0},
+        grid_length={"x": 512, "y": 512},
+        start_point={"x": 0, "y": 0},
+        pixel_size={"x": 1 / 512, "y": -1 / 512},
+        np_array=np.zeros((y_length, 512), np.float32))
+
+
+class TestMeshCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.temp_dir.name) / "cache"
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_make_key_zip_member(self):
+        # zip内のxmlはCRC32とサイズからキーを作成し、xmlを解凍しない
+        member = ZipMember(Path("a.zip"), "a.xml", crc=0x1234abcd, file_size=100)
+        with mock.patch.object(ZipMember, "open", side_effect=AssertionError):
+            key = MeshCache.make_key(member, 644132)
+            changed_key = MeshCache.make_key(
+                ZipMember(Path("a.zip"), "a.xml", crc=0x1234abce, file_size=100), 644132)
+        self.assertIn("644132", key)
+        self.assertNotEqual(key, changed_key)
+
+    def test_make_key_path(self):
+        # xmlファイルは更新されるとキーが変わる
+        xml_path = Path(self.temp_dir.name) / "a.xml"
+        xml_path.write_text("<a/>", encoding="utf-8")
+        key = MeshCache.make_key(xml_path, 644132)
+        self.assertEqual(key, MeshCache.make_key(xml_path, 644132))
+        xml_path.write_text("<ab/>", encoding="utf-8")
+        self.assertNotEqual(key, MeshCache.make_key(xml_path, 644132))
+
+    def test_evict(self):
+        # 1メッシュ約0.75MBのため、上限2MBで3つ目を保存すると最後に利用されたのが最も古いものを削除する
+        # 作成後はディレクトリを走査しない
+        cache = MeshCache(self.cache_dir, max_size=2)
+        with mock.patch.object(Path, "glob", side_effect=AssertionError):
+            cache.put("a", _make_mesh_data(1, 384))
+            cache.put("b", _make_mesh_data(2, 384))
+            self.assertIsNotNone(cache.get("a"))
+            cache.put("c", _make_mesh_data(3, 384))
+
+        self.assertEqual(["a", "c"], list(cache._entries))
+        self.assertIsNone(cache.get("b"))
+        self.assertFalse((self.cache_dir / "b.json").exists())
+        self.assertEqual(1, cache.get("a").mesh_code)
+
+        # 作成時にディレクトリを走査して、既存のキャッシュを合計サイズに含める
+        reopened_cache = MeshCache(self.cache_dir, max_size=2)
+        self.assertEqual(2, len(reopened_cache))
+        self.assertEqual(cache._total_size, reopened_cache._total_size)
+
+    def test_dem_cache(self):
+        # キャッシュのキーの作成ではxmlを読み込まず、2回目はキャッシュから読み込む
+        zip_path = Path(self.temp_dir.name) / "a.zip"
+        write_zip(zip_path, "DEM5A", 2)
+        cache = MeshCache(self.cache_dir)
+
+        first = Dem(zip_path, cache=cache).mesh_data_list
+        self.assertEqual(2, len(cache))
+
+        with mock.patch.object(Dem, "_load_xml_content") as load_xml_content:
+            second = Dem(zip_path, cache=cache).mesh_data_list
+        load_xml_content.assert_not_called()
+        for first_mesh, second_mesh in zip(first, second):
+            np.testing.assert_array_equal(first_mesh.np_array, second_mesh.np_array)
+
+
+if __name__ == "__main__":
+    unittest.main()
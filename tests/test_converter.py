@@ -1,9 +1,46 @@
+import tempfile
 import unittest
 from pathlib import Path
+from unittest import mock
 
+import numpy as np
 from osgeo import gdal, gdalconst
 
-from convert_fgd_dem import Converter
+from benchmarks.fgd_synthetic import (
+    PRODUCTS,
+    XML_HEAD,
+    XML_TAIL,
+    get_mesh_bounds,
+    make_mesh_codes,
+    make_xml,
+    write_zip,
+)
+from convert_fgd_dem import Converter, Dem
+from convert_fgd_dem.geotiff import Product
+from convert_fgd_dem.helpers import convert_height_to_rgb
+
+
+def _make_flat_xml(mesh_code, product, height, no_data_rows=0):
+    """全ての点を同じ標高値とし、上からno_data_rows行をデータなしとしたxmlを作成する"""
+    x_length, y_length = PRODUCTS[product]["grid"]
+    lower_lat, lower_lon, upper_lat, upper_lon = get_mesh_bounds(mesh_code)
+    lines = (
+        ["データなし,-9999."] * (x_length * no_data_rows)
+        + [f"地表面,{height:.2f}"] * (x_length * (y_length - no_data_rows)))
+    return (
+        XML_HEAD.format(
+            mesh_code=mesh_code,
+            product=product,
+            lower_lat=lower_lat,
+            lower_lon=lower_lon,
+            upper_lat=upper_lat,
+            upper_lon=upper_lon,
+            high_x=x_length - 1,
+            high_y=y_length - 1)
+        + "\n".join(lines)
+        + "\n"
+        + XML_TAIL
+    )
 
 
 class TestConverter(unittest.TestCase):
@@ -25,6 +62,337 @@ class TestConverter(unittest.TestCase):
             geo_transform,
         )
 
+    def test_to_array(self):
+        converter = Converter(
+            import_path=Path("./target_files/FG-GML-6441-32-DEM5A.zip"),
+        )
+        np_array, geo_transform, crs = converter.to_array()
+        self.assertEqual((1500, 2250), np_array.shape)
+        self.assertEqual(141.25, geo_transform[0])
+        self.assertEqual(43.0, geo_transform[3])
+        self.assertIn("4326", crs)
+
+    def test_to_dataset(self):
+        converter = Converter(
+            import_path=Path("./target_files/FG-GML-6441-32-DEM5A.zip"),
+        )
+        dst_ds = converter.to_dataset()
+        self.assertEqual("MEM", dst_ds.GetDriver().ShortName)
+        self.assertEqual(2250, dst_ds.RasterXSize)
+        self.assertEqual(1500, dst_ds.RasterYSize)
+
+        rgb_ds = converter.to_dataset(epsg="EPSG:3857", rgbify=True)
+        self.assertEqual("MEM", rgb_ds.GetDriver().ShortName)
+        self.assertEqual(3, rgb_ds.RasterCount)
+
+
+class TestConverterOutput(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.zip_path = Path(self.temp_dir.name) / "FG-GML-6441-00-DEM5A.zip"
+        self.output_path = Path(self.temp_dir.name) / "output"
+        self.mesh_codes = write_zip(self.zip_path, "DEM5A", 4)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _read(self, file_name):
+        src = gdal.Open(str(self.output_path / file_name), gdalconst.GA_ReadOnly)
+        return src.ReadAsArray(), src.GetGeoTransform()
+
+    def test_windowed_write(self):
+        # 全体の配列を作成せずにメッシュ毎に書き込んだ結果が、結合した配列と一致する
+        geo_transform, dem_array, _, _, _ = Converter(self.zip_path).make_data_for_geotiff()
+        converter = Converter(self.zip_path, output_path=self.output_path)
+        with mock.patch.object(Converter, "_create_dem_array", side_effect=AssertionError):
+            converter.dem_to_geotiff()
+
+        np_array, output_geo_transform = self._read("output.tif")
+        np.testing.assert_array_equal(dem_array, np_array)
+        np.testing.assert_allclose(geo_transform, output_geo_transform)
+
+    def test_memmap_dir(self):
+        # memmap_dirを指定した場合は一時ファイルをメモリマップした配列に結合し、大きさの上限を設けない
+        memmap_dir = Path(self.temp_dir.name) / "memmap"
+        _, expected, _, _, _ = Converter(self.zip_path).make_data_for_geotiff()
+        converter = Converter(self.zip_path, memmap_dir=memmap_dir)
+        _, dem_array, _, _, _ = converter.make_data_for_geotiff()
+        self.assertIsInstance(dem_array, np.memmap)
+        np.testing.assert_array_equal(expected, dem_array)
+        # 一時ファイルは作成直後に削除される
+        self.assertEqual([], list(memmap_dir.iterdir()))
+
+        with self.assertRaises(Exception):
+            Converter(self.zip_path)._create_dem_array(10000, 1)
+        large_array = converter._create_dem_array(10000, 1)
+        self.assertEqual((1, 10000), large_array.shape)
+        self.assertTrue((large_array == -9999).all())
+
+    def test_warp_in_memory(self):
+        # 投影変換はメモリ上のデータセットから行い、EPSG:4326の中間ファイルを書き出さない
+        converter = Converter(
+            self.zip_path,
+            output_path=self.output_path,
+            output_epsg="EPSG:3857",
+            warp_memory_limit=64)
+        with mock.patch.object(gdal, "Warp", wraps=gdal.Warp) as gdal_warp:
+            converter.dem_to_geotiff()
+
+        gdal_warp.assert_called_once()
+        (warp_path, source_ds), warp_options = gdal_warp.call_args
+        self.assertEqual(str((self.output_path / "output.tif").resolve()), warp_path)
+        self.assertNotIsInstance(source_ds, str)
+        self.assertEqual("EPSG:3857", warp_options["dstSRS"])
+        self.assertEqual(64, warp_options["warpMemoryLimit"])
+        self.assertEqual(["output.tif"], [path.name for path in self.output_path.iterdir()])
+
+    def test_single_pass_products(self):
+        # 標高値とterrain rgbを、メッシュを一度だけデコードして同時に書き出す
+        converter = Converter(self.zip_path, output_path=self.output_path, rgbify=True)
+        with mock.patch.object(
+                Dem, "_load_xml_content", wraps=Dem._load_xml_content) as load_xml_content:
+            converter.dem_to_geotiff()
+        self.assertEqual(len(self.mesh_codes), load_xml_content.call_count)
+
+        dem_array, _ = self._read("output.tif")
+        rgb_array, _ = self._read("rgbify.tif")
+        np.testing.assert_array_equal(convert_height_to_rgb(dem_array), rgb_array)
+
+    def test_cog_options(self):
+        # 許容誤差は標高値のLERCにのみ、予測子は可逆圧縮にのみ設定する
+        dem_options = Product(cog=True, compress="LERC", max_z_error=0.5).make_cog_options()
+        self.assertIn("MAX_Z_ERROR=0.5", dem_options)
+        self.assertIn("OVERVIEW_RESAMPLING=AVERAGE", dem_options)
+        rgb_options = Product(
+            rgbify=True, cog=True, compress="LERC", max_z_error=0.5).make_cog_options()
+        self.assertNotIn("MAX_Z_ERROR=0.5", rgb_options)
+        self.assertIn("OVERVIEW_RESAMPLING=NEAREST", rgb_options)
+        self.assertIn("PREDICTOR=YES", Product(cog=True).make_cog_options())
+        self.assertNotIn("PREDICTOR=YES", Product(cog=True, compress="NONE").make_cog_options())
+
+    def test_cog(self):
+        # COGのレイアウト・圧縮・タイルの大きさ・オーバービューが指定通りに書き出される
+        _, dem_array, _, _, _ = Converter(self.zip_path).make_data_for_geotiff()
+        Converter(
+            self.zip_path,
+            output_path=self.output_path,
+            cog=True,
+            compress="DEFLATE").dem_to_geotiff()
+
+        src = gdal.Open(str(self.output_path / "output.tif"), gdalconst.GA_ReadOnly)
+        image_structure = src.GetMetadata("IMAGE_STRUCTURE")
+        self.assertEqual("COG", image_structure.get("LAYOUT"))
+        self.assertEqual("DEFLATE", image_structure.get("COMPRESSION"))
+        self.assertEqual([512, 512], src.GetRasterBand(1).GetBlockSize())
+        # 4メッシュ（900×150）はタイルより大きいため、オーバービューが作成される
+        self.assertGreaterEqual(src.GetRasterBand(1).GetOverviewCount(), 1)
+        np.testing.assert_array_equal(dem_array, src.ReadAsArray())
+        # COGに変換する前の一時的なGeoTiffは残さない
+        self.assertEqual(["output.tif"], [path.name for path in self.output_path.iterdir()])
+
+    def test_cog_max_z_error(self):
+        # LERCで圧縮した標高値は、許容誤差（max_z_error）の範囲で元の値と一致する
+        _, dem_array, _, _, _ = Converter(self.zip_path).make_data_for_geotiff()
+        Converter(
+            self.zip_path,
+            output_path=self.output_path,
+            cog=True,
+            compress="LERC_DEFLATE",
+            max_z_error=0.5).dem_to_geotiff()
+
+        src = gdal.Open(str(self.output_path / "output.tif"), gdalconst.GA_ReadOnly)
+        self.assertEqual("LERC_DEFLATE", src.GetMetadata("IMAGE_STRUCTURE").get("COMPRESSION"))
+        np.testing.assert_allclose(dem_array, src.ReadAsArray(), rtol=0, atol=0.5 + 1e-3)
+
+
+class TestConverterUpdate(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.xml_dir = Path(self.temp_dir.name) / "xml"
+        self.output_path = Path(self.temp_dir.name) / "output"
+        self.xml_dir.mkdir()
+        self.mesh_codes = make_mesh_codes("DEM5A", 3)
+        for mesh_code in self.mesh_codes[:2]:
+            self._write_xml(mesh_code, seed=0)
+        Converter(
+            import_path=self.xml_dir,
+            output_path=self.output_path,
+        ).dem_to_geotiff()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _write_xml(self, mesh_code, seed):
+        xml_path = self.xml_dir / f"FG-GML-{mesh_code}-DEM5A.xml"
+        xml_path.write_text(make_xml(mesh_code, seed=seed), encoding="utf-8")
+
+    def _update(self):
+        converter = Converter(
+            import_path=self.xml_dir,
+            output_path=self.output_path,
+            update=True,
+        )
+        with mock.patch.object(
+                converter,
+                "_write_mesh_windows",
+                wraps=converter._write_mesh_windows) as write_mesh_windows:
+            changed_mesh_codes = converter.update_products(converter._make_products())
+        return changed_mesh_codes, write_mesh_windows
+
+    def _read_output(self):
+        src = gdal.Open(str(self.output_path / "output.tif"), gdalconst.GA_ReadOnly)
+        return src.GetRasterBand(1).ReadAsArray()
+
+    def test_unchanged(self):
+        changed_mesh_codes, write_mesh_windows = self._update()
+        self.assertEqual([], changed_mesh_codes)
+        write_mesh_windows.assert_not_called()
+
+    def test_changed_mesh(self):
+        before = self._read_output()
+        self._write_xml(self.mesh_codes[1], seed=1)
+        changed_mesh_codes, write_mesh_windows = self._update()
+        self.assertEqual([self.mesh_codes[1]], changed_mesh_codes)
+        self.assertEqual(
+            [self.mesh_codes[1]],
+            write_mesh_windows.call_args.kwargs["mesh_codes"])
+
+        # 変更したメッシュ（東側）の範囲のみ書き換わる
+        after = self._read_output()
+        x_length = after.shape[1] // 2
+        self.assertTrue((before[:, :x_length] == after[:, :x_length]).all())
+        self.assertFalse((before[:, x_length:] == after[:, x_length:]).all())
+
+        # 書き換えた成果物は、全体を作り直したものと一致する
+        rebuilt_path = Path(self.temp_dir.name) / "rebuilt"
+        Converter(import_path=self.xml_dir, output_path=rebuilt_path).dem_to_geotiff()
+        src = gdal.Open(str(rebuilt_path / "output.tif"), gdalconst.GA_ReadOnly)
+        self.assertTrue((src.GetRasterBand(1).ReadAsArray() == after).all())
+
+        # 再度更新しても、何も書き換えない
+        changed_mesh_codes, _ = self._update()
+        self.assertEqual([], changed_mesh_codes)
+
+    def test_missing_output(self):
+        # 更新する成果物がまだ存在しない場合は、全体を書き出す
+        expected = self._read_output()
+        (self.output_path / "output.tif").unlink()
+        converter = Converter(
+            import_path=self.xml_dir,
+            output_path=self.output_path,
+            update=True,
+        )
+        with mock.patch.object(
+                converter,
+                "update_products",
+                wraps=converter.update_products) as update_products:
+            converter.dem_to_geotiff()
+        update_products.assert_not_called()
+        self.assertTrue((self._read_output() == expected).all())
+
+        # 書き出した成果物は、次回から更新できる
+        changed_mesh_codes, _ = self._update()
+        self.assertEqual([], changed_mesh_codes)
+
+    def test_geo_transform_mismatch(self):
+        self._write_xml(self.mesh_codes[2], seed=0)
+        with self.assertRaises(Exception):
+            self._update()
+
+
+class TestConverterResolution(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.xml_dir = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _write_xml(self, mesh_code, product, height, no_data_rows=0):
+        xml_path = self.xml_dir / f"FG-GML-{mesh_code}-{product}.xml"
+        xml_path.write_text(
+            _make_flat_xml(mesh_code, product, height, no_data_rows), encoding="utf-8")
+
+    def test_map_axis(self):
+        # 粗くする場合：メッシュのセルの中心が含まれる出力のセルに集約する（境界がピクセルの途中にある）
+        sources, targets = Converter._map_axis(0.25, 0.4, 5)
+        self.assertEqual([0, 1, 2, 3, 4], sources.tolist())
+        self.assertEqual([0, 0, 1, 1, 2], targets.tolist())
+
+        # 細かくする場合：出力のセルの中心が含まれるメッシュのセルを複製する
+        sources, targets = Converter._map_axis(0.5, 2.5, 2)
+        self.assertEqual([0, 0, 0, 1, 1], sources.tolist())
+        self.assertEqual([0, 1, 2, 3, 4], targets.tolist())
+
+    def test_seam(self):
+        # 3次メッシュの幅（45秒）は0.4秒の整数倍ではないため、境界の列は両方のメッシュのセルを平均する
+        mesh_codes = make_mesh_codes("DEM5A", 2)
+        self._write_xml(mesh_codes[0], "DEM5A", 100)
+        self._write_xml(mesh_codes[1], "DEM5A", 200)
+
+        np_array, _, _ = Converter(import_path=self.xml_dir, resolution="0.4").to_array()
+        self.assertEqual([100, 150, 200], np.unique(np_array[np_array != -9999]).tolist())
+
+    def test_straddle_edges(self):
+        # 境界がピクセルの途中にある場合のみ、隣のメッシュとセルを共有する
+        self.assertEqual((True, True), Converter._straddle_edges(0.25, 0.4, 5))
+        self.assertEqual((False, False), Converter._straddle_edges(1.0, 0.5, 4))
+        self.assertEqual((False, False), Converter._straddle_edges(0.5, 2.5, 2))
+
+    def test_seam_corner(self):
+        # 2×2のメッシュの境界の行・列・角を配列でまとめて合計した結果が、セル毎に合計した結果と一致する
+        mesh_codes = make_mesh_codes("DEM5A", 12)
+        for index, height in ((0, 100), (1, 200), (10, 300), (11, 400)):
+            self._write_xml(mesh_codes[index], "DEM5A", height)
+
+        resample_mesh = Converter._resample_mesh
+        with mock.patch.object(
+                Converter, "_resample_mesh", autospec=True,
+                side_effect=resample_mesh) as mock_resample_mesh:
+            np_array, _, _ = Converter(import_path=self.xml_dir, resolution="0.7").to_array()
+        with mock.patch.object(
+                Converter, "_merge_seam_cells",
+                side_effect=lambda *args: Converter._merge_small_mesh_cells(*args[:-1])):
+            expected, _, _ = Converter(import_path=self.xml_dir, resolution="0.7").to_array()
+        np.testing.assert_array_equal(expected, np_array)
+
+        # 内側の境界は全てのメッシュを合計した時点で取り除かれ、画像の外周の境界のみ残る
+        y_length, x_length = np_array.shape
+        seam_cells = mock_resample_mesh.call_args[0][3]
+        for key in seam_cells:
+            if key[1] == "row":
+                self.assertIn(key[2], (0, y_length - 1))
+            elif key[1] == "column":
+                self.assertIn(key[2], (0, x_length - 1))
+            else:
+                self.assertTrue(key[1] in (0, y_length - 1) or key[2] in (0, x_length - 1))
+
+    def test_seam_aligned(self):
+        # 3次メッシュの幅（45秒×30秒）が1.5秒の整数倍の場合は、境界のセルを合計しない
+        mesh_codes = make_mesh_codes("DEM5A", 12)
+        for index, height in ((0, 100), (1, 200), (10, 300), (11, 400)):
+            self._write_xml(mesh_codes[index], "DEM5A", height)
+
+        with mock.patch.object(Converter, "_merge_seam_cells") as merge_seam_cells:
+            np_array, _, _ = Converter(import_path=self.xml_dir, resolution="1.5").to_array()
+        merge_seam_cells.assert_not_called()
+        self.assertEqual([100, 200, 300, 400], np.unique(np_array).tolist())
+
+    def test_priority(self):
+        # 細かい3次メッシュの値を優先し、データなしの部分のみ粗い2次メッシュの値で埋める
+        self._write_xml(make_mesh_codes("DEM10B", 1)[0], "DEM10B", 50)
+        self._write_xml(make_mesh_codes("DEM5A", 1)[0], "DEM5A", 100, no_data_rows=10)
+
+        converter = Converter(import_path=self.xml_dir, resolution="finest")
+        np_array, _, _ = converter.to_array()
+        self.assertEqual([50, 100], np.unique(np_array).tolist())
+        # 3次メッシュ（225×150）のうち、データなしの10行を除いた部分のみ3次メッシュの値になる
+        self.assertEqual(225 * 140, np.count_nonzero(np_array == 100))
+
+        # GDALのデータセットに書き込む場合（merge_block）も同じ結果になる
+        dst_ds = converter.to_dataset()
+        self.assertTrue((dst_ds.GetRasterBand(1).ReadAsArray() == np_array).all())
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,7 +1,33 @@
+import tempfile
+import tracemalloc
 import unittest
+import zipfile
+from concurrent.futures import Future
 from pathlib import Path
+from unittest import mock
 
+import numpy as np
+
+from benchmarks.fgd_synthetic import PRODUCTS, make_mesh_codes, make_xml, write_zip
 from convert_fgd_dem import Dem
+from convert_fgd_dem.dem import TupleListDecoder, ZipMember
+
+
+class _SyncExecutor:
+    """投入された処理をその場で実行し、投入された引数を記録するプロセスプールの代わり"""
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.submitted = []
+
+    def submit(self, func, *args):
+        self.submitted.append(args)
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+    def shutdown(self, cancel_futures=False):
+        pass
 
 
 class TestDem(unittest.TestCase):
@@ -19,6 +45,168 @@ class TestDem(unittest.TestCase):
         }
         self.assertEqual(bounds_latlng, dem_ins.bounds_latlng)
 
+    def test_decode_tuple_list(self):
+        # 行の途中で区切られた文字データも、つなげてから変換する
+        decoder = TupleListDecoder(3)
+        for text in ("地表面,354", ".15\n地表面,-9999.\n海", "水面,0.00\n"):
+            decoder.feed(text)
+        items = decoder.close()
+        self.assertEqual(np.float32, items.dtype)
+        self.assertEqual([354.15, -9999.0, 0.0], items.astype(float).round(2).tolist())
+
+    def test_decode_tuple_list_overflow(self):
+        # グリッドのセル数を超えた分は切り捨てる
+        decoder = TupleListDecoder(2)
+        decoder.feed("地表面,1.00\n地表面,2.00\n地表面,3.00")
+        self.assertEqual([1.0, 2.0], decoder.close().tolist())
+        self.assertEqual(3, decoder.count)
+
+    def test_decode_tuple_list_malformed(self):
+        # 解釈できない値を含む場合は、途中までの配列を返さずにエラーとする
+        decoder = TupleListDecoder(3)
+        with self.assertRaises(Exception):
+            decoder.feed("地表面,354.15\n地表面,abc\n地表面,1.00\n")
+
+    def test_get_xml_content_memory(self):
+        # 標高値の文字列全体やfloat64の配列を作らず、グリッドの大きさに比例したメモリのみを使う
+        x_length, y_length = PRODUCTS["DEM10B"]["grid"]
+        mesh_code = make_mesh_codes("DEM10B", 1)[0]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            xml_path = Path(temp_dir) / f"FG-GML-{mesh_code}-DEM10B.xml"
+            xml_path.write_text(make_xml(mesh_code, "DEM10B"), encoding="utf-8")
+
+            tracemalloc.start()
+            try:
+                mesh_data = Dem._load_xml_content(xml_path)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        array_bytes = x_length * y_length * np.dtype(np.float32).itemsize
+        self.assertEqual((y_length, x_length), mesh_data.np_array.shape)
+        # 読み込み途中の配列と結果の配列の2つ分に、読み込む単位の分の余裕を持たせた上限
+        self.assertLess(peak, array_bytes * 2 + 4 * 1024 * 1024)
+
+
+class TestDemSynthetic(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.zip_dir = Path(self.temp_dir.name) / "zip"
+        self.zip_dir.mkdir()
+        self.zip_path = self.zip_dir / "FG-GML-6441-00-DEM5A.zip"
+        self.mesh_codes = write_zip(self.zip_path, "DEM5A", 6)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_zip_members(self):
+        # macOSのゴミファイルは取り込まず、zip内のxmlを解凍せずに読み込む
+        with zipfile.ZipFile(self.zip_path, "a") as zip_data:
+            zip_data.writestr("__MACOSX/._FG-GML-6441-00-00-DEM5A-20200101.xml", "")
+        xml_paths = Dem.list_xml_paths(self.zip_path)
+        self.assertEqual(len(self.mesh_codes), len(xml_paths))
+        self.assertTrue(all(isinstance(xml_path, ZipMember) for xml_path in xml_paths))
+
+        with mock.patch.object(zipfile.ZipFile, "extract", side_effect=AssertionError), \
+                mock.patch.object(zipfile.ZipFile, "extractall", side_effect=AssertionError):
+            zip_meshes = Dem(self.zip_path).mesh_data_list
+        self.assertEqual([self.zip_path], list(self.zip_dir.iterdir()))
+
+        # 解凍したxmlのディレクトリから読み込んだ場合と一致する
+        xml_dir = Path(self.temp_dir.name) / "xml"
+        with zipfile.ZipFile(self.zip_path) as zip_data:
+            zip_data.extractall(xml_dir)
+        xml_meshes = Dem(xml_dir).mesh_data_list
+        self.assertEqual(
+            [mesh_data.mesh_code for mesh_data in xml_meshes],
+            [mesh_data.mesh_code for mesh_data in zip_meshes])
+        for xml_mesh, zip_mesh in zip(xml_meshes, zip_meshes):
+            np.testing.assert_array_equal(xml_mesh.np_array, zip_mesh.np_array)
+
+    def test_workers(self):
+        # プロセスプールで並列に読み込んでも、1プロセスで読み込んだ場合と同じ順番・内容になる
+        expected = Dem(self.zip_path, workers=1).mesh_data_list
+        mesh_data_list = Dem(self.zip_path, workers=3).mesh_data_list
+        self.assertEqual(
+            [mesh_data.mesh_code for mesh_data in expected],
+            [mesh_data.mesh_code for mesh_data in mesh_data_list])
+        for expected_mesh, mesh_data in zip(expected, mesh_data_list):
+            np.testing.assert_array_equal(expected_mesh.np_array, mesh_data.np_array)
+
+        with self.assertRaises(Exception):
+            Dem(self.zip_path, workers=0)
+
+    def test_mesh_data(self):
+        # 標高値はxmlの値をfloat32の配列に、メタデータは数値に整形して保持する
+        mesh_data = Dem(self.zip_path).get_mesh_data(self.mesh_codes[1])
+        xml_text = make_xml(self.mesh_codes[1], "DEM5A", seed=1)
+        tuple_list = xml_text.split("<gml:tupleList>\n")[1].split("</gml:tupleList>")[0]
+        x_length, y_length = PRODUCTS["DEM5A"]["grid"]
+        expected = np.array(
+            [line.split(",")[1] for line in tuple_list.splitlines()],
+            dtype=np.float32).reshape(y_length, x_length)
+
+        self.assertEqual(self.mesh_codes[1], mesh_data.mesh_code)
+        self.assertEqual({"x": x_length, "y": y_length}, mesh_data.grid_length)
+        self.assertEqual({"x": 0, "y": 0}, mesh_data.start_point)
+        self.assertEqual(np.float32, mesh_data.np_array.dtype)
+        np.testing.assert_array_equal(expected, mesh_data.np_array)
+
+    def test_iter_mesh_data_not_retained(self):
+        # 1つずつ返したメッシュは、Demに保持されない
+        dem = Dem(self.zip_path)
+        mesh_codes = [mesh_data.mesh_code for mesh_data in dem.iter_mesh_data()]
+        self.assertEqual(sorted(self.mesh_codes), mesh_codes)
+        self.assertEqual({}, dem._loaded_mesh_data)
+
+    def test_lazy_loading(self):
+        # 初期化・get_infoではヘッダーのみを読み込み、標高値は参照されたメッシュのみを一度だけデコードする
+        with mock.patch.object(
+                Dem, "_load_xml_content", wraps=Dem._load_xml_content) as load_xml_content:
+            dem = Dem(self.zip_path)
+            info = dem.get_info()
+            load_xml_content.assert_not_called()
+            self.assertEqual(len(self.mesh_codes), info["mesh_count"])
+
+            dem.get_mesh_data(self.mesh_codes[2])
+            dem.get_mesh_data(self.mesh_codes[2])
+            self.assertEqual(1, load_xml_content.call_count)
+
+        dem = Dem(self.zip_path, mesh_codes=self.mesh_codes[:2])
+        self.assertEqual(self.mesh_codes[:2], sorted(dem.mesh_code_list))
+
+    def test_streaming(self):
+        # 1プロセスの場合は、取り出されたメッシュの分だけxmlを解析する
+        with mock.patch.object(
+                Dem, "_load_xml_content", wraps=Dem._load_xml_content) as load_xml_content:
+            mesh_iter = Dem(self.zip_path).iter_mesh_data()
+            next(mesh_iter)
+            self.assertEqual(1, load_xml_content.call_count)
+            next(mesh_iter)
+            self.assertEqual(2, load_xml_content.call_count)
+            mesh_iter.close()
+
+    def test_bounded_prefetch(self):
+        # 先読みはワーカー数の2倍までに抑え、取り出した分だけ次のメッシュを投入する
+        executors = []
+
+        def make_executor(max_workers):
+            executors.append(_SyncExecutor(max_workers))
+            return executors[-1]
+
+        with mock.patch("convert_fgd_dem.dem.ProcessPoolExecutor", side_effect=make_executor):
+            mesh_iter = Dem(self.zip_path, workers=2).iter_mesh_data()
+            mesh_data_list = [next(mesh_iter)]
+            self.assertEqual(4, len(executors[0].submitted))
+            mesh_data_list.append(next(mesh_iter))
+            self.assertEqual(5, len(executors[0].submitted))
+            mesh_data_list.extend(mesh_iter)
+
+        self.assertEqual(1, len(executors))
+        self.assertEqual(len(self.mesh_codes), len(executors[0].submitted))
+        self.assertEqual(
+            sorted(self.mesh_codes), [mesh_data.mesh_code for mesh_data in mesh_data_list])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+from convert_fgd_dem.helpers import (
+    average_to_grid,
+    convert_height_to_B,
+    convert_height_to_G,
+    convert_height_to_R,
+    convert_height_to_rgb,
+    iter_rgb_blocks,
+)
+
+
+class TestHelpers(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.height_array = rng.uniform(-100, 4000, (300, 225)).astype(np.float32)
+        self.height_array[rng.random(self.height_array.shape) < 0.1] = -9999
+        self.height_array[0, :8] = [0, -0.05, 0.05, -0.1, 12.35, -12.35, 3776.24, -9999]
+
+    def test_convert_height_to_rgb(self):
+        func_R = np.frompyfunc(convert_height_to_R, 1, 1)
+        func_G = np.frompyfunc(convert_height_to_G, 2, 1)
+        func_B = np.frompyfunc(convert_height_to_B, 3, 1)
+        r_arr = func_R(self.height_array)
+        g_arr = func_G(self.height_array, r_arr)
+        b_arr = func_B(self.height_array, r_arr, g_arr)
+        expected = np.array([r_arr, g_arr, b_arr]).astype(np.uint8)
+
+        rgb_array = convert_height_to_rgb(self.height_array)
+        self.assertEqual(np.uint8, rgb_array.dtype)
+        np.testing.assert_array_equal(expected, rgb_array)
+
+    def test_iter_rgb_blocks(self):
+        expected = convert_height_to_rgb(self.height_array)
+        blocks = list(iter_rgb_blocks(self.height_array, block_rows=64))
+        self.assertEqual([0, 64, 128, 192, 256], [row for row, _ in blocks])
+        np.testing.assert_array_equal(
+            expected, np.concatenate([block for _, block in blocks], axis=1))
+
+    def test_average_to_grid(self):
+        np_array = np.array(
+            [
+                [1, 3, 5, -9999],
+                [5, 7, -9999, -9999],
+                [2, 2, 2, 2],
+            ],
+            dtype=np.float32,
+        )
+        averaged = average_to_grid(
+            np_array, np.array([0, 0, 1]), np.array([0, 0, 1, 1]))
+        expected = np.array([[4, 5], [2, 2]], dtype=np.float32)
+        np.testing.assert_array_equal(expected, averaged)
+
+        all_no_data = np.full((2, 2), -9999, dtype=np.float32)
+        averaged = average_to_grid(all_no_data, np.array([0, 0]), np.array([0, 0]))
+        np.testing.assert_array_equal([[-9999]], averaged)
+
+
+if __name__ == "__main__":
+    unittest.main()
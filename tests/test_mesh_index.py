@@ -0,0 +1,84 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from convert_fgd_dem.mesh_index import MeshIndex
+
+XML_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<Dataset xmlns="http://fgd.gsi.go.jp/spec/2008/FGD_GMLSchema"
+ xmlns:gml="http://www.opengis.net/gml/3.2">
+<DEM>
+<mesh>{mesh_code}</mesh>
+<coverage>
+<gml:boundedBy><gml:Envelope>
+<gml:lowerCorner>{lower_lat} {lower_lon}</gml:lowerCorner>
+<gml:upperCorner>{upper_lat} {upper_lon}</gml:upperCorner>
+</gml:Envelope></gml:boundedBy>
+<gml:gridDomain><gml:Grid><gml:limits><gml:GridEnvelope>
+<gml:low>0 0</gml:low>
+<gml:high>1 1</gml:high>
+</gml:GridEnvelope></gml:limits></gml:Grid></gml:gridDomain>
+<gml:rangeSet><gml:DataBlock>
+<gml:tupleList>
+地表面,1.00
+地表面,2.00
+地表面,3.00
+地表面,4.00
+</gml:tupleList>
+</gml:DataBlock></gml:rangeSet>
+<gml:coverageFunction><gml:GridFunction>
+<gml:startPoint>0 0</gml:startPoint>
+</gml:GridFunction></gml:coverageFunction>
+</coverage>
+</DEM>
+</Dataset>
+"""
+
+
+class TestMeshIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.xml_paths = []
+        for mesh_code, lower_lon in ((64413200, 141.25), (64413201, 141.2625)):
+            xml_path = Path(self.temp_dir.name) / f"{mesh_code}.xml"
+            xml_path.write_text(
+                XML_TEMPLATE.format(
+                    mesh_code=mesh_code,
+                    lower_lat=42.916666667,
+                    lower_lon=lower_lon,
+                    upper_lat=42.925,
+                    upper_lon=lower_lon + 0.0125,
+                ),
+                encoding="utf-8",
+            )
+            self.xml_paths.append(xml_path)
+        self.mesh_index = MeshIndex(self.xml_paths)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_scan_xml_header(self):
+        entry = MeshIndex.scan_xml_header(self.xml_paths[0])
+        self.assertEqual(64413200, entry.mesh_code)
+        self.assertEqual({"lat": 42.916666667, "lon": 141.25}, entry.lower_corner)
+        self.assertEqual({"lat": 42.925, "lon": 141.2625}, entry.upper_corner)
+        self.assertEqual({"x": 2, "y": 2}, entry.grid_length)
+
+    def test_query_bbox(self):
+        entries = self.mesh_index.query(bbox=(141.26, 42.92, 141.265, 42.93))
+        self.assertEqual([64413200, 64413201], [entry.mesh_code for entry in entries])
+
+        entries = self.mesh_index.query(bbox=(141.2630, 42.92, 141.265, 42.93))
+        self.assertEqual([64413201], [entry.mesh_code for entry in entries])
+
+        # 辺が接するだけのメッシュは含まない
+        entries = self.mesh_index.query(bbox=(141.2625, 42.92, 141.265, 42.93))
+        self.assertEqual([64413201], [entry.mesh_code for entry in entries])
+
+    def test_query_mesh_codes(self):
+        entries = self.mesh_index.query(mesh_codes=[64413201])
+        self.assertEqual([self.xml_paths[1]], [entry.xml_path for entry in entries])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+from convert_fgd_dem.profiler import NullProfiler, Profiler
+
+
+class TestProfiler(unittest.TestCase):
+    def test_stage(self):
+        received = []
+        profiler = Profiler(callbacks=[received.append])
+        with profiler.stage("parse_xml", cells=10):
+            pass
+        with profiler.stage("parse_xml") as record:
+            record["cells"] = 5
+
+        self.assertEqual(2, len(received))
+        self.assertEqual(received, profiler.records)
+        for key in ("wall_seconds", "cpu_seconds", "max_rss_mb", "read_bytes", "write_bytes"):
+            self.assertIn(key, received[0])
+
+        summary = profiler.summarize()
+        self.assertEqual(1, len(summary))
+        self.assertEqual(2, summary[0]["count"])
+        self.assertEqual(15, summary[0]["cells"])
+
+    def test_stage_with_exception(self):
+        profiler = Profiler()
+        with self.assertRaises(ValueError):
+            with profiler.stage("write"):
+                raise ValueError()
+        self.assertEqual(["write"], [record["stage"] for record in profiler.records])
+
+    def test_without_records(self):
+        # 集計しない場合は記録を保持せず、コールバックへの通知のみ行う
+        received = []
+        profiler = Profiler(callbacks=[received.append], keep_records=False)
+        with profiler.stage("write"):
+            pass
+        self.assertEqual(["write"], [record["stage"] for record in received])
+        self.assertEqual([], profiler.records)
+
+    def test_null_profiler(self):
+        profiler = NullProfiler()
+        with profiler.stage("parse_xml", cells=10) as record:
+            record["cells"] = 5
+        self.assertNotIn("wall_seconds", record)
+        self.assertEqual([], profiler.summarize())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+from benchmarks.fgd_synthetic import write_zip
+from convert_fgd_dem.cache import MemoryMeshCache
+from convert_fgd_dem.dem import Dem, MeshData
+from convert_fgd_dem.server import ConvertServer
+
+
+async def _request(port, raw_request):
+    """ローカルホストのサーバーにリクエストを送り、ステータス行とボディを返す"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(raw_request)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    if response.startswith(b"HTTP/1.1 100"):
+        response = response.split(b"\r\n\r\n", 1)[1]
+    head, _, body = response.partition(b"\r\n\r\n")
+    if b"Transfer-Encoding: chunked" in head:
+        chunks = []
+        while True:
+            size, _, body = body.partition(b"\r\n")
+            size = int(size, 16)
+            if size == 0:
+                break
+            chunks.append(body[:size])
+            body = body[size + 2:]
+        body = b"".join(chunks)
+    return head.split(b"\r\n")[0].decode("latin-1"), body
+
+
+class TestConvertServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.convert_server = ConvertServer(max_concurrency=1)
+        server = await self.convert_server.start("127.0.0.1", 0)
+        self.port = server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        await self.convert_server.close()
+
+    async def test_health(self):
+        status, body = await _request(self.port, b"GET /health HTTP/1.1\r\n\r\n")
+        self.assertEqual(status, "HTTP/1.1 200 OK")
+        self.assertEqual(json.loads(body)["status"], "ok")
+
+    async def test_errors(self):
+        for raw_request, expected_status in [
+            (b"GET /unknown HTTP/1.1\r\n\r\n", 404),
+            (b"GET /convert?format=png HTTP/1.1\r\n\r\n", 400),
+            (b"GET /convert?bbox=a,b HTTP/1.1\r\n\r\n", 400),
+            # archive_dirが設定されていない
+            (b"GET /convert?bbox=141,43,142,44 HTTP/1.1\r\n\r\n", 404),
+            (b"POST /convert HTTP/1.1\r\n\r\n", 411),
+            (b"PUT /convert HTTP/1.1\r\n\r\n", 405),
+        ]:
+            status, _ = await _request(self.port, raw_request)
+            self.assertEqual(status.split(" ")[1], str(expected_status))
+
+    async def test_post_zip(self):
+        zip_bytes = Path("./target_files/FG-GML-6441-32-DEM5A.zip").read_bytes()
+        status, body = await _request(
+            self.port,
+            b"POST /convert?format=terrain-rgb HTTP/1.1\r\n"
+            b"Content-Length: %d\r\n\r\n" % len(zip_bytes) + zip_bytes)
+        self.assertEqual(status, "HTTP/1.1 200 OK")
+        self.assertIn(body[:4], (b"II*\x00", b"MM\x00*"))
+        # デコードしたメッシュはリクエスト間で再利用できるよう保持する
+        self.assertGreater(len(self.convert_server.cache), 0)
+
+
+class TestConvertServerArchive(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.archive_dir = Path(self.temp_dir.name)
+        self.mesh_codes = write_zip(self.archive_dir / "dem5a.zip", mesh_count=2)
+        self.convert_server = ConvertServer(archive_dir=self.archive_dir, max_concurrency=2)
+        server = await self.convert_server.start("127.0.0.1", 0)
+        self.port = server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        await self.convert_server.close()
+        self.temp_dir.cleanup()
+
+    async def test_find_archives(self):
+        # 索引は起動時に作成し、該当するメッシュを含むzipのみを返す
+        self.assertEqual(1, len(self.convert_server.archive_entries))
+        self.assertEqual(
+            [self.archive_dir / "dem5a.zip"],
+            self.convert_server._find_archives(mesh_codes=self.mesh_codes[:1]))
+        self.assertEqual([], self.convert_server._find_archives(mesh_codes=[1]))
+
+        # 追加されたzipは、次のリクエストで索引に追加する
+        dem10b_codes = write_zip(self.archive_dir / "dem10b.zip", product="DEM10B", mesh_count=1)
+        self.assertEqual(
+            [self.archive_dir / "dem10b.zip"],
+            self.convert_server._find_archives(mesh_codes=dem10b_codes))
+
+        status, _ = await _request(
+            self.port, b"GET /convert?mesh_codes=1 HTTP/1.1\r\n\r\n")
+        self.assertEqual(status, "HTTP/1.1 404 Not Found")
+
+    async def test_semaphore(self):
+        # スレッドプールに空きがあっても、同時に変換する数はmax_concurrencyまでに制限する
+        self.convert_server.executor = ThreadPoolExecutor(max_workers=4)
+        lock = threading.Lock()
+        running = []
+        max_running = []
+
+        def convert_sync(*args):
+            with lock:
+                running.append(None)
+                max_running.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+            return "/vsimem/dummy.tif"
+
+        with mock.patch.object(self.convert_server, "_convert_sync", convert_sync):
+            await asyncio.gather(*[
+                self.convert_server._convert(self.archive_dir, {}, False, "EPSG:4326")
+                for _ in range(6)
+            ])
+        self.assertEqual(2, max(max_running))
+
+    async def test_cache_reused(self):
+        raw_request = b"GET /convert?mesh_codes=%d,%d HTTP/1.1\r\n\r\n" % tuple(self.mesh_codes)
+        with mock.patch.object(
+                Dem, "_load_xml_content", wraps=Dem._load_xml_content) as load_xml_content:
+            status, _ = await _request(self.port, raw_request)
+            self.assertEqual(status, "HTTP/1.1 200 OK")
+            self.assertEqual(2, load_xml_content.call_count)
+
+            # 2回目のリクエストでは、キャッシュしたメッシュを再利用してxmlを解析しない
+            status, _ = await _request(self.port, raw_request)
+            self.assertEqual(status, "HTTP/1.1 200 OK")
+            self.assertEqual(2, load_xml_content.call_count)
+
+
+class TestMemoryMeshCache(unittest.TestCase):
+    def _make_mesh_data(self, mesh_code):
+        return MeshData(
+            mesh_code=mesh_code,
+            lower_corner={"lat": 0.0, "lon": 0.0},
+            upper_corner={"lat": 1.0, "lon": 1.0},
+            grid_length={"x": 512, "y": 512},
+            start_point={"x": 0, "y": 0},
+            pixel_size={"x": 1 / 512, "y": -1 / 512},
+            np_array=np.zeros((512, 512), np.float32))
+
+    def test_evict(self):
+        # 1メッシュ1MBのため、上限2MBで3つ目を保存すると最後に利用されたのが最も古いものを破棄する
+        cache = MemoryMeshCache(max_size=2)
+        cache.put("a", self._make_mesh_data(1))
+        cache.put("b", self._make_mesh_data(2))
+        self.assertIsNotNone(cache.get("a"))
+        cache.put("c", self._make_mesh_data(3))
+
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertFalse(cache.get("a").np_array.flags.writeable)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import json
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from tests.test_mesh_index import XML_TEMPLATE
+
+# 起動時に読み込まれてはいけないモジュール
+HEAVY_MODULES = ("osgeo", "numpy")
+# 「--help」の実行で、インタプリタの起動後に読み込まれるモジュール数の上限
+# 処理時間は環境によって大きく変わるため、読み込むモジュール数で起動の重さを検証する
+# （内訳は「python -X importtime -m convert_fgd_dem --help」で確認できる）
+MAX_HELP_MODULES = 200
+
+# mainを実行した後、読み込まれた重いモジュールと、新たに読み込まれたモジュール数を標準エラー出力にJSONで書き出す
+RUN_MAIN = """
+import json, sys
+baseline_modules = set(sys.modules)
+from convert_fgd_dem.__main__ import main
+try:
+    main(sys.argv[1:])
+except SystemExit:
+    pass
+heavy_modules = [name for name in {heavy_modules!r} if name in sys.modules]
+module_count = len(set(sys.modules) - baseline_modules)
+sys.stderr.write(json.dumps({{"heavy_modules": heavy_modules, "module_count": module_count}}))
+"""
+
+
+def _run(code, *args):
+    """Pythonのコードを別プロセスで実行し、標準出力・標準エラー出力を返す"""
+    completed = subprocess.run(
+        [sys.executable, "-c", code, *args],
+        cwd=Path(__file__).parent.parent,
+        capture_output=True,
+        text=True,
+        check=True)
+    return completed.stdout, completed.stderr
+
+
+class TestStartup(unittest.TestCase):
+    def _run_main(self, *args):
+        stdout, stderr = _run(
+            RUN_MAIN.format(heavy_modules=HEAVY_MODULES), *args)
+        loaded = json.loads(stderr)
+        return stdout, loaded["heavy_modules"], loaded["module_count"]
+
+    def test_help(self):
+        stdout, heavy_modules, module_count = self._run_main("--help")
+        self.assertIn("--import_path", stdout)
+        self.assertEqual(heavy_modules, [])
+        self.assertLessEqual(module_count, MAX_HELP_MODULES)
+
+    def test_info(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            xml_path = Path(temp_dir) / "a.xml"
+            xml_path.write_text(
+                XML_TEMPLATE.format(
+                    mesh_code=53394600,
+                    lower_lat=35.6, lower_lon=139.75,
+                    upper_lat=35.608333333, upper_lon=139.7625),
+                encoding="utf-8")
+
+            stdout, heavy_modules, _ = self._run_main(
+                "--import_path", str(xml_path), "--info", "True")
+
+        info = json.loads(stdout)
+        self.assertEqual(info["mesh_count"], 1)
+        self.assertEqual(info["meshes"][0]["mesh_code"], 53394600)
+        self.assertEqual(heavy_modules, [])
+
+    def test_lazy_attribute(self):
+        import convert_fgd_dem
+
+        self.assertIn("Converter", dir(convert_fgd_dem))
+        with self.assertRaises(AttributeError):
+            convert_fgd_dem.NotExisting
+
+
+if __name__ == "__main__":
+    unittest.main()
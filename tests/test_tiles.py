@@ -0,0 +1,66 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+from convert_fgd_dem import tiles
+from convert_fgd_dem.tiles import (
+    TILE_SIZE,
+    build_parent_tiles,
+    get_tile_bounds,
+    get_tile_range,
+    lonlat_to_tile,
+)
+
+
+class TestTiles(unittest.TestCase):
+    def test_lonlat_to_tile(self):
+        self.assertEqual(lonlat_to_tile(0, 0, 0), (0, 0))
+        self.assertEqual(lonlat_to_tile(140.0, 35.2, 10), (910, 404))
+        # 範囲外の緯度経度はタイルの範囲に収める
+        self.assertEqual(lonlat_to_tile(180, -89, 2), (3, 3))
+
+    def test_get_tile_bounds(self):
+        min_x, min_y, max_x, max_y = get_tile_bounds(0, 0, 1)
+        self.assertAlmostEqual(min_x, -tiles.HALF_CIRCUMFERENCE)
+        self.assertAlmostEqual(min_y, 0)
+        self.assertAlmostEqual(max_x, 0)
+        self.assertAlmostEqual(max_y, tiles.HALF_CIRCUMFERENCE)
+
+    def test_get_tile_range(self):
+        bounds_latlng = {
+            "lower_left": {"lat": 35.0, "lon": 140.0},
+            "upper_right": {"lat": 35.2, "lon": 140.3},
+        }
+        self.assertEqual(
+            get_tile_range(bounds_latlng, 10),
+            [(910, 404), (910, 405), (911, 404), (911, 405)])
+
+    def test_build_parent_tiles(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            scratch_dir = Path(temp_dir)
+            child = np.full((TILE_SIZE, TILE_SIZE), -9999, dtype=np.float32)
+            child[:2, :2] = [[1, 2], [3, -9999]]
+            np.save(scratch_dir / "11-2-4.npy", child)
+
+            with mock.patch.object(tiles, "write_tile_image") as write_tile_image:
+                written_tiles = build_parent_tiles(
+                    [(1, 2), (1, 3)], 10, scratch_dir / "tiles", scratch_dir)
+
+            # 子タイルが存在しない・全てnodataのタイルは書き出さない
+            self.assertEqual(written_tiles, [(1, 2)])
+            self.assertEqual(write_tile_image.call_count, 1)
+            heights = write_tile_image.call_args[0][0]
+            self.assertEqual(heights.shape, (TILE_SIZE, TILE_SIZE))
+            # nodataを除いて平均する
+            self.assertEqual(heights[0, 0], 2)
+            self.assertEqual(heights[0, 1], -9999)
+            # 読み込んだ子タイルの一時ファイルは削除し、作成したタイルの一時ファイルを残す
+            self.assertFalse((scratch_dir / "11-2-4.npy").exists())
+            self.assertTrue((scratch_dir / "10-1-2.npy").exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
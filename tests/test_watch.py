@@ -0,0 +1,117 @@
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+from convert_fgd_dem import watch
+from convert_fgd_dem.watch import SpoolWatcher, run_watch
+
+
+def _write_zip(zip_path):
+    with zipfile.ZipFile(zip_path, "w") as zip_file:
+        zip_file.writestr(f"{zip_path.stem}.xml", "<Dataset/>")
+
+
+class TestSpoolWatcher(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.watch_dir = Path(self.temp_dir.name)
+        self.watcher = SpoolWatcher(self.watch_dir, settle_seconds=2.0)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_poll(self):
+        zip_path = self.watch_dir / "a.zip"
+        _write_zip(zip_path)
+
+        # サイズと更新日時がsettle_seconds以上変わらないものだけを返す
+        self.assertEqual(self.watcher.poll(now=0.0), [])
+        self.assertEqual(self.watcher.poll(now=1.0), [])
+        self.assertEqual(self.watcher.poll(now=2.0), [zip_path])
+        # 一度返したものは、内容が変わらない限り再度返さない
+        self.assertEqual(self.watcher.poll(now=10.0), [])
+
+    def test_poll_partial_zip(self):
+        # 書き込み途中（zipとして読み込めない）のものは返さない
+        zip_path = self.watch_dir / "b.zip"
+        zip_path.write_bytes(b"PK\x03\x04partial")
+        self.watcher.poll(now=0.0)
+        self.assertEqual(self.watcher.poll(now=5.0), [])
+
+    def test_poll_limit(self):
+        zip_paths = [self.watch_dir / f"{name}.zip" for name in ("a", "b", "c")]
+        for zip_path in zip_paths:
+            _write_zip(zip_path)
+
+        # 上限を超えた分は、次回以降の確認で返す
+        self.watcher.poll(now=0.0)
+        self.assertEqual(self.watcher.poll(now=2.0, limit=2), zip_paths[:2])
+        self.assertEqual(self.watcher.poll(now=2.0, limit=2), zip_paths[2:])
+        self.assertEqual(self.watcher.poll(now=3.0), [])
+
+
+class TestRunWatch(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.watch_dir = Path(self.temp_dir.name) / "spool"
+        self.output_path = Path(self.temp_dir.name) / "output"
+        self.watch_dir.mkdir()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_run_watch(self):
+        for name in ("a", "b", "c", "d", "e"):
+            _write_zip(self.watch_dir / f"{name}.zip")
+        # 出力先が存在するzipはスキップする
+        (self.output_path / "c").mkdir(parents=True)
+
+        lock = threading.Lock()
+        in_flight = []
+        max_in_flight = []
+        limits = []
+        poll = SpoolWatcher.poll
+
+        def poll_with_record(watcher, now=None, limit=None):
+            limits.append(limit)
+            return poll(watcher, now=now, limit=limit)
+
+        def convert(import_path, output_path, converter_options):
+            with lock:
+                in_flight.append(import_path)
+                max_in_flight.append(len(in_flight))
+            time.sleep(0.05)
+            with lock:
+                in_flight.remove(import_path)
+            import_path.unlink()
+            return 0.05
+
+        # プロセスプールの代わりにスレッドプールで、投入数の上限（max_pending）のみで同時実行数が決まるようにする
+        with mock.patch.object(watch, "ProcessPoolExecutor", ThreadPoolExecutor), \
+                mock.patch.object(watch, "_init_worker", lambda: None), \
+                mock.patch.object(watch, "_convert", convert), \
+                mock.patch.object(SpoolWatcher, "poll", poll_with_record):
+            results = run_watch(
+                self.watch_dir,
+                self.output_path,
+                jobs=4,
+                poll_interval=0.01,
+                settle_seconds=0.0,
+                max_pending=2,
+                max_polls=100)
+
+        statuses = {result["name"]: result["status"] for result in results}
+        self.assertEqual(
+            {"a": "done", "b": "done", "c": "skipped", "d": "done", "e": "done"}, statuses)
+        self.assertEqual(2, max(max_in_flight))
+        # 上限に達している間は確認せず、空きの数を超えて検出しない（待っているzipは監視するディレクトリに残る）
+        self.assertTrue(all(1 <= limit <= 2 for limit in limits))
+
+
+if __name__ == "__main__":
+    unittest.main()